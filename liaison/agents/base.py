@@ -16,6 +16,10 @@ StepOutput = collections.namedtuple('StepOutput',
                                     ['action', 'logits', 'next_state', 'graph_embeddings'])
 StepOutput.__new__.__defaults__ = (None, ) * len(StepOutput._fields)
 
+# global step after the update. Returned along with the logged values by
+# update so that the learner doesn't need a separate sess.run for it.
+GLOBAL_STEP_KEY = 'steps/global_step'
+
 
 class Agent(object):
   """The base Agent class.
@@ -81,8 +85,12 @@ class Agent(object):
 
     self._train_op = optimizer.apply_gradients(clipped_grads_and_vars,
                                                global_step=self.global_step)
+    with tf.control_dependencies([self._train_op]):
+      global_step = tf.identity(self.global_step)
 
     return {  # optimization related
+        GLOBAL_STEP_KEY:
+        global_step,
         'opt/pre_clipped_grad_norm':
         global_norm,
         'opt/clipped_grad_norm':
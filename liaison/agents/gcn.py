@@ -103,7 +103,7 @@ class Agent(BaseAgent):
       # flatten graph features for graph embeddings.
       with tf.variable_scope('flatten_graphs'):
         # merge time and batch dimensions
-        flattened_observations = nest.map_structure(merge_first_two_dims, observations)
+        flattened_observations = merge_time_and_batch_dims(observations)
         # flatten by merging the batch and node, edge dimensions
         flattened_observations['graph_features'] = self._process_graph_features(
             flattened_observations['graph_features'])
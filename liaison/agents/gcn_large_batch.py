@@ -5,6 +5,7 @@ import numpy as np  # set seed
 import six
 import tensorflow as tf  # set seed
 import tree as nest
+from liaison.agents.base import GLOBAL_STEP_KEY
 from liaison.agents.gcn import Agent as GCNAgent
 from liaison.agents.utils import *
 
@@ -17,6 +18,8 @@ class Agent(GCNAgent):
     # shadow assignments assign value of shadow to main variable
     self._shadow_assignments = None
     self._apply_grads_every = apply_grads_every
+    # global step fetched with the last update.
+    self._step = None
 
   def _create_shadow_vars(self, variables):
     assert self._shadow_vars is None
@@ -62,8 +65,12 @@ class Agent(GCNAgent):
 
     self._train_op = optimizer.apply_gradients(clipped_grads_and_vars,
                                                global_step=self.global_step)
+    with tf.control_dependencies([self._train_op]):
+      global_step = tf.identity(self.global_step)
 
     return {  # optimization related
+        GLOBAL_STEP_KEY:
+        global_step,
         'opt/pre_clipped_grad_norm':
         global_norm,
         'opt/clipped_grad_norm':
@@ -76,11 +83,15 @@ class Agent(GCNAgent):
 
   def update(self, sess, feed_dict, profile_kwargs):
     """profile_kwargs pass to sess.run for profiling purposes."""
-    step = self.global_step.eval(sess)
+    # the step fetched by the previous update. (read once after a restore)
+    step = self._step
+    if step is None:
+      step = sess.run(self.global_step)
     if step > 0 and step % self._apply_grads_every == 0:
       sess.run(self._shadow_assignments)
 
     _, vals = sess.run([self._train_op, self._logged_values],
                        feed_dict=feed_dict,
                        **profile_kwargs)
+    self._step = int(vals[GLOBAL_STEP_KEY])
     return vals
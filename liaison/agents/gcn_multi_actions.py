@@ -4,6 +4,7 @@ import graph_nets as gn
 import tensorflow as tf
 import tree as nest
 from liaison.agents import BaseAgent, StepOutput
+from liaison.agents.base import GLOBAL_STEP_KEY
 from liaison.agents.losses.vtrace import \
     MultiActionLoss as VTraceMultiActionLoss
 from liaison.agents.utils import *
@@ -25,6 +26,8 @@ class Agent(BaseAgent):
                                     trainable=False,
                                     collections=[tf.GraphKeys.LOCAL_VARIABLES],
                                     name='total_steps')
+    # global step fetched with the last update.
+    self._step = None
 
   def initial_state(self, bs):
     return self._model.get_initial_state(bs)
@@ -91,6 +94,11 @@ class Agent(BaseAgent):
       discounts: [T + 1, B] of discount values at each step.
     """
     self._validate_observations(observations)
+    # the time and batch dims of the graph features are indexed below
+    # (merge_first_two_dims and the bootstrap observation).
+    if is_packed_graphs(observations['graph_features']):
+      raise Exception('Packed graph features are not supported by this agent. '
+                      'Turn off actor.strip_graph_padding.')
     config = self.config
     behavior_logits = step_outputs.logits  # [T, B, T2, T1]
     actions = step_outputs.action  # [T, B, T2]
@@ -250,7 +258,10 @@ class Agent(BaseAgent):
   def update(self, sess, feed_dict, profile_kwargs):
     """profile_kwargs pass to sess.run for profiling purposes."""
     ops = []
-    i = sess.run(self._global_step)
+    # the step fetched by the previous update. (read once after a restore)
+    i = self._step
+    if i is None:
+      i = sess.run(self._global_step)
     log_features = False
     if self.config.log_features_every > 0:
       if i % self.config.log_features_every == 0:
@@ -262,6 +273,7 @@ class Agent(BaseAgent):
         feed_dict=feed_dict,
         **profile_kwargs)
 
+    self._step = int(mean_vals[GLOBAL_STEP_KEY])
     if log_features:
       self._log_features(l[0], i)
     return mean_vals, var_vals
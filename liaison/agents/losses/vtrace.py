@@ -4,6 +4,24 @@ from liaison.agents.utils import *
 from liaison.env import StepType
 from liaison.utils import ConfigDict
 
+# Key of the per-sample replay priorities in the logged values.
+# Popped by the learner before logging.
+PRIORITIES_KEY = 'replay/priorities'
+
+
+def per_sample_priorities(values, vs, valid_mask):
+  """Mean absolute value error over the valid steps of each sample.
+
+  Args:
+    values, vs: [T, B]
+    valid_mask: [T, B] boolean mask
+  Returns:
+    [B] tensor
+  """
+  valid_mask = tf.cast(valid_mask, tf.float32)
+  abs_err = tf.abs(values - vs) * valid_mask
+  return tf.reduce_sum(abs_err, 0) / tf.maximum(tf.reduce_sum(valid_mask, 0), 1.)
+
 
 class Loss:
 
@@ -100,6 +118,7 @@ class Loss:
         # rewards
         'reward/advantage': f(vtrace_returns.pg_advantages),
         'reward/vtrace_returns': f(vtrace_returns.vs),
+        PRIORITIES_KEY: per_sample_priorities(values, vtrace_returns.vs, valid_mask),
     }
     self.total_loss = total_loss
 
@@ -239,6 +258,7 @@ class MultiActionLoss(Loss):
         # rewards
         'reward/advantage': f(vtrace_returns.pg_advantages),
         'reward/vtrace_returns': f(vtrace_returns.vs),
+        PRIORITIES_KEY: per_sample_priorities(values, vtrace_returns.vs, valid_mask),
     }
 
     def f2(x):
@@ -7,6 +7,7 @@ import numpy as np
 import tensorflow as tf
 from absl import logging
 from liaison.agents import BaseAgent, StepOutput
+from liaison.agents.base import GLOBAL_STEP_KEY
 from liaison.agents.utils import *
 from liaison.env import StepType
 
@@ -94,8 +95,9 @@ class Agent(BaseAgent):
       return tf.reduce_sum(tf.boolean_mask(x, valid_mask)) / n_valid_steps
 
     self._logged_values = {
-        'steps/global_step':
-        global_step,
+        # value after the increment.
+        GLOBAL_STEP_KEY:
+        self._incr_op,
         **self._extract_logged_values(
             tf.nest.map_structure(lambda k: k[:-1], observations), f)
     }
@@ -1,5 +1,10 @@
 import graph_nets as gn
 import tensorflow as tf
+import tree as nest
+
+# Fields of GraphsTuple and BipartiteGraphsTuple that are concatenated across
+# the graphs (instead of padded to the max size) in packed graphs.
+PACKED_GRAPH_FIELDS = ('nodes', 'edges', 'senders', 'receivers', 'left_nodes', 'right_nodes')
 
 
 def sample_from_logits(logits, seed):
@@ -59,6 +64,45 @@ def merge_first_two_dims(tensor, validate=True):
   return tf.reshape(tensor, shape)
 
 
+def is_packed_graphs(graph_features):
+  """Whether the nodes and edges of the graphs are already concatenated.
+
+  The learner receives packed graphs if the actors strip the padding of
+  the graph observations. (see Trajectory.batch)
+  Args:
+    graph_features: dict or gn.graphs.GraphsTuple or BipartiteGraphsTuple.
+  """
+  if isinstance(graph_features, dict):
+    get = graph_features.get
+  else:
+    get = lambda k: getattr(graph_features, k, None)
+
+  if get('nodes') is not None:
+    nodes, n_node = get('nodes'), get('n_node')
+  else:
+    nodes, n_node = get('left_nodes'), get('n_left_nodes')
+  # padded nodes have a node dimension after the dimensions of the counts.
+  return nodes.shape.ndims - n_node.shape.ndims < 2
+
+
+def merge_time_and_batch_dims(observations):
+  """merge_first_two_dims of all the observations.
+
+  The concatenated fields of packed graph features have no time and batch
+  dimensions and are left as is.
+  """
+  observations = dict(observations)
+  graph_features = observations.pop('graph_features', None)
+  observations = nest.map_structure(merge_first_two_dims, observations)
+  if graph_features is not None:
+    packed = is_packed_graphs(graph_features)
+    observations['graph_features'] = {
+        k: v if packed and k in PACKED_GRAPH_FIELDS else nest.map_structure(
+            merge_first_two_dims, v) for k, v in graph_features.items()
+    }
+  return observations
+
+
 def get_decay_ops(init_val,
                   min_val,
                   start_decay_step,
@@ -119,6 +163,9 @@ def flatten_graphs(graph_features):
       graph_features.n_edge   => [B]
       graph_features.globals  => [B, ...]
   """
+  if is_packed_graphs(graph_features):
+    return gn.utils_tf.stop_gradient(graph_features)
+
   node_indices = gn.utils_tf.sparse_to_dense_indices(graph_features.n_node)
   edge_indices = gn.utils_tf.sparse_to_dense_indices(graph_features.n_edge)
 
@@ -165,12 +212,18 @@ def flatten_bipartite_graphs(graph_features):
       graph_features.n_edge   => [B]
       graph_features.globals  => [B, ...]
   """
-  left_indices = gn.utils_tf.sparse_to_dense_indices(graph_features.n_left_nodes)
-  right_indices = gn.utils_tf.sparse_to_dense_indices(graph_features.n_right_nodes)
-
   def f(graph, fields_to_stop):
     return graph.map(tf.stop_gradient, fields_to_stop)
 
+  if is_packed_graphs(graph_features):
+    fields_to_stop = ['left_nodes', 'right_nodes', 'globals']
+    if graph_features.edges is not None:
+      fields_to_stop.append('edges')
+    return f(graph_features, fields_to_stop)
+
+  left_indices = gn.utils_tf.sparse_to_dense_indices(graph_features.n_left_nodes)
+  right_indices = gn.utils_tf.sparse_to_dense_indices(graph_features.n_right_nodes)
+
   if graph_features.edges is not None:
     edge_indices = gn.utils_tf.sparse_to_dense_indices(graph_features.n_edge)
     senders = tf.gather_nd(params=graph_features.senders, indices=edge_indices)
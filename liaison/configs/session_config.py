@@ -7,6 +7,9 @@ def get_config():
   config.learner = ConfigDict()
   config.learner.publish_every = 100
   config.learner.checkpoint_every = int(1e9)
+  # snapshot the variables on the training loop and write and
+  # upload the checkpoint in the background.
+  config.learner.async_checkpoint = False
   config.learner.n_train_steps = int(1e9)
   config.learner.use_gpu = True
   config.learner.batch_size = 8
@@ -15,12 +18,26 @@ def get_config():
   # prefetch workers are spawned in a seperate process.
   config.learner.prefetch_processes = 1
   config.learner.prefetch_threads_per_process = 8
+  # batch and preprocess the trajectories in these many processes
+  # which hand over the batches through shared memory. 0 => in a thread.
+  config.learner.combine_processes = 0
   config.learner.inmem_tmp_dir = '/tmp/caraml/'
   # first sess.run is not profiled.
   # generates a profile after every this many steps.
   config.learner.profile_step = 5
+  # traces a step every this many steps (0 disables) along with the host
+  # side spans of the step into a rolling set of max_traces trace files.
+  # Traces are spaced further apart to keep the slow down of the traced
+  # updates below trace_overhead_budget of the update time.
+  config.learner.trace_every = 0
+  config.learner.max_traces = 20
+  config.learner.trace_overhead_budget = 0.01
   config.learner.restore_from = ''
   config.learner.compress_before_send = True
+  # feed the batches into a staging area from a separate thread
+  # so that feeding overlaps with the update.
+  config.learner.use_staging_area = False
+  config.learner.staging_capacity = 2
 
   config.actor = ConfigDict()
   config.actor.class_path = 'liaison.distributed.actor'
@@ -28,6 +45,20 @@ def get_config():
   config.actor.n_unrolls = None  # loop forever.
   config.actor.use_parallel_envs = True
   config.actor.use_threaded_envs = False
+  # parallel env workers write timesteps into shared memory
+  # instead of pickling them through a queue.
+  config.actor.use_shared_memory_envs = False
+  # serial envs write timesteps into the same output arrays every step.
+  config.actor.reuse_env_buffers = False
+  # step envs asynchronously and run the shell on whichever envs
+  # are ready instead of waiting for the slowest env.
+  config.actor.use_async_envs = False
+  config.actor.async_min_ready_envs = None  # None => half the batch.
+  # envs read the global step from the actor instead of polling the ps.
+  config.actor.share_global_step = False
+  # ship graph observations without their padding and pack them at the
+  # learner. Requires an agent that accepts packed graphs (liaison.agents.gcn).
+  config.actor.strip_graph_padding = False
   config.actor.discount_factor = 1.0
   config.actor.compress_before_send = True
 
@@ -41,6 +72,10 @@ def get_config():
   config.shell.agent_scope = 'shell'
   config.shell.ps_client_timeout = 2
   config.shell.ps_client_not_ready_sleep = 2
+  # None, 'lz4', 'fp16' or 'bf16'. (see parameter_codec)
+  config.shell.ps_client_codec = None
+  # parameters are pushed by the ps instead of polled every sync_period.
+  config.shell.ps_subscribe = False
   config.shell.sync_period = 10  # in # steps.
   config.shell.use_gpu = True
   config.shell.restore_from = None
@@ -49,10 +84,14 @@ def get_config():
   config.replay.class_path = 'liaison.replay.uniform_replay'
   config.replay.class_name = 'Replay'
   config.replay.load_balanced = False  # unknown bug
+  # every shard gets its own priority port. Launch the trainer with the
+  # same --replay_n_shards.
   config.replay.n_shards = 1
   config.replay.evict_interval = 0
   config.replay.memory_size = 100
   config.replay.sampling_start_size = 0
+  # max time between rechecks of a sample request waiting for data.
+  config.replay.sample_wait_timeout = 1.0
   config.replay.tensorboard_display = True
   config.replay.loggerplex = ConfigDict()
   config.replay.loggerplex.tensorboard_display = True
@@ -61,6 +100,20 @@ def get_config():
   config.replay.loggerplex.local_logger_time_format = 'hms'
   config.replay.compress_before_send = True
   config.replay.max_times_sampled = 5
+  # used by the prioritized replay.
+  config.replay.priority_exponent = 0.6
+  config.replay.importance_sampling_exponent = 0.4
+  # spill experiences to memory-mapped files on local disk
+  # to hold more than fits in RAM.
+  config.replay.disk_tier = ConfigDict()
+  config.replay.disk_tier.enabled = False
+  config.replay.disk_tier.dirname = '/tmp/liaison_replay'
+  config.replay.disk_tier.segment_size_MB = 256
+  # of deserialized experiences cached in RAM.
+  config.replay.disk_tier.cache_size = 64
+  config.replay.disk_tier.compress = False
+  # segments with less than this fraction live are compacted.
+  config.replay.disk_tier.min_live_ratio = 0.5
 
   config.loggerplex = ConfigDict()
   config.loggerplex.enable_local_logger = True
@@ -80,7 +133,10 @@ def get_config():
   config.tensorplex.deserializer = 'pickle'
 
   config.ps = ConfigDict()
-  # config.ps.n_shards = 1
+  # variables are split across the shards by consistent hashing.
+  # every shard gets its own ports. Launch the trainer with the same
+  # --ps_n_shards. Not supported with shell.ps_subscribe.
+  config.ps.n_shards = 1
 
   config.irs = ConfigDict()
   config.irs.n_shards = 1
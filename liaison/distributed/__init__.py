@@ -1,4 +1,4 @@
-from .parameter_server import (ParameterClient, ParameterPublisher,
+from .parameter_server import (ParameterClient, ParameterPublisher, ParameterSubscriber,
                                ShardedParameterServer, ParameterServer)
 from .simple_parameter_server import ParameterServer as SimpleParameterServer
 from .simple_parameter_server import ParameterPublisher as SimpleParameterPublisher
@@ -11,6 +11,7 @@ from .actor import Actor
 from .exp_sender import ExpSender
 from .exp_collector import ExperienceCollectorServer
 from .data_fetcher import LearnerDataPrefetcher
+from .priority_sender import PrioritySender
 
 from .learner import Learner
 
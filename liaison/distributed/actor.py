@@ -13,10 +13,13 @@ import os
 from queue import Queue
 
 import liaison.utils as U
+import numpy as np
 from liaison.env.batch import ParallelBatchedEnv, SerialBatchedEnv
 from liaison.utils import ConfigDict
+from tensorflow.contrib.framework import nest
 
 from .exp_sender import ExpSender
+from .global_step import create_shared_global_step
 from .full_episode_trajectory import Trajectory as FullEpisodeTrajectory
 from .spec_server import SpecServer
 from .trajectory import Trajectory
@@ -45,20 +48,44 @@ class Actor:
       n_unrolls=None,  # None => loop forever
       use_parallel_envs=False,
       use_threaded_envs=False,
+      use_shared_memory_envs=False,
+      reuse_env_buffers=False,
+      use_async_envs=False,
+      async_min_ready_envs=None,  # None => half the batch.
+      share_global_step=False,
+      strip_graph_padding=False,
       **sess_config):
+    """
+    Args:
+      share_global_step: Share the global step received by the shell with
+        the envs through shared memory. (see global_step.py)
+      strip_graph_padding: Ship the graph observations of the env without
+        their padding. The learner packs them into a single graph per
+        batch, which the agent has to accept. (see Trajectory.batch)
+    """
     assert isinstance(actor_id, int)
     self.config = ConfigDict(sess_config)
     self.batch_size = batch_size
     self._traj_length = traj_length
     self._system_loggers = system_loggers
+    # must be created before the envs so that they can find it.
+    if share_global_step:
+      self._shared_global_step = create_shared_global_step()
+    else:
+      self._shared_global_step = None
     if use_parallel_envs:
       self._env = ParallelBatchedEnv(batch_size,
                                      env_class,
                                      env_configs,
                                      seed,
-                                     use_threads=use_threaded_envs)
+                                     use_threads=use_threaded_envs,
+                                     use_shared_memory=use_shared_memory_envs)
     else:
-      self._env = SerialBatchedEnv(batch_size, env_class, env_configs, seed)
+      self._env = SerialBatchedEnv(batch_size,
+                                   env_class,
+                                   env_configs,
+                                   seed,
+                                   reuse_buffers=reuse_env_buffers)
     self._action_spec = self._env.action_spec()
     self._obs_spec = self._env.observation_spec()
     self._shell = shell_class(
@@ -70,14 +97,24 @@ class Actor:
     )
 
     self._traj = Trajectory(obs_spec=self._obs_spec,
-                            step_output_spec=self._shell.step_output_spec())
+                            step_output_spec=self._shell.step_output_spec(),
+                            static_obs_keys=self._env.static_observation_keys(),
+                            traj_length=traj_length,
+                            graph_obs_keys=self._env.graph_observation_keys()
+                            if strip_graph_padding else None)
 
     if actor_id == 0:
       self._start_spec_server()
 
     self._setup_exp_sender()
     # blocking call -- runs forever
-    self.run_loop(n_unrolls)
+    if use_async_envs:
+      assert use_parallel_envs, 'Async stepping requires parallel envs.'
+      if async_min_ready_envs is None:
+        async_min_ready_envs = max(1, batch_size // 2)
+      self.run_loop_async(n_unrolls, async_min_ready_envs)
+    else:
+      self.run_loop(n_unrolls)
 
   def run_loop(self, n_unrolls):
     ts = self._env.reset()
@@ -93,14 +130,16 @@ class Actor:
         step_output = self._shell.step(step_type=ts.step_type,
                                        reward=ts.reward,
                                        observation=ts.observation)
+      self._update_global_step()
       with U.Timer() as env_step_timer:
         ts = self._env.step(step_output.action)
       self._traj.add(step_output=step_output, **dict(ts._asdict()))
       if len(self._traj) == self._traj_length + 1:
         with U.Timer() as send_experience_timer:
           exps = self._traj.debatch_and_stack()
-          self._traj.reset()
-          self._send_experiences(exps)
+          # the exps view into these until they are sent.
+          bufs = self._traj.reset()
+          self._send_experiences(exps, bufs)
           self._traj.start(next_state=self._shell.next_state, **dict(ts._asdict()))
         system_logs['put_experience_async_sec'] = send_experience_timer.to_seconds()
 
@@ -111,6 +150,67 @@ class Actor:
                  **system_logs))
       i += 1
 
+  def run_loop_async(self, n_unrolls, min_ready_envs):
+    """Steps the envs asynchronously.
+
+    Each iteration runs the shell only on the envs that are done with
+    their previous step, so a slow env doesn't hold up the rest.
+    """
+    ts = self._env.reset()
+    self._traj.reset()
+    self._traj.start(next_state=self._shell.next_state, **dict(ts._asdict()))
+    env_ids = np.arange(self.batch_size)
+    # step output of the step in flight for each env.
+    pending_step_output = None
+    i = 0
+    system_logs = {}
+    while True:
+      if n_unrolls is not None:
+        if i == n_unrolls:
+          return
+      with U.Timer() as shell_step_timer:
+        step_output = self._shell.step(step_type=ts.step_type,
+                                       reward=ts.reward,
+                                       observation=ts.observation,
+                                       env_ids=env_ids)
+      self._update_global_step()
+      if pending_step_output is None:
+        # first step is over all the envs.
+        pending_step_output = type(step_output)(*[np.array(v) for v in step_output])
+      else:
+        for pending_v, v in zip(pending_step_output, step_output):
+          pending_v[env_ids] = v
+      self._env.async_send(step_output.action, env_ids)
+
+      with U.Timer() as env_step_timer:
+        env_ids, ts = self._env.async_recv(min_ready_envs)
+      self._traj.add(step_output=type(step_output)(*[v[env_ids] for v in pending_step_output]),
+                     env_ids=env_ids,
+                     **dict(ts._asdict()))
+
+      finished_ids, exps = self._traj.pop_finished()
+      if len(finished_ids):
+        with U.Timer() as send_experience_timer:
+          self._send_experiences(exps)
+          # the last step of the unroll is the first step of the next one.
+          idx = np.searchsorted(env_ids, finished_ids)
+          self._traj.start(next_state=self._shell.next_state[finished_ids],
+                           env_ids=finished_ids,
+                           **nest.map_structure(lambda v: v[idx], dict(ts._asdict())))
+        system_logs['put_experience_async_sec'] = send_experience_timer.to_seconds()
+
+      for logger in self._system_loggers:
+        logger.write(
+            dict(shell_step_time_sec=shell_step_timer.to_seconds(),
+                 env_step_time_sec=env_step_timer.to_seconds(),
+                 n_ready_envs=len(env_ids),
+                 **system_logs))
+      i += 1
+
+  def _update_global_step(self):
+    if self._shared_global_step is not None and self._shell.global_step is not None:
+      self._shared_global_step.set(self._shell.global_step)
+
   def _setup_exp_sender(self):
     self._exp_sender = ExpSender(host=os.environ['SYMPH_COLLECTOR_FRONTEND_HOST'],
                                  port=os.environ['SYMPH_COLLECTOR_FRONTEND_PORT'],
@@ -118,7 +218,12 @@ class Actor:
                                  manual_flush=True,
                                  compress_before_send=self.config.compress_before_send)
 
-  def _send_experiences(self, exps):
+  def _send_experiences(self, exps, bufs=None):
+    """
+      Args:
+        bufs: trajectory buffers that exps view into. Recycled once the
+          exps are sent.
+    """
     if hasattr(self, 'send_exp_queue'):
       q = self.send_exp_queue
     else:
@@ -126,18 +231,21 @@ class Actor:
 
       def f():
         while True:
-          exps = q.get()
+          exps, bufs = q.get()
           for exp in exps:
             self._exp_sender.send(hash_dict=exp)
           self._exp_sender.flush()
+          if bufs is not None:
+            self._traj.recycle(bufs)
 
       self.exp_thread = U.start_thread(f, daemon=True)
-    q.put(exps)
+    q.put((exps, bufs))
 
   def _start_spec_server(self):
     logging.info("Starting spec server.")
     print("Starting spec server.")
     self._spec_server = SpecServer(port=os.environ['SYMPH_SPEC_PORT'],
                                    traj_spec=self._traj.spec,
-                                   action_spec=self._action_spec)
+                                   action_spec=self._action_spec,
+                                   graph_obs_keys=self._traj.graph_obs_keys)
     self._spec_server.start()
@@ -1,12 +1,105 @@
+import atexit
+import multiprocessing as mp
 import os
 import queue
+import tempfile
+from collections import namedtuple
 from threading import Thread
 
 import liaison.utils as U
+import numpy as np
 from caraml.zmq import DataFetcher
 
 from .exp_serializer import get_deserializer, get_serializer
 
+_SHM_ALIGNMENT = 64
+
+# Placeholder of an array in the skeleton of a batch written to a slot.
+_SlotArray = namedtuple('_SlotArray', ['index', 'shape', 'dtype'])
+
+
+class BatchSlot:
+  """Shared memory buffer for a combined batch backed by a file on /dev/shm.
+
+  The file is grown to fit the batch being written. Processes map the
+  file by its name and remap it when it has grown.
+  """
+
+  def __init__(self, fname):
+    self.fname = fname
+    self._mm = None
+
+  def buffer(self, nbytes=0):
+    """Returns a mapping of the slot holding at least nbytes."""
+    nbytes = max(nbytes, 1)
+    if self._mm is None or len(self._mm) < nbytes:
+      if os.path.getsize(self.fname) < nbytes:
+        os.truncate(self.fname, nbytes)
+      self._mm = np.memmap(self.fname,
+                           dtype=np.uint8,
+                           mode='r+',
+                           shape=(os.path.getsize(self.fname), ))
+    return self._mm
+
+
+def _mk_skeleton(obj, arrays):
+  """Replaces the arrays in the nested dicts and lists of obj by _SlotArray."""
+  if isinstance(obj, np.ndarray):
+    arrays.append(obj)
+    return _SlotArray(len(arrays) - 1, obj.shape, obj.dtype.str)
+  elif isinstance(obj, dict):
+    return type(obj)({k: _mk_skeleton(v, arrays) for k, v in obj.items()})
+  elif isinstance(obj, list):
+    return [_mk_skeleton(v, arrays) for v in obj]
+  return obj
+
+
+def _fill_skeleton(obj, buf, offsets):
+  if isinstance(obj, _SlotArray):
+    return np.ndarray(obj.shape, dtype=obj.dtype, buffer=buf, offset=offsets[obj.index])
+  elif isinstance(obj, dict):
+    return type(obj)({k: _fill_skeleton(v, buf, offsets) for k, v in obj.items()})
+  elif isinstance(obj, list):
+    return [_fill_skeleton(v, buf, offsets) for v in obj]
+  return obj
+
+
+def write_batch(batch, slot):
+  """Copies the arrays of the batch into the slot.
+
+  Returns:
+    (skeleton, offsets) to pass to read_batch.
+    offsets of the arrays are followed by the total # of bytes.
+  """
+  arrays = []
+  skeleton = _mk_skeleton(batch, arrays)
+  offsets = []
+  total = 0
+  for arr in arrays:
+    offsets.append(total)
+    total += -(-arr.nbytes // _SHM_ALIGNMENT) * _SHM_ALIGNMENT
+  offsets.append(total)
+
+  buf = slot.buffer(total)
+  for arr, offset in zip(arrays, offsets):
+    # also makes the time major views contiguous.
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=buf, offset=offset)[...] = arr
+  return skeleton, offsets
+
+
+def read_batch(skeleton, offsets, slot):
+  """Returns the batch written to the slot with views of its arrays."""
+  return _fill_skeleton(skeleton, slot.buffer(offsets[-1]), offsets)
+
+
+def _combine_worker(combine_trajs, traj_queue, free_slots, ready_queue, slot_fnames):
+  slots = [BatchSlot(fname) for fname in slot_fnames]
+  while True:
+    batch = combine_trajs(traj_queue.get())
+    slot_id = free_slots.get()
+    skeleton, offsets = write_batch(batch, slots[slot_id])
+    ready_queue.put((slot_id, skeleton, offsets))
+
 
 class LearnerDataPrefetcher(DataFetcher):
   """
@@ -30,7 +123,16 @@ class LearnerDataPrefetcher(DataFetcher):
       tmp_dir,
       compress_before_send,
       worker_preprocess=None,
+      combine_processes=0,
   ):
+    """
+    Args:
+      combine_processes: If > 0, combine_trajs runs in these many worker
+        processes which write the combined batches into shared memory
+        slots. The batch returned by get is then only valid until the next
+        call to get. The workers are spawned, so combine_trajs has to be
+        picklable.
+    """
     assert batch_size % prefetch_batch_size == 0
     self.fetch_queue = queue.Queue(
         maxsize=max(1, max_prefetch_queue - batch_size // prefetch_batch_size))
@@ -46,6 +148,9 @@ class LearnerDataPrefetcher(DataFetcher):
     self.prefetch_host = '127.0.0.1'
     self.worker_comm_port = os.environ['SYMPH_PREFETCH_QUEUE_PORT']
     self.worker_preprocess = worker_preprocess
+    self.combine_processes = combine_processes
+    # slot of the batch last returned by get.
+    self._held_slot_id = None
     super().__init__(handler=self._put,
                      remote_host=self.sampler_host,
                      remote_port=self.sampler_port,
@@ -58,12 +163,52 @@ class LearnerDataPrefetcher(DataFetcher):
                      threads_per_worker=prefetch_threads_per_process,
                      tmp_dir=tmp_dir)
 
+  def start(self):
+    # before get can wait on the ready queue.
+    if self.combine_processes > 0:
+      self._start_combine_workers()
+    super().start()
+
   def run(self):
-    self._combine_prefetch_thread = Thread(
-        target=self._combine_prefetched_batches)
+    if self.combine_processes > 0:
+      target = self._dispatch_prefetched_batches
+    else:
+      target = self._combine_prefetched_batches
+    self._combine_prefetch_thread = Thread(target=target)
     self._combine_prefetch_thread.start()
     super().run()
 
+  def _start_combine_workers(self):
+    n = self.combine_processes
+    # not forked: the learner has a tf.Session, zmq sockets and threads
+    # running by now.
+    ctx = mp.get_context('spawn')
+    # a slot is being written by each worker, waiting in the ready queue
+    # or held by the consumer.
+    n_slots = 2 * n + 1
+    shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    slot_fnames = []
+    for _ in range(n_slots):
+      fd, fname = tempfile.mkstemp(prefix='liaison_batch_slot_', dir=shm_dir)
+      os.close(fd)
+      atexit.register(os.remove, fname)
+      slot_fnames.append(fname)
+    self._slots = [BatchSlot(fname) for fname in slot_fnames]
+
+    self._traj_queue = ctx.Queue(n)
+    self._free_slots = ctx.Queue(n_slots)
+    for i in range(n_slots):
+      self._free_slots.put(i)
+    self._ready_queue = ctx.Queue(n_slots)
+    self._combine_workers = []
+    for _ in range(n):
+      worker = ctx.Process(target=_combine_worker,
+                           args=(self._combine_trajs, self._traj_queue, self._free_slots,
+                                 self._ready_queue, slot_fnames),
+                           daemon=True)
+      worker.start()
+      self._combine_workers.append(worker)
+
   def _put(self, _, data):
     self.fetch_queue.put(data, block=True)
 
@@ -74,9 +219,35 @@ class LearnerDataPrefetcher(DataFetcher):
         l.extend(self.fetch_queue.get())
       self._combine_prefetch_queue.put(self._combine_trajs(l))
 
+  def _dispatch_prefetched_batches(self):
+    while True:
+      l = []
+      while len(l) < self.batch_size:
+        l.extend(self.fetch_queue.get())
+      self._traj_queue.put(l)
+
   def get(self):
     with self.timer.time():
-      return self._combine_prefetch_queue.get()
+      if self.combine_processes == 0:
+        return self._combine_prefetch_queue.get()
+
+      # the previous batch is no longer used.
+      if self._held_slot_id is not None:
+        self._free_slots.put(self._held_slot_id)
+      slot_id, skeleton, offsets = self._get_ready_slot()
+      self._held_slot_id = slot_id
+      return read_batch(skeleton, offsets, self._slots[slot_id])
+
+  def _get_ready_slot(self):
+    while True:
+      try:
+        return self._ready_queue.get(timeout=1)
+      except queue.Empty:
+        # nothing would ever be put if a worker died.
+        for worker in self._combine_workers:
+          if not worker.is_alive():
+            raise RuntimeError(
+                f'Combine worker {worker.pid} died with exit code {worker.exitcode}')
 
   def request_generator(self):
     while True:
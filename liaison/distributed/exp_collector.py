@@ -2,15 +2,20 @@ import weakref
 from threading import Thread
 
 import liaison.utils as U
+import numpy as np
 from caraml.zmq import ZmqReceiver
 
-from .exp_serializer import get_deserializer, get_serializer
+from .exp_serializer import (get_deserializer, get_frames_deserializer,
+                             get_serializer)
 
 
 class ExperienceCollectorServer(Thread):
   """
         Accepts experience from agents,
         deduplicates experience whenever possible
+
+        exp_handler is called with (exp, nbytes) where nbytes is the
+        total size of the arrays in exp.
     """
 
   def __init__(self,
@@ -34,6 +39,7 @@ class ExperienceCollectorServer(Thread):
         Starts the server loop
     """
     self._weakref_map = weakref.WeakValueDictionary()
+    deserialize_frames = get_frames_deserializer()
     self.receiver = ZmqReceiver(
         host=self.host,
         port=self.port,
@@ -41,38 +47,51 @@ class ExperienceCollectorServer(Thread):
         serializer=get_serializer(self._compress_before_send),
         deserializer=get_deserializer(self._compress_before_send))
     while True:
-      exp, storage = self.receiver.recv()
-      experience_list = self._retrieve_storage(exp, storage)
-      for exp in experience_list:
-        self._exp_handler(exp)
+      # experiences arrive as multipart messages (see ExpSender.flush)
+      # arrays are rebuilt on top of the received frames without copying.
+      socket = self.receiver.socket.unwrap()
+      frames = socket.recv_multipart(copy=False)
+      # REP socket: ack right away so the sender can move on.
+      socket.send(b'ack')
+      exp_list, storage = deserialize_frames(frames)
+      for exp in exp_list:
+        nbytes = [0]
+        exp = self._retrieve_storage(exp, storage, nbytes)
+        self._exp_handler(exp, nbytes[0])
 
-  def _retrieve_storage(self, exp, storage):
+  def _retrieve_storage(self, exp, storage, nbytes):
     """
         Args:
             exp: a nested dict or list
                 Only dict keys that end with `_hash` will be retrieved.
                 The processed key will see `_hash` removed
             storage: chunk of storage sent with the exps
+            nbytes: [int] accumulates the size of the arrays in exp.
         """
     if isinstance(exp, list):
       for i, e in enumerate(exp):
-        exp[i] = self._retrieve_storage(e, storage)
+        exp[i] = self._retrieve_storage(e, storage, nbytes)
 
     elif isinstance(exp, dict):
       for key in list(exp.keys()):  # copy keys
         if key.endswith('_hash'):
           new_key = key[:-len('_hash')]  # delete suffix
-          exp[new_key] = self._retrieve_storage(exp[key], storage)
+          exp[new_key] = self._retrieve_storage(exp[key], storage, nbytes)
           del exp[key]
         else:
-          exp[key] = self._retrieve_storage(exp[key], storage)
+          exp[key] = self._retrieve_storage(exp[key], storage, nbytes)
 
     elif isinstance(exp, str):
       exphash = exp
       if exphash in self._weakref_map:
-        return self._weakref_map[exphash]
+        exp = self._weakref_map[exphash]
       else:
         self._weakref_map[exphash] = storage[exphash]
-        return storage[exphash]
+        exp = storage[exphash]
+      nbytes[0] += getattr(exp, 'nbytes', 0)
+
+    elif isinstance(exp, np.ndarray):
+      # small arrays are sent inline.
+      nbytes[0] += exp.nbytes
 
     return exp
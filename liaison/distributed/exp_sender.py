@@ -2,12 +2,21 @@
 Agent side.
 Send experience chunks (buffered) to Replay node.
 """
+import hashlib
+import pickle
+
 import liaison.utils as U
-import pyarrow as pa
+import numpy as np
 from caraml.zmq import ZmqSender
 from liaison.session import PeriodicTracker
 
-from .exp_serializer import get_deserializer, get_serializer
+from .exp_serializer import (get_deserializer, get_frames_serializer,
+                             get_serializer)
+
+
+# Arrays smaller than this many bytes are sent inline instead of
+# being deduplicated -- the hash key would cost as much as the array.
+MIN_HASH_BYTES = 1024
 
 
 class ExpBuffer(object):
@@ -15,10 +24,10 @@ class ExpBuffer(object):
         Temporarily holds and deduplicates experience
     """
 
-  def __init__(self, serialize_fn):
+  def __init__(self, min_hash_bytes=MIN_HASH_BYTES):
     self.exp_list = []  # list of exp dicts
     self.ob_storage = {}
-    self._serialize_fn = serialize_fn
+    self._min_hash_bytes = min_hash_bytes
 
   def add(self, hash_dict, nonhash_dict):
     """
@@ -59,11 +68,31 @@ class ExpBuffer(object):
       return None
     else:  # values is a single object
       obj = values
-      hsh = U.binary_hash(self._serialize_fn(obj))
+      # small leaves are kept inline.
+      # (receiver only looks up `str` leaves in the storage)
+      if isinstance(obj, np.ndarray):
+        if obj.nbytes < self._min_hash_bytes:
+          return obj
+      elif isinstance(obj, (np.generic, int, float, bool)):
+        return obj
+      hsh = self._hash_leaf(obj)
       if hsh not in self.ob_storage:
         self.ob_storage[hsh] = obj
       return hsh  # returns string here
 
+  @staticmethod
+  def _hash_leaf(obj):
+    """Hash directly over the raw array buffer keyed on dtype and shape."""
+    h = hashlib.blake2b(digest_size=8)
+    if isinstance(obj, np.ndarray):
+      h.update(str(obj.dtype).encode('utf-8'))
+      h.update(str(obj.shape).encode('utf-8'))
+      h.update(np.ascontiguousarray(obj))
+    else:
+      # rare non-array leaves (strings etc.)
+      h.update(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    return h.hexdigest()
+
 
 class ExpSender(object):
   """
@@ -78,17 +107,20 @@ class ExpSender(object):
                port,
                flush_iteration,
                compress_before_send,
-               manual_flush=False):
+               manual_flush=False,
+               min_hash_bytes=MIN_HASH_BYTES):
     """
       Args:
           flush_iteration: how many send() calls before we flush the buffer
+          min_hash_bytes: arrays smaller than this are not deduplicated.
     """
     self._client = ZmqSender(
         host=host,
         port=port,
         serializer=get_serializer(compress_before_send),
         deserializer=get_deserializer(compress_before_send))
-    self._exp_buffer = ExpBuffer(get_serializer(compress_before_send))
+    self._serialize_frames = get_frames_serializer(compress_before_send)
+    self._exp_buffer = ExpBuffer(min_hash_bytes)
     if not manual_flush:
       self._flush_tracker = PeriodicTracker(flush_iteration)
     self._manual_flush = manual_flush
@@ -113,4 +145,11 @@ class ExpSender(object):
 
   def flush(self):
     exp_binary = self._exp_buffer.flush()
-    self._client.send(exp_binary)
+    # ship the numpy buffers as seperate zmq frames to avoid
+    # joining them into a single message.
+    frames = self._serialize_frames(exp_binary)
+    socket = self._client.socket.unwrap()
+    socket.send_multipart(frames, copy=False)
+    # REQ socket: wait for the collector to ack before the next send.
+    if socket.recv() != b'ack':
+      raise ValueError('ExpSender did not receive ack from the collector')
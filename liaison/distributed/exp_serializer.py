@@ -2,10 +2,33 @@
   Maintain a seperate serializer class for experience to handle custom types.
   Add custom types to the dicts below.
 
-  Use compression to shrink the experiences.
+  Experiences are pickled with protocol 5 so that numpy leaves are written
+  out-of-band as raw buffers instead of being copied into the pickle stream.
+  Each out-of-band buffer is compressed separately.
+
+  The serialized experience is a list of frames:
+    frames[0]: pickled list of (codec, original_len) for every buffer.
+    frames[1]: the pickle stream (everything except the array data).
+    frames[2:]: one frame per out-of-band buffer.
+
+  The frames can be shipped as a zmq multipart message. On the receiving end,
+  arrays are rebuilt directly on top of the received frames (or on top of
+  the decompressed buffers) without any further copy.
 """
+import copyreg
+import functools
+import io
+import struct
+import sys
+
 import pyarrow as pa
 
+if sys.version_info < (3, 8):
+  # out-of-band buffers need the protocol 5 backport on older pythons.
+  import pickle5 as pickle
+else:
+  import pickle
+
 # Add custom types here as required.
 CUSTOM_TYPES = {}
 SERIALIZERS = {}
@@ -15,55 +38,124 @@ DESERIALIZERS = {}
 for d1, d2 in [(CUSTOM_TYPES, SERIALIZERS), (CUSTOM_TYPES, DESERIALIZERS)]:
   assert sorted(d1.keys()) == sorted(d2.keys())
 
+# loss-less compression scheme
+CODEC = 'lz4'
+# Buffers smaller than this are not worth compressing.
+MIN_COMPRESS_BYTES = 1024
 
-def _get_pa_context():
-  # Add custom types to context for serializing, deserializing using pyarrow.
-  ctxt = pa.SerializationContext()
-  for k, v in CUSTOM_TYPES.items():
-    ctxt.register_type(v,
-                       k,
-                       custom_serializer=SERIALIZERS[k],
-                       custom_deserializer=DESERIALIZERS[k])
-  return ctxt
+PICKLE_PROTOCOL = 5
 
 
-# loss-less compression scheme
-CODEC = 'lz4'
+def _reduce_custom_type(type_name, obj):
+  return DESERIALIZERS[type_name], (SERIALIZERS[type_name](obj), )
 
 
-def get_serializer(compress=True):
-  context = _get_pa_context()
+def _get_dispatch_table():
+  # Add custom types to the pickler dispatch table.
+  table = copyreg.dispatch_table.copy()
+  for k, v in CUSTOM_TYPES.items():
+    table[v] = functools.partial(_reduce_custom_type, k)
+  return table
+
+
+def get_frames_serializer(compress=True):
+  """Returns f(val) -> list of frames (bytes-like objects)."""
+  dispatch_table = _get_dispatch_table()
+  codec = pa.Codec(CODEC) if compress else None
 
   def f(val):
-    # first serialize the data
-    buf = pa.serialize(val, context=context).to_buffer()
-    if compress:
-      original_len = len(buf)
+    buffers = []
+    stream = io.BytesIO()
+    pickler = pickle.Pickler(stream,
+                             protocol=PICKLE_PROTOCOL,
+                             buffer_callback=buffers.append)
+    pickler.dispatch_table = dispatch_table
+    pickler.dump(val)
+
+    meta = []
+    frames = [None, stream.getbuffer()]
+    for buf in buffers:
+      # zero-copy view of the array memory.
+      raw = buf.raw()
+      if codec is not None and raw.nbytes >= MIN_COMPRESS_BYTES:
+        frames.append(codec.compress(raw, asbytes=True))
+        meta.append((CODEC, raw.nbytes))
+      else:
+        frames.append(raw)
+        meta.append((None, raw.nbytes))
+    frames[0] = pickle.dumps(meta, protocol=PICKLE_PROTOCOL)
+    return frames
+
+  return f
+
+
+def get_frames_deserializer():
+  """Returns f(frames) -> val.
 
-      # compress the data
-      buf = pa.compress(buf, codec=CODEC, asbytes=True)
+  Compression is recorded per buffer in the header frame, so the
+  deserializer doesn't need to know if the sender compressed.
+  """
+  codecs = {}
 
-      # add metadata required for decompression
-      return pa.serialize((original_len, CODEC, buf)).to_buffer()
-    else:
-      return buf
+  def f(frames):
+    frames = [memoryview(frame) for frame in frames]
+    meta = pickle.loads(frames[0])
+    assert len(meta) == len(frames) - 2
+
+    buffers = []
+    for (codec, original_len), frame in zip(meta, frames[2:]):
+      if codec is None:
+        buffers.append(frame)
+      else:
+        if codec not in codecs:
+          codecs[codec] = pa.Codec(codec)
+        buffers.append(codecs[codec].decompress(frame,
+                                                decompressed_size=original_len))
+    return pickle.loads(frames[1], buffers=buffers)
+
+  return f
+
+
+def _pack_frames(frames):
+  lens = [memoryview(frame).nbytes for frame in frames]
+  header = struct.pack('<I%dQ' % len(lens), len(lens), *lens)
+  return b''.join([header] + frames)
+
+
+def _unpack_frames(buf):
+  buf = memoryview(buf)
+  n_frames, = struct.unpack_from('<I', buf, 0)
+  offset = struct.calcsize('<I')
+  lens = struct.unpack_from('<%dQ' % n_frames, buf, offset)
+  offset += struct.calcsize('<%dQ' % n_frames)
+  frames = []
+  for l in lens:
+    frames.append(buf[offset:offset + l])
+    offset += l
+  return frames
+
+
+def get_serializer(compress=True):
+  """Single buffer variant for channels that can't send multipart messages.
+
+  The frames are joined into one contiguous buffer prefixed with their
+  lengths.
+  """
+  serialize_frames = get_frames_serializer(compress)
+
+  def f(val):
+    return _pack_frames(serialize_frames(val))
 
   return f
 
 
 def get_deserializer(compress=True):
   """If compression is used at the serializer end."""
-  context = _get_pa_context()
+  del compress  # recorded in the header frame.
+  deserialize_frames = get_frames_deserializer()
 
   def f(buf):
-    if compress:
-      # first deserialize the compressed data
-      l, codec, buf = pa.deserialize(buf)
-
-      # extract the data
-      buf = pa.decompress(buf, l, codec=codec)
-
-    # deserialize the actual data
-    return pa.deserialize(buf, context=context)
+    # frames are views into buf -- no copy.
+    return deserialize_frames(_unpack_frames(buf))
 
   return f
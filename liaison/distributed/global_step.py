@@ -0,0 +1,47 @@
+"""Shares the learner's global step with all the envs of an actor.
+
+The shell receives the global step along with the parameters. The actor
+writes it to a shared memory counter which the envs (in the actor process
+or in ParallelBatchedEnv workers) read instead of polling the parameter
+server on their own. The counter file is passed down to the env
+processes through the environment variable below.
+"""
+import atexit
+import os
+import tempfile
+
+import numpy as np
+
+GLOBAL_STEP_FILE_ENV_VAR = 'LIAISON_GLOBAL_STEP_FILE'
+
+
+class SharedGlobalStep:
+
+  def __init__(self, fname, create=False):
+    self.fname = fname
+    self._arr = np.memmap(fname, dtype=np.int64, mode='w+' if create else 'r+', shape=(1, ))
+
+  def set(self, step):
+    self._arr[0] = step
+
+  def get(self):
+    return int(self._arr[0])
+
+
+def create_shared_global_step():
+  """Creates the counter and exports it to the envs created from now on."""
+  shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+  fd, fname = tempfile.mkstemp(prefix='liaison_global_step_', dir=shm_dir)
+  os.close(fd)
+  shared_step = SharedGlobalStep(fname, create=True)
+  os.environ[GLOBAL_STEP_FILE_ENV_VAR] = fname
+  atexit.register(os.remove, fname)
+  return shared_step
+
+
+def get_shared_global_step():
+  """Returns the counter created by the actor or None if there isn't one."""
+  fname = os.environ.get(GLOBAL_STEP_FILE_ENV_VAR)
+  if fname is None:
+    return None
+  return SharedGlobalStep(fname)
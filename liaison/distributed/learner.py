@@ -4,6 +4,7 @@ Requires env variables:
   SYMPH_PS_PUBLISHING_PORT
   SYMPH_PS_SERVING_HOST
   SYMPH_PS_SERVING_PORT
+  SYMPH_PS_{PUBLISHING,SERVING}_<shard>_PORT (with ps_n_shards > 1)
   SYMPH_SPEC_HOST
   SYMPH_SPEC_PORT
   SYMPH_IRS_HOST
@@ -15,24 +16,60 @@ import logging
 import os
 import uuid
 from queue import Queue
-from threading import Thread
+from threading import Event, Thread
 
 import liaison.utils as U
+import numpy as np
 import tensorflow as tf
 from caraml.zmq import (ZmqClient, ZmqFileUploader, ZmqProxyThread, ZmqPub,
                         ZmqServer, ZmqSub, ZmqTimeoutError)
+from liaison.agents.base import GLOBAL_STEP_KEY
+from liaison.agents.losses.vtrace import PRIORITIES_KEY
 from liaison.distributed import (LearnerDataPrefetcher, ParameterClient,
-                                 SimpleParameterPublisher, Trajectory)
+                                 PrioritySender, SimpleParameterPublisher,
+                                 Trajectory)
+from liaison.distributed.priority_sender import IS_WEIGHT_KEY, REPLAY_KEY
+from liaison.distributed.step_tracer import StepTracer, merge_host_spans
 from liaison.irs import get_irs_client
 from liaison.session.tracker import PeriodicTracker
 from liaison.utils import ConfigDict, logging
 from tensorflow.contrib.framework import nest
+from tensorflow.contrib.staging import StagingArea
 from tensorflow.core.protobuf import rewriter_config_pb2
 from tensorflow.python.client import timeline
 
 TEMP_FOLDER = '/tmp/liaison/'
 
 
+class _TrajBatcher(object):
+  """Batches the trajectories fetched from the replay.
+
+  Picklable so that it can run in the combine worker processes of
+  LearnerDataPrefetcher.
+  """
+
+  def __init__(self, traj_spec, graph_obs_keys):
+    self._traj_spec = traj_spec
+    self._graph_obs_keys = graph_obs_keys
+
+  def __call__(self, l):
+    # tags added by prioritized replays.
+    replay_keys = [exp.pop(REPLAY_KEY) for exp in l if REPLAY_KEY in exp]
+    is_weights = [exp.pop(IS_WEIGHT_KEY) for exp in l if IS_WEIGHT_KEY in exp]
+    # graph observations are packed if the actors strip their padding.
+    traj = Trajectory.batch(l, self._traj_spec, self._graph_obs_keys)
+    if replay_keys:
+      assert len(replay_keys) == len(l) == len(is_weights)
+      traj[REPLAY_KEY] = replay_keys
+      traj[IS_WEIGHT_KEY] = np.asarray(is_weights, dtype=np.float32)
+    return traj
+
+
+def _pop_replay_tags(batch):
+  """Returns the (replay keys, importance-sampling weights) of the batch."""
+  return batch.pop(REPLAY_KEY, None), batch.pop(IS_WEIGHT_KEY, None)
+
+
 class Learner(object):
 
   # learner does the following operations.
@@ -54,6 +91,14 @@ class Learner(object):
                use_gpu=True,
                publish_every=1,
                checkpoint_every=100,
+               use_staging_area=False,
+               staging_capacity=2,
+               async_checkpoint=False,
+               trace_every=0,
+               max_traces=20,
+               trace_overhead_budget=0.01,
+               ps_n_shards=1,
+               replay_n_shards=1,
                **session_config):
     """
     Args:
@@ -70,6 +115,20 @@ class Learner(object):
       max_prefetch_queue: Max-size of the prefetch queue.
       max_preprocess_queue: Max-size of the preprocess queue.
       prefetch_process: # of processes to run in parallel for prefetching.
+      use_staging_area: Feed the batches into a staging area on the device
+        from a separate thread, so that feeding the next batch overlaps
+        with the update on the current one.
+      staging_capacity: Max # of batches staged ahead of the update.
+      async_checkpoint: Only snapshot the variables into host memory
+        on the training loop and write and upload the checkpoint in the
+        background. Checkpoints due while the previous one is still being
+        uploaded are coalesced into the next snapshot.
+      trace_every: Trace a step every this many steps (0 disables) into
+        a rolling set of max_traces chrome traces. (see StepTracer)
+      trace_overhead_budget: Max fraction of the update time that tracing
+        may slow it down by.
+      ps_n_shards: # of parameter server shards to publish to.
+      replay_n_shards: # of replay shards to send the priorities to.
     """
     self.config = ConfigDict(**session_config)
     self._loggers = loggers
@@ -79,17 +138,27 @@ class Learner(object):
     self._traj_length = traj_length
 
     self._agent_scope = agent_scope
+    self._ps_n_shards = ps_n_shards
+    self._replay_n_shards = replay_n_shards
     self._setup_ps_publisher()
     self._setup_ps_client_handle()
-    self._setup_exp_fetcher()
+    # set up on the first batch from a prioritized replay.
+    self._priority_sender = None
     self._setup_spec_client()
     self._get_specs()
+    self._setup_exp_fetcher()
 
     self._publish_queue = Queue()
     self._publish_thread = Thread(target=self._publish)
     self._publish_thread.start()
     self._publish_tracker = PeriodicTracker(publish_every)
     self._profile_step = self.config.profile_step
+    self._tracer = StepTracer(trace_every, max_traces, trace_overhead_budget)
+    self._trace_thread = None
+    if trace_every > 0:
+      self._trace_queue = Queue()
+      self._trace_thread = Thread(target=self._upload_traces)
+      self._trace_thread.start()
     self._checkpoint_every = checkpoint_every
 
     self._graph = tf.Graph()
@@ -103,6 +172,9 @@ class Learner(object):
 
       self._mk_phs(self._traj_spec)
       traj_phs = self._traj_phs
+      self._use_staging_area = use_staging_area
+      if use_staging_area:
+        traj_phs = self._mk_staging_area(traj_phs, use_gpu, staging_capacity)
       self._agent.build_update_ops(step_types=traj_phs['step_type'],
                                    prev_states=traj_phs['step_output']['next_state'],
                                    step_outputs=ConfigDict(traj_phs['step_output']),
@@ -125,6 +197,9 @@ class Learner(object):
       self.sess.run(tf.global_variables_initializer())
       self.sess.run(tf.local_variables_initializer())
       self._saver = tf.train.Saver()
+      self._async_checkpoint = async_checkpoint
+      if async_checkpoint:
+        self._mk_ckpt_snapshot_ops()
 
       self._variables = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope=agent_scope)
       self._variable_names = [var.name for var in self._variables]
@@ -152,8 +227,22 @@ class Learner(object):
         print(f'Checkpt restored from {restore_from}')
         print(f'***********************************************')
 
+      # kept up to date from the update fetches. (see _update_global_step)
+      self._global_step = self.sess.run(self._global_step_op)
       self._initial_publish()
       self._exp_fetcher.start()
+      if async_checkpoint:
+        self._ckpt_queue = Queue()
+        # set while no snapshot is being written.
+        self._ckpt_idle = Event()
+        self._ckpt_idle.set()
+        self._ckpt_pending = False
+        self._ckpt_thread = Thread(target=self._write_ckpt_snapshots)
+        self._ckpt_thread.start()
+      if use_staging_area:
+        # replay tags of the staged batches in the order they are staged.
+        self._staged_replay_tags = Queue()
+        self._staging_thread = U.start_thread(self._stage_batches, daemon=True)
 
   def _mk_phs(self, traj_spec):
 
@@ -164,10 +253,36 @@ class Learner(object):
 
     self._traj_phs = nest.map_structure(mk_ph, traj_spec)
 
+  def _mk_staging_area(self, traj_phs, use_gpu, capacity):
+    """Returns the batch dequeued from the staging area fed by traj_phs.
+
+    Every sess.run of ops built on the returned batch consumes one
+    staged batch.
+    """
+    flat_phs = nest.flatten(traj_phs)
+    with tf.device('/gpu:0' if use_gpu else '/cpu:0'):
+      area = StagingArea(dtypes=[ph.dtype for ph in flat_phs],
+                         shapes=[ph.shape for ph in flat_phs],
+                         capacity=capacity)
+      self._stage_op = area.put(flat_phs)
+      staged = area.get()
+    return nest.pack_sequence_as(traj_phs, staged)
+
+  def _mk_feed_dict(self, batch):
+    return {ph: val for ph, val in zip(nest.flatten(self._traj_phs), nest.flatten(batch))}
+
+  def _stage_batches(self):
+    """Feeds the prefetched batches into the staging area. (runs forever)"""
+    while True:
+      batch = self._get_batch()
+      self._staged_replay_tags.put(_pop_replay_tags(batch))
+      # blocks while the staging area is full.
+      self.sess.run(self._stage_op, feed_dict=self._mk_feed_dict(batch))
+
   def _get_specs(self):
     while True:
       try:
-        self._traj_spec, self._action_spec = self.spec_client.request(
+        self._traj_spec, self._action_spec, self._graph_obs_keys = self.spec_client.request(
             (self._batch_size, self._traj_length))
       except ZmqTimeoutError:
         logging.info('ZmQ timed out for the spec server. Retrying...')
@@ -181,8 +296,9 @@ class Learner(object):
                                  deserializer=U.pickle_deserialize,
                                  timeout=4)
 
-  def _batch_and_preprocess_trajs(self, l):
-    traj = Trajectory.batch(l, self._traj_spec)
+  def _get_batch(self):
+    """Returns the next prefetched batch preprocessed by the agent."""
+    traj = self._exp_fetcher.get()
     # feed and overwrite the trajectory
     traj['step_output'], traj['step_output']['next_state'], traj['step_type'], traj[
         'reward'], traj['observation'], traj['discount'] = self._agent.update_preprocess(
@@ -207,24 +323,41 @@ class Learner(object):
     self._exp_fetcher = LearnerDataPrefetcher(
         batch_size=bs,
         prefetch_batch_size=pf_bs,
-        combine_trajs=self._batch_and_preprocess_trajs,
+        combine_trajs=_TrajBatcher(self._traj_spec, self._graph_obs_keys),
         max_prefetch_queue=config.max_prefetch_queue * pf_bs,
         prefetch_processes=config.prefetch_processes,
         prefetch_threads_per_process=config.prefetch_threads_per_process,
         tmp_dir=config.inmem_tmp_dir,
-        compress_before_send=config.compress_before_send)
+        compress_before_send=config.compress_before_send,
+        combine_processes=config.combine_processes)
 
   def _setup_ps_client_handle(self):
     """Initialize self._ps_client and connect it to the ps."""
-    self._ps_client = ParameterClient(host=os.environ['SYMPH_PS_SERVING_HOST'],
-                                      port=os.environ['SYMPH_PS_SERVING_PORT'],
+    self._ps_client = ParameterClient(host=U.get_service_host('ps-serving'),
+                                      port=[
+                                          U.get_service_port('ps-serving', shard)
+                                          for shard in range(self._ps_n_shards)
+                                      ],
                                       agent_scope=self._agent_scope)
 
   def _setup_ps_publisher(self):
-    self._ps_publisher = SimpleParameterPublisher(host=os.environ['SYMPH_PS_PUBLISHING_HOST'],
-                                                  port=os.environ['SYMPH_PS_PUBLISHING_PORT'],
+    self._ps_publisher = SimpleParameterPublisher(host=U.get_service_host('ps-publishing'),
+                                                  port=[
+                                                      U.get_service_port('ps-publishing', shard)
+                                                      for shard in range(self._ps_n_shards)
+                                                  ],
                                                   agent_scope=self._agent_scope)
 
+  def _send_priorities(self, replay_keys, priorities):
+    if self._priority_sender is None:
+      self._priority_sender = PrioritySender(host=U.get_service_host('priority'),
+                                             ports=[
+                                                 U.get_service_port('priority', shard)
+                                                 for shard in range(self._replay_n_shards)
+                                             ],
+                                             compress_before_send=self.config.compress_before_send)
+    self._priority_sender.send(replay_keys, priorities)
+
   def _initial_publish(self):
     self._publish_variables()
     # blocks until connection is successful.
@@ -266,16 +399,36 @@ class Learner(object):
                        dst_dir_name='')
     U.f_remove(fname)
 
-  def _create_ckpt(self):
-    # save the model
+  def _mk_ckpt_snapshot_ops(self):
+    """Host copies of the checkpointed variables for async checkpoints.
+
+    The snapshot is saved under the names of the original variables so
+    that the checkpoint is the same as the one saved by self._saver.
+    """
+    var_list = {}
+    assign_ops = []
+    with tf.device('/cpu:0'), tf.name_scope('ckpt_snapshot'):
+      for var in tf.global_variables():
+        # local so that it is neither checkpointed nor published itself.
+        snapshot_var = tf.Variable(tf.zeros(var.shape, var.dtype.base_dtype),
+                                   trainable=False,
+                                   collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                                   name=var.op.name.replace('/', '_'))
+        var_list[var.op.name] = snapshot_var
+        assign_ops.append(snapshot_var.assign(var, read_value=False))
+    self.sess.run(tf.variables_initializer(list(var_list.values())))
+    self._ckpt_snapshot_op = tf.group(*assign_ops)
+    self._ckpt_snapshot_saver = tf.train.Saver(var_list=var_list)
+
+  def _save_ckpt(self, saver, global_step):
     export_path = os.path.join(TEMP_FOLDER, str(uuid.uuid4()))
     U.f_mkdir(export_path)
     logging.info('Using %s folder for checkpointing ' % export_path)
     with self._graph.as_default():
-      self._saver.save(self.sess,
-                       export_path + '/learner',
-                       global_step=self.global_step,
-                       write_meta_graph=False)
+      saver.save(self.sess,
+                 export_path + '/learner',
+                 global_step=global_step,
+                 write_meta_graph=False)
 
     file_uploader = self._get_file_uploader()
     for fname in os.listdir(export_path):
@@ -284,44 +437,97 @@ class Learner(object):
       file_uploader.send('register_checkpoint',
                          src_fname=os.path.join(export_path, fname),
                          dst_fname=fname,
-                         dst_dir_name='%d/' % self.global_step)
+                         dst_dir_name='%d/' % global_step)
     U.f_remove(export_path)
 
-  def _save_profile(self, options, run_metadata):
-    tl = timeline.Timeline(run_metadata.step_stats)
-    ctf = tl.generate_chrome_trace_format()
+  def _create_ckpt(self):
+    # save the model
+    if not self._async_checkpoint:
+      self._save_ckpt(self._saver, self.global_step)
+    elif self._ckpt_idle.is_set():
+      self._ckpt_idle.clear()
+      self._ckpt_pending = False
+      self.sess.run(self._ckpt_snapshot_op)
+      self._ckpt_queue.put(self.global_step)
+    else:
+      # coalesced into the snapshot taken once the upload finishes.
+      self._ckpt_pending = True
+
+  def _write_ckpt_snapshots(self):
+    while True:
+      global_step = self._ckpt_queue.get()
+      if global_step is None:
+        return
+      self._save_ckpt(self._ckpt_snapshot_saver, global_step)
+      self._ckpt_idle.set()
+
+  def _upload_profile(self, ctf, dst_fname):
     export_path = os.path.join(TEMP_FOLDER, str(uuid.uuid4()))
     U.f_mkdir(export_path)
-    with open(os.path.join(export_path, 'timeline.json'), 'w') as f:
+    with open(os.path.join(export_path, dst_fname), 'w') as f:
       f.write(ctf)
     file_uploader = self._get_file_uploader()
     file_uploader.send('register_profile',
-                       src_fname=os.path.join(export_path, 'timeline.json'),
-                       dst_fname='timeline.json',
+                       src_fname=os.path.join(export_path, dst_fname),
+                       dst_fname=dst_fname,
                        dst_dir_name='')  # dst_dir_name is unused.
     U.f_remove(export_path)
 
+  def _save_profile(self, options, run_metadata):
+    tl = timeline.Timeline(run_metadata.step_stats)
+    self._upload_profile(tl.generate_chrome_trace_format(), 'timeline.json')
+
+  def _upload_traces(self):
+    while True:
+      trace = self._trace_queue.get()
+      if trace is None:
+        return
+      fname, spans, step, run_metadata = trace
+      ctf = timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format()
+      self._upload_profile(merge_host_spans(ctf, spans, step), fname)
+
   @property
   def global_step(self):
-    return self.sess.run(self._global_step_op)
+    return self._global_step
+
+  def _update_global_step(self, log_vals):
+    if GLOBAL_STEP_KEY in log_vals:
+      self._global_step = int(log_vals[GLOBAL_STEP_KEY])
+    else:
+      self._global_step = self.sess.run(self._global_step_op)
 
   def main(self):
     for _ in range(self.config.n_train_steps):
       system_logs = dict()
+      step = self.global_step
+      tracing = self._tracer.begin_step(step)
+      # host side spans of the step.
+      timers = dict()
 
       # fetch the next training batch
       with U.Timer() as batch_timer:
-        batch = self._exp_fetcher.get()
+        if self._use_staging_area:
+          # the update dequeues the batch from the staging area.
+          replay_keys, is_weights = self._staged_replay_tags.get()
+        else:
+          batch = self._get_batch()
+          replay_keys, is_weights = _pop_replay_tags(batch)
 
       with U.Timer() as step_timer:
         # run update step on the sampled batch
-        feed_dict = {ph: val for ph, val in zip(nest.flatten(self._traj_phs), nest.flatten(batch))}
+        with U.Timer() as timers['feed']:
+          if self._use_staging_area:
+            feed_dict = {}
+          else:
+            feed_dict = self._mk_feed_dict(batch)
+        profile = self.global_step == self._profile_step
         profile_kwargs = {}
-        if self.global_step == self._profile_step:
+        if profile or tracing:
           profile_kwargs = dict(options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
                                 run_metadata=tf.RunMetadata())
 
-        ret = self._agent.update(self.sess, feed_dict, profile_kwargs)
+        with U.Timer() as timers['update']:
+          ret = self._agent.update(self.sess, feed_dict, profile_kwargs)
 
         if isinstance(ret, dict):
           log_vals = ret
@@ -329,7 +535,15 @@ class Learner(object):
         else:
           log_vals, var_log_vals = ret
 
-        if profile_kwargs:
+        self._update_global_step(log_vals)
+        # per-sample priorities are not logged.
+        priorities = log_vals.pop(PRIORITIES_KEY, None)
+        if replay_keys is not None and priorities is not None:
+          self._send_priorities(replay_keys, priorities)
+        if is_weights is not None:
+          log_vals['replay/is_weight'] = float(np.mean(is_weights))
+
+        if profile:
           self._save_profile(**profile_kwargs)
 
       with U.Timer() as log_timer:
@@ -349,12 +563,15 @@ class Learner(object):
         with U.Timer() as publish_timer:
           self._publish_variables()
         system_logs['publish_time_sec'] = publish_timer.to_seconds()
+        timers['publish'] = publish_timer
 
       # Checkpoint if required
-      if self.global_step % self._checkpoint_every == 0:
+      ckpt_due = self.global_step % self._checkpoint_every == 0
+      if ckpt_due or (self._async_checkpoint and self._ckpt_pending):
         with U.Timer() as ckpt_timer:
           self._create_ckpt()
         system_logs['ckpt_time_sec'] = ckpt_timer.to_seconds()
+        timers['checkpoint'] = ckpt_timer
 
       with U.Timer() as system_log_timer:
         # log system profile
@@ -367,4 +584,20 @@ class Learner(object):
                    **system_logs))
       system_logs['log_time_sec'] = log_timer.to_seconds() + system_log_timer.to_seconds()
 
+      timers.update(prefetch_wait=batch_timer, log=log_timer, system_log=system_log_timer)
+      trace = self._tracer.end_step(step, timers['update'].to_seconds(), timers)
+      if trace is not None:
+        # the trace is converted and uploaded in the background.
+        self._trace_queue.put(trace + (step, profile_kwargs['run_metadata']))
+
     self._publish_queue.put(None)  # exit the thread once training ends.
+    if self._trace_thread is not None:
+      self._trace_queue.put(None)
+    if self._async_checkpoint:
+      # a checkpoint coalesced while the last snapshot was being written
+      # would otherwise be lost.
+      self._ckpt_idle.wait()
+      if self._ckpt_pending:
+        self._create_ckpt()
+      self._ckpt_queue.put(None)
+      self._ckpt_thread.join()
@@ -7,6 +7,7 @@ from threading import Thread
 
 import liaison.utils as U
 import tensorflow as tf
+from liaison.agents.losses.vtrace import PRIORITIES_KEY
 from liaison.distributed import Trajectory
 from liaison.session.tracker import PeriodicTracker
 from liaison.utils import ConfigDict, logging
@@ -91,4 +92,5 @@ class Learner(object):
     # run update step on the sampled batch
     feed_dict = {ph: val for ph, val in zip(nest.flatten(self._traj_phs), nest.flatten(batch))}
     log_vals = self._agent.update(self.sess, feed_dict, {})
+    log_vals.pop(PRIORITIES_KEY, None)
     return log_vals
@@ -0,0 +1,85 @@
+"""
+  Transport encodings for the parameters served to the actors.
+
+  codec can be one of:
+    None: variables are sent as is.
+    'lz4': loss-less compression of the array buffer.
+    'fp16', 'bf16': float arrays are rounded to 16 bits for the transport
+      and cast back to their dtype on the receiving end. Halves the
+      bytes at the cost of precision which is fine for acting.
+
+  Encoded variables are tuples (codec, dtype, shape, payload) so that
+  decode can tell them apart from the variables sent as is.
+"""
+import numpy as np
+import pyarrow as pa
+
+CODECS = (None, 'lz4', 'fp16', 'bf16')
+# Buffers smaller than this are not worth compressing.
+MIN_COMPRESS_BYTES = 1024
+
+_pa_codecs = {}
+
+
+def _get_pa_codec(name):
+  if name not in _pa_codecs:
+    _pa_codecs[name] = pa.Codec(name)
+  return _pa_codecs[name]
+
+
+def _to_bf16(a):
+  bits = np.ascontiguousarray(a, dtype=np.float32).view(np.uint32)
+  # round to nearest even.
+  bits = bits + (np.uint32(0x7FFF) + ((bits >> 16) & 1))
+  return (bits >> 16).astype(np.uint16)
+
+
+def _from_bf16(a):
+  return (a.astype(np.uint32) << 16).view(np.float32)
+
+
+def encode(value, codec):
+  if codec not in CODECS:
+    raise ValueError('Unknown parameter codec: %s' % codec)
+  value = np.asarray(value)
+  if codec is None:
+    return value
+
+  if codec == 'lz4':
+    if value.nbytes < MIN_COMPRESS_BYTES or value.dtype == object:
+      return value
+    payload = _get_pa_codec(codec).compress(np.ascontiguousarray(value), asbytes=True)
+  else:
+    if not np.issubdtype(value.dtype, np.floating) or value.dtype.itemsize <= 2:
+      return value
+    if codec == 'fp16':
+      payload = value.astype(np.float16)
+    else:
+      payload = _to_bf16(value)
+  return (codec, value.dtype.str, value.shape, payload)
+
+
+def decode(value):
+  if not isinstance(value, tuple):
+    return value
+  codec, dtype, shape, payload = value
+  dtype = np.dtype(dtype)
+  if codec == 'lz4':
+    buf = _get_pa_codec(codec).decompress(payload,
+                                          decompressed_size=int(np.prod(shape)) * dtype.itemsize,
+                                          asbytes=True)
+    return np.frombuffer(buf, dtype=dtype).reshape(shape)
+  elif codec == 'fp16':
+    return np.asarray(payload).astype(dtype, copy=False)
+  elif codec == 'bf16':
+    return _from_bf16(np.asarray(payload)).astype(dtype, copy=False).reshape(shape)
+  else:
+    raise ValueError('Unknown parameter codec: %s' % codec)
+
+
+def encode_parameters(params, codec):
+  return {k: encode(v, codec) for k, v in params.items()}
+
+
+def decode_parameters(params):
+  return {k: decode(v) for k, v in params.items()}
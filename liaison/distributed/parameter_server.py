@@ -2,48 +2,196 @@
     Defines the parameter publishing mechanism that propagates
         updated parameters from the learner to agents
 """
+import bisect
+import hashlib
 import os
 import sys
+import threading
 import time
+import uuid
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Process
 
 import liaison.utils as U
+import numpy as np
 from absl import logging
-from caraml.zmq import (ZmqClient, ZmqProxyThread, ZmqPub, ZmqServer, ZmqSub,
-                        ZmqTimeoutError)
+from caraml.zmq import (ZmqClient, ZmqPub, ZmqServer, ZmqSub, ZmqTimeoutError)
+from liaison.distributed.parameter_codec import decode_parameters, encode
 
 # type can be 'info' or 'parameters'
-# if hash is None, then force fetch
-# else, fetch only if hash has changed.
+# version: (learner_id, publish_iteration) of the parameters held by the
+#   client. If None, then force fetch. Else, fetch only the variables
+#   that have changed since then.
 # var_list: List of variables to fetch
 # agent_scope: Substitute agent scope with learner scope for fetching
-PSRequest = namedtuple('PSRequest',
-                       ['type', 'hash', 'var_list', 'agent_scope'])
+# codec: transport encoding of the parameters (see parameter_codec)
+PSRequest = namedtuple('PSRequest', ['type', 'version', 'var_list', 'agent_scope', 'codec'])
 PSRequest.__new__.__defaults__ = (None, ) * len(PSRequest._fields)
 
 # type can be 'info' or 'parameters' or 'not_ready' or 'no_change'
 # not_ready indicates that the parameter server has no data to serve.
-# no_change means that the parameters have not changed since last hash.
+# no_change means that the parameters have not changed since last version.
 # info => dict of learner side info
 # parameters => valid only for the 'parameters' type
 PSResponse = namedtuple('PSResponse', ['type', 'info', 'parameters'])
 PSResponse.__new__.__defaults__ = (None, ) * len(PSResponse._fields)
 
 
+def _shard_key(var_name):
+  # scope differs between the learner and the agents.
+  return var_name.split('/', 1)[-1]
+
+
+def _shard_topic(shard):
+  # trailing / so that no topic is a prefix of another.
+  return 'ps/%d/' % shard
+
+
+class ConsistentHashRing(object):
+  """
+        Assigns variables to parameter server shards.
+
+        Every shard is placed at n_virtual_nodes points of a hash ring and
+        a key belongs to the shard at the next point. Changing the # of
+        shards moves only ~1/shards of the keys. md5 is used (instead of
+        python's hash) so that all the processes agree on the assignment.
+    """
+
+  def __init__(self, n_shards, n_virtual_nodes=64):
+    points = sorted((self._hash('%d/%d' % (shard, i)), shard)
+                    for shard in range(n_shards)
+                    for i in range(n_virtual_nodes))
+    self._points = [point for point, _ in points]
+    self._shards = [shard for _, shard in points]
+    self.n_shards = n_shards
+    self._cache = {}
+
+  @staticmethod
+  def _hash(key):
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+  def shard(self, key):
+    if key not in self._cache:
+      i = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+      self._cache[key] = self._shards[i]
+    return self._cache[key]
+
+
+class ParameterStore(object):
+  """
+        Versioned snapshots of the parameters published by the learner.
+
+        Publishes are versioned (learner_id, publish_iteration) by the
+        publisher. The iteration at which each variable last changed is
+        tracked, so that clients holding an older version from the same
+        learner are sent only the changed variables. Encoded variables
+        are cached per codec till they change.
+    """
+
+  def __init__(self):
+    # (parameters, info, var_name -> iteration changed at, encoded cache)
+    # swapped in one go so that the serving thread sees a consistent view.
+    self._snapshot = None
+    # version of the publish before the latest one, if comparable.
+    self._base_version = None
+
+  @property
+  def param_info(self):
+    return None if self._snapshot is None else self._snapshot[1]
+
+  def set(self, parameters, info):
+    learner_id, iteration = info['version']
+    if self._snapshot is None or self._snapshot[1]['version'][0] != learner_id:
+      # iterations of another learner (or a restarted one) aren't comparable.
+      prev_params, changed_at, encoded = {}, {}, {}
+      self._base_version = None
+    else:
+      prev_params, prev_info, changed_at, encoded = self._snapshot
+      changed_at = dict(changed_at)
+      encoded = dict(encoded)
+      self._base_version = prev_info['version']
+
+    for var_name, val in parameters.items():
+      if var_name in prev_params and np.array_equal(prev_params[var_name], val):
+        continue
+      changed_at[var_name] = iteration
+      for k in [k for k in encoded if k[0] == var_name]:
+        del encoded[k]
+
+    self._snapshot = (parameters, info, changed_at, encoded)
+
+  def handle_request(self, request):
+    if self._snapshot is None:
+      return PSResponse(type='not_ready')
+    parameters, info, changed_at, encoded = self._snapshot
+
+    if request.type == 'info':
+      return PSResponse(type='info', info=info)
+
+    elif request.type == 'parameter':
+      learner_id, iteration = info['version']
+      since = 0
+      if request.version is not None:
+        client_learner_id, client_iteration = request.version
+        if client_learner_id == learner_id:
+          if client_iteration == iteration:  # param not changed
+            return PSResponse(type='no_change', info=info)
+          since = client_iteration
+
+      params_asked_for = {}
+      for var_name in request.var_list:
+        name = var_name.replace(request.agent_scope + '/', info['agent_scope'] + '/', 1)
+        if changed_at[name] <= since:
+          continue
+        params_asked_for[var_name] = self._encoded(parameters, encoded, name, request.codec)
+      return PSResponse(type='parameters', info=info, parameters=params_asked_for)
+    else:
+      raise ValueError('invalid request type received: %s' % (request.type))
+
+  def broadcast_message(self, codec):
+    """
+        Returns (base_version, parameters, info) to push to the subscribers
+        after a publish. parameters holds only the variables that changed
+        since base_version, the publish before. (All of them if
+        base_version is None)
+    """
+    parameters, info, changed_at, encoded = self._snapshot
+    iteration = info['version'][1]
+    base_version = self._base_version
+    params = {}
+    for name in parameters:
+      if base_version is None or changed_at[name] == iteration:
+        params[name] = self._encoded(parameters, encoded, name, codec)
+    return base_version, params, info
+
+  @staticmethod
+  def _encoded(parameters, encoded, name, codec):
+    k = (name, codec)
+    if k not in encoded:
+      encoded[k] = encode(parameters[name], codec)
+    return encoded[k]
+
+
 class ParameterPublisher(object):
   """
         Publishes parameters from the learner side
         Using ZmqPub socket
     """
 
-  def __init__(self, port, agent_scope):
+  def __init__(self, port, agent_scope, n_shards=1):
     """
         Args:
             port: the port connected to the pub socket
             module_dict: ModuleDict object that exposes model parameters
+            n_shards: # of parameter server shards to split the variables
+                across. (see ShardedParameterServer)
         """
     self._agent_scope = agent_scope
+    self._ring = ConsistentHashRing(n_shards)
+    # parameters are versioned (learner_id, # of publishes).
+    self._learner_id = uuid.uuid4().hex
+    self._n_publishes = 0
     self._publisher = ZmqPub(
         host='*',
         port=port,
@@ -63,52 +211,56 @@ class ParameterPublisher(object):
         'time': time.time(),
         'iteration': iteration,
         'variable_list': list(var_dict.keys()),
-        'hash': U.pyobj_hash(var_dict),
+        'version': self._next_version(),
     }
+    shard_var_dicts = [dict() for _ in range(self._ring.n_shards)]
+    for var_name, val in var_dict.items():
+      shard_var_dicts[self._ring.shard(_shard_key(var_name))][var_name] = val
     print('Publishing to the parameter server.')
-    self._publisher.pub(topic='ps', data=(var_dict, info))
+    # every shard gets the publish (even if empty) so that all are versioned.
+    for shard, shard_var_dict in enumerate(shard_var_dicts):
+      self._publisher.pub(topic=_shard_topic(shard), data=(shard_var_dict, info))
+
+  def _next_version(self):
+    self._n_publishes += 1
+    return (self._learner_id, self._n_publishes)
 
 
 class ShardedParameterServer(object):
   """
         Runs multiple parameter servers in parallel processes.
+        Each one owns the subset of variables assigned to it by a
+        ConsistentHashRing and serves them on the ps-frontend port
+        of the shard. (see U.shard_service_name)
+        Use with ParameterPublisher with the same n_shards and
+        ParameterClient with the ports of all the shards.
     """
 
   def __init__(self, shards, supress_output=False):
     self.shards = shards
 
     # Serving parameter to agents
-    self.frontend_port = os.environ['SYMPH_PS_FRONTEND_PORT']
-    self.backend_port = os.environ['SYMPH_PS_BACKEND_PORT']
-    self.serving_frontend_add = "tcp://*:{}".format(self.frontend_port)
-    self.serving_backend_add = "tcp://*:{}".format(self.backend_port)
+    self.frontend_ports = [U.get_service_port('ps-frontend', i) for i in range(shards)]
 
     # Subscribing to learner published parameters
     self.publisher_host = os.environ['SYMPH_PARAMETER_PUBLISH_HOST']
     self.publisher_port = os.environ['SYMPH_PARAMETER_PUBLISH_PORT']
 
     self._supress_output = supress_output
-    self.proxy = None
     self.workers = []
 
   def launch(self):
     """
-        Runs load balancing proxy thread
-            and self.shards ParameterServer processes
-        Returns after all threads and processes are running
+        Runs self.shards ParameterServer processes
+        Returns after all processes are running
     """
-    self.proxy = ZmqProxyThread(in_add=self.serving_frontend_add,
-                                out_add=self.serving_backend_add,
-                                pattern='router-dealer')
-    self.proxy.start()
-
     self.workers = []
     for i in range(self.shards):
       worker = ParameterServer(publisher_host=self.publisher_host,
                                publisher_port=self.publisher_port,
-                               serving_host='localhost',
-                               serving_port=self.backend_port,
-                               load_balanced=True,
+                               serving_host='*',
+                               serving_port=self.frontend_ports[i],
+                               shard=i,
                                supress_output=self._supress_output)
       worker.start()
       self.workers.append(worker)
@@ -117,7 +269,6 @@ class ShardedParameterServer(object):
     """
             Wait for all parameter server workers to exit
                 (Currently this means they crashed)
-            Note that proxy is a daemon thread and doesn't need waiting
         """
     for i, worker in enumerate(self.workers):
       worker.join()
@@ -133,8 +284,10 @@ class ParameterServer(Process):
         Standalone script for PS node that runs in an infinite loop.
         The ParameterServer subscribes to learner to get the latest
             model parameters and serves these parameters to agents
-        It implements a simple hash based caching mechanism to avoid
+        It implements a simple version based caching mechanism to avoid
             serving duplicate parameters to agent
+        and serves only the changed variables to agents
+            that hold an older version. (see ParameterStore)
     """
 
   def __init__(
@@ -144,6 +297,7 @@ class ParameterServer(Process):
       serving_host,
       serving_port,
       load_balanced=False,
+      shard=0,
       supress_output=False,
   ):
     """
@@ -152,8 +306,10 @@ class ParameterServer(Process):
             serving_host, serving_port: where to serve parameters to agents
             load_balanced: whether multiple parameter servers are sharing the
                 same address
+            shard: shard of the variables to serve.
         """
     Process.__init__(self)
+    self.shard = shard
     self.publisher_host = publisher_host
     self.publisher_port = publisher_port
     self.serving_host = serving_host
@@ -161,8 +317,7 @@ class ParameterServer(Process):
     self.load_balanced = load_balanced
     self._supress_output = supress_output
     # storage
-    self.parameters = None
-    self.param_info = None
+    self._store = ParameterStore()
     # threads
     self._subscriber = None
     self._server = None
@@ -182,7 +337,7 @@ class ParameterServer(Process):
         host=self.publisher_host,
         port=self.publisher_port,
         # handler=self._set_storage,
-        topic='ps',
+        topic=_shard_topic(self.shard),
         deserializer=U.deserialize,
     )
     self._server = ZmqServer(
@@ -204,37 +359,15 @@ class ParameterServer(Process):
 
   def _set_storage(self, data):
     logging.info('Set storage called on ps')
-    self.parameters, self.param_info = data
-    logging.info('_set_storage received info: {}'.format(self.param_info))
+    self._store.set(*data)
+    logging.info('_set_storage received info: {}'.format(self._store.param_info))
 
   def _handle_agent_request(self, request):
     """Reply to agents' request for parameters."""
 
     request = PSRequest(**request)
     logging.info('Request received of type: %s', request.type)
-
-    if self.param_info is None:
-      return PSResponse(type='not_ready')._asdict()
-
-    if request.type == 'info':
-      return PSResponse(type='info', info=self.param_info)._asdict()
-
-    elif request.type == 'parameter':
-      if request.hash is not None:
-        if request.hash == self.param_info['hash']:  # param not changed
-          return PSResponse(type='no_change', info=self.param_info)._asdict()
-
-      params_asked_for = {
-          var_name: self.parameters[var_name.replace(
-              request.agent_scope + '/', self.param_info['agent_scope'] + '/',
-              1)]
-          for var_name in request.var_list
-      }
-      return PSResponse(type='parameters',
-                        info=self.param_info,
-                        parameters=params_asked_for)._asdict()
-    else:
-      raise ValueError('invalid request type received: %s' % (request.type))
+    return self._store.handle_request(request)._asdict()
 
 
 class ParameterClient(object):
@@ -250,45 +383,93 @@ class ParameterClient(object):
       agent_scope,
       timeout=2,
       not_ready_sleep=2,
+      codec=None,
   ):
     """
         Args:
             host: parameter server host
-            port: parameter server port
+            port: parameter server port or a list with the port
+                of every parameter server shard.
             timeout: how long should the the client wait
                 if the parameter server is not available
+            codec: transport encoding of the parameters.
+                (see parameter_codec)
         """
+    ports = port if isinstance(port, (list, tuple)) else [port]
+    n_shards = len(ports)
     self.host = host
-    self.port = port
+    self.ports = ports
     self.timeout = timeout
+    self._codec = codec
     self._current_info = {}
-    self._last_hash = ''
     self.alive = False
     self._agent_scope = agent_scope
     self._not_ready_sleep = not_ready_sleep
 
-    self._client = ZmqClient(host=self.host,
-                             port=self.port,
-                             timeout=self.timeout,
-                             serializer=U.serialize,
-                             deserializer=U.deserialize)
+    self._ring = ConsistentHashRing(n_shards)
+    # version of the parameters held from each shard.
+    self._versions = [None] * n_shards
+    self._clients = [
+        ZmqClient(host=self.host,
+                  port=port,
+                  timeout=self.timeout,
+                  serializer=U.serialize,
+                  deserializer=U.deserialize) for port in ports
+    ]
+    # info is the same on all shards.
+    self._client = self._clients[0]
+    # fetches from the shards in parallel.
+    self._pool = None
+
+  @property
+  def _version(self):
+    return self._versions[0]
 
   def fetch_parameter_with_info(self, var_names, force_update=False):
     """Keeps trying on time out errors and not ready responses until
-      fetch is successful."""
-
+      fetch is successful.
+
+      Returns only the variables that changed since the last fetch
+      (all of them on the first fetch or with force_update)."""
+
+    if self._ring.n_shards == 1:
+      return self._fetch_shard(0, var_names, force_update)
+
+    shard_var_names = [[] for _ in range(self._ring.n_shards)]
+    for var_name in var_names:
+      shard_var_names[self._ring.shard(_shard_key(var_name))].append(var_name)
+
+    if self._pool is None:
+      self._pool = ThreadPoolExecutor(self._ring.n_shards)
+    futures = [
+        self._pool.submit(self._fetch_shard, shard, names, force_update)
+        for shard, names in enumerate(shard_var_names) if names
+    ]
+    params = None
+    infos = []
+    for future in futures:
+      shard_params, info = future.result()
+      infos.append(info)
+      if shard_params is not None:
+        params = params or {}
+        params.update(shard_params)
+    # report the info of the most stale shard.
+    return params, min(infos, key=lambda info: info['version'][1])
+
+  def _fetch_shard(self, shard, var_names, force_update):
     if force_update:
-      use_hash = None
+      use_version = None
     else:
-      use_hash = self._last_hash
+      use_version = self._versions[shard]
 
     while True:
       try:
-        response = self._client.request(
+        response = self._clients[shard].request(
             PSRequest(type='parameter',
-                      hash=use_hash,
+                      version=use_version,
                       var_list=var_names,
-                      agent_scope=self._agent_scope)._asdict())
+                      agent_scope=self._agent_scope,
+                      codec=self._codec)._asdict())
       except ZmqTimeoutError:
         logging.info('ZmQ timed out.')
         self.on_fetch_parameter_failed()
@@ -297,7 +478,7 @@ class ParameterClient(object):
       self.on_fetch_parameter_success()
       response = PSResponse(**response)
 
-      if use_hash is None:
+      if use_version is None:
         assert response.type != 'no_change'
 
       if response.type == 'not_ready':
@@ -305,12 +486,12 @@ class ParameterClient(object):
         time.sleep(self._not_ready_sleep)
 
       elif response.type == 'no_change':
-        assert self._last_hash == response.info['hash']
+        assert self._versions[shard] == tuple(response.info['version'])
         return None, response.info
 
       else:
-        self._last_hash = response.info['hash']
-        return response.parameters, response.info
+        self._versions[shard] = tuple(response.info['version'])
+        return decode_parameters(response.parameters), response.info
 
   def fetch_info(self):
     """
@@ -325,7 +506,7 @@ class ParameterClient(object):
       try:
         response = self._client.request(
             PSRequest(type='info',
-                      hash=self._last_hash,
+                      version=self._version,
                       var_list=None,
                       agent_scope=self._agent_scope)._asdict())
       except ZmqTimeoutError:
@@ -351,7 +532,7 @@ class ParameterClient(object):
     try:
       response = self._client.request(
           PSRequest(type='info',
-                    hash=self._last_hash,
+                    version=self._version,
                     var_list=None,
                     agent_scope=self._agent_scope)._asdict())
     except ZmqTimeoutError:
@@ -381,3 +562,79 @@ class ParameterClient(object):
     if not self.alive:
       self.alive = True
       logging.info('Parameter client came back alive')
+
+
+class ParameterSubscriber(object):
+  """
+        On agent side, receives the parameters that the parameter server
+        pushes after every publish (see broadcast_port of
+        SimpleParameterServer) in a background thread.
+
+        Broadcasts carry only the variables changed since the publish
+        before. If a broadcast is missed (slow joiner or dropped message)
+        the variables are pulled with the ParameterClient instead.
+    """
+
+  def __init__(self, host, port, ps_client, agent_scope, var_names):
+    """
+        Args:
+            host, port: where the parameter server broadcasts.
+            ps_client: ParameterClient to pull with.
+            var_names: variables to subscribe to.
+        """
+    self._ps_client = ps_client
+    self._agent_scope = agent_scope
+    self._var_names = list(var_names)
+    self._var_names_set = set(var_names)
+    # var_name -> value received since the last get_latest.
+    self._latest = {}
+    self._version = None
+    # info of the latest parameters received.
+    self.info = None
+    # serializes the updates from the broadcasts and the pulls.
+    self._update_lock = threading.Lock()
+    self._subscriber = ZmqSub(
+        host=host,
+        port=port,
+        topic='ps',
+        deserializer=U.deserialize,
+    )
+    self._subscriber_thread = self._subscriber.start_loop(handler=self._on_broadcast,
+                                                          blocking=False)
+
+  def get_latest(self):
+    """
+        Returns the variables changed since the last call.
+        Doesn't block except for the first call which waits until the
+        parameters are pulled from the parameter server.
+    """
+    if self._version is None:
+      with self._update_lock:
+        if self._version is None:
+          self._pull()
+    with self._update_lock:
+      latest, self._latest = self._latest, {}
+    return latest
+
+  def _pull(self):
+    params, info = self._ps_client.fetch_parameter_with_info(self._var_names)
+    if params:
+      self._latest.update(params)
+    self._version = tuple(info['version'])
+    self.info = info
+
+  def _on_broadcast(self, data):
+    base_version, params, info = data
+    with self._update_lock:
+      if base_version is None or tuple(base_version) != self._version:
+        if self._version is not None:
+          logging.info('Missed a parameter broadcast. Pulling instead.')
+        self._pull()
+        return
+      params = decode_parameters(params)
+      for name, val in params.items():
+        var_name = name.replace(info['agent_scope'] + '/', self._agent_scope + '/', 1)
+        if var_name in self._var_names_set:
+          self._latest[var_name] = val
+      self._version = tuple(info['version'])
+      self.info = info
@@ -0,0 +1,68 @@
+"""
+Learner side.
+Send priority updates for the sampled experience back to the replay.
+"""
+from collections import defaultdict
+from queue import Queue
+
+import liaison.utils as U
+import numpy as np
+from caraml.zmq import ZmqClient
+
+from .exp_serializer import get_deserializer, get_serializer
+
+# Prioritized replays tag each sampled experience with
+# (replay index, slot, generation) under this key.
+REPLAY_KEY = 'replay_key'
+# and with their normalized importance-sampling weight under this key.
+IS_WEIGHT_KEY = 'is_weight'
+# Request sent to the replay shards to update priorities.
+UPDATE_PRIORITIES_REQUEST = 'update_priorities'
+
+
+class PrioritySender(object):
+  """Sends (replay_keys, priorities) to the replay shards they came from.
+
+  Every replay shard serves priority updates on its own port, so the
+  updates are grouped by the replay index in the keys and every group is
+  sent to its own shard. Requests are sent from a background thread so that
+  the learner doesn't wait on the replay.
+  """
+
+  def __init__(self, *, host, ports, compress_before_send, max_queue=16):
+    """
+      Args:
+        ports: priority port of every replay shard.
+    """
+    self._host = host
+    self._ports = ports
+    self._compress_before_send = compress_before_send
+    # replay index -> client. connected on the first update to the shard.
+    self._clients = {}
+    self._queue = Queue(max_queue)
+    self._thread = U.start_thread(self._send_loop, daemon=True)
+
+  def send(self, replay_keys, priorities):
+    assert len(replay_keys) == len(priorities)
+    groups = defaultdict(lambda: ([], []))
+    for key, p in zip(replay_keys, priorities):
+      keys, prios = groups[key[0]]
+      keys.append(key)
+      prios.append(p)
+    for index, (keys, prios) in groups.items():
+      self._queue.put((index, (UPDATE_PRIORITIES_REQUEST, keys, np.asarray(prios,
+                                                                          dtype=np.float32))))
+
+  def _get_client(self, index):
+    if index not in self._clients:
+      self._clients[index] = ZmqClient(
+          host=self._host,
+          port=self._ports[index],
+          serializer=get_serializer(self._compress_before_send),
+          deserializer=get_deserializer(self._compress_before_send))
+    return self._clients[index]
+
+  def _send_loop(self):
+    while True:
+      index, request = self._queue.get()
+      self._get_client(index).request(request)
@@ -1,16 +1,20 @@
 """Shell for policy evaluation.
 
 Env variables used:
-  SYMPH_PS_FRONTEND_HOST
-  SYMPH_PS_FRONTEND_PORT
+  SYMPH_PS_SERVING_HOST
+  SYMPH_PS_SERVING_PORT
+  SYMPH_PS_SERVING_<shard>_PORT (with ps_n_shards > 1)
+  SYMPH_PS_BROADCAST_HOST (with ps_subscribe)
+  SYMPH_PS_BROADCAST_PORT (with ps_subscribe)
 """
 
 import copy
 import os
 
+import liaison.utils as U
 import tensorflow as tf
 from absl import logging
-from liaison.distributed import ParameterClient
+from liaison.distributed import ParameterClient, ParameterSubscriber
 from liaison.env import StepType
 from liaison.specs import ArraySpec
 from liaison.utils import ConfigDict
@@ -55,12 +59,31 @@ class Shell:
       sync_period=None,
       use_gpu=False,
       verbose=True,
+      ps_client_codec=None,
+      ps_subscribe=False,
+      ps_n_shards=1,
       **kwargs):
+    """
+    Args:
+      ps_client_codec: Transport encoding of the parameters fetched from
+        the parameter server. (see parameter_codec)
+      ps_subscribe: If True, subscribe to the parameters pushed by the
+        parameter server instead of polling it every sync_period steps.
+        The latest parameters received are swapped in at the next step.
+      ps_n_shards: # of parameter server shards to fetch the parameters
+        from. Not supported with ps_subscribe.
+    """
     self.config = ConfigDict(kwargs)
+    self._ps_client_codec = ps_client_codec
+    self._ps_subscribe = ps_subscribe
+    if ps_subscribe and ps_n_shards != 1:
+      raise ValueError('ps_subscribe is not supported with ps_n_shards > 1')
+    self._ps_n_shards = ps_n_shards
     self.verbose = verbose
     self._obs_spec = obs_spec
     if sync_period is not None:
-      self._sync_checker = SyncEveryNSteps(sync_period)
+      # checking for pushed parameters doesn't block, so do it every step.
+      self._sync_checker = SyncEveryNSteps(1 if ps_subscribe else sync_period)
       assert self._sync_checker.should_sync(0)  # must sync at the beginning
     else:
       self._sync_checker = SyncNever()
@@ -112,10 +135,23 @@ class Shell:
                             name='assign_%s_ph' % var.name.replace(':', '_'))
         self._var_name_to_phs[var.name] = ph
         self._var_names_to_assign_ops[var.name] = tf.assign(var, ph, use_locking=True)
+      # set of variable names -> op grouping their assigns so that a sync
+      # is a single sess.run. Only the variables changed since the last sync
+      # are fetched, which is mostly the same set every time.
+      self._fused_assign_ops = {
+          frozenset(self._variable_names): tf.group(*self._var_names_to_assign_ops.values())
+      }
       if restore_from:
         self.restore_from_checkpoint(restore_from)
     self._next_state = None
     self._ps_client = None
+    self._ps_subscriber = None
+    self._global_step = None
+
+  @property
+  def global_step(self):
+    """Learner's global step of the synced parameters. (None before the first sync)"""
+    return self._global_step
 
   @property
   def next_state(self):
@@ -126,36 +162,65 @@ class Shell:
 
   def _mk_phs(self, initial_state_dummy_spec):
 
+    # leading batch dimension is left unspecified so that
+    # a subset of the envs can be evaluated.
     def mk_ph(spec):
-      return tf.placeholder(dtype=spec.dtype, shape=spec.shape, name='shell_' + spec.name + '_ph')
+      return tf.placeholder(dtype=spec.dtype,
+                            shape=(None, ) + tuple(spec.shape[1:]),
+                            name='shell_' + spec.name + '_ph')
 
     self._step_type_ph = tf.placeholder(dtype=tf.int8, shape=(None, ), name='shell_step_type_ph')
     self._reward_ph = tf.placeholder(dtype=tf.float32, shape=(None, ), name='shell_reward_ph')
     self._obs_ph = nest.map_structure(mk_ph, self._obs_spec)
     self._next_state_ph = tf.placeholder(dtype=initial_state_dummy_spec.dtype,
-                                         shape=initial_state_dummy_spec.shape,
+                                         shape=(None, ) + initial_state_dummy_spec.shape[1:],
                                          name='next_state_ph')
 
   def _setup_ps_client(self):
     """Initialize self._ps_client and connect it to the ps."""
-    self._ps_client = ParameterClient(host=os.environ['SYMPH_PS_SERVING_HOST'],
-                                      port=os.environ['SYMPH_PS_SERVING_PORT'],
+    self._ps_client = ParameterClient(host=U.get_service_host('ps-serving'),
+                                      port=[
+                                          U.get_service_port('ps-serving', shard)
+                                          for shard in range(self._ps_n_shards)
+                                      ],
                                       agent_scope=self._agent_scope,
                                       timeout=self.config.ps_client_timeout,
-                                      not_ready_sleep=self.config.ps_client_not_ready_sleep)
+                                      not_ready_sleep=self.config.ps_client_not_ready_sleep,
+                                      codec=self._ps_client_codec)
+    if self._ps_subscribe:
+      self._ps_subscriber = ParameterSubscriber(host=os.environ['SYMPH_PS_BROADCAST_HOST'],
+                                                port=os.environ['SYMPH_PS_BROADCAST_PORT'],
+                                                ps_client=self._ps_client,
+                                                agent_scope=self._agent_scope,
+                                                var_names=self._variable_names)
 
   def _pull_vars(self):
     """get weights from the parameter server."""
-    params, unused_info = self._ps_client.fetch_parameter_with_info(self._variable_names)
+    if self._ps_subscriber is not None:
+      params = self._ps_subscriber.get_latest()
+      info = self._ps_subscriber.info
+    else:
+      params, info = self._ps_client.fetch_parameter_with_info(self._variable_names)
+    self._global_step = info['iteration']
     return params
 
+  def _get_fused_assign_op(self, var_names):
+    key = frozenset(var_names)
+    if key not in self._fused_assign_ops:
+      with self._graph.as_default():
+        self._fused_assign_ops[key] = tf.group(
+            *[self._var_names_to_assign_ops[var_name] for var_name in key])
+    return self._fused_assign_ops[key]
+
   def _sync_variables(self):
+    # only the variables changed since the last sync are returned.
+    # (nothing if the version hasn't changed, which skips the run.)
     var_vals = self._pull_vars()
     if var_vals:
-      assert sorted(var_vals.keys()) == sorted(self._variable_names) == sorted(
-          self._var_names_to_assign_ops.keys())
-      for var_name, assign_op in self._var_names_to_assign_ops.items():
-        self.sess.run(assign_op, feed_dict={self._var_name_to_phs[var_name]: var_vals[var_name]})
+      assert set(var_vals.keys()) <= set(self._var_names_to_assign_ops.keys())
+      self.sess.run(self._get_fused_assign_op(var_vals.keys()),
+                    feed_dict={self._var_name_to_phs[k]: v
+                               for k, v in var_vals.items()})
       logging.info("Synced weights.")
 
   def sync(self):
@@ -201,13 +266,22 @@ class Shell:
     print(f'Checkpt restored from {restore_path}')
     print(f'***********************************************')
 
-  def step(self, step_type, reward, observation):
+  def step(self, step_type, reward, observation, env_ids=None):
+    """
+    Args:
+      env_ids: If provided, the arguments hold only the timesteps of these
+        envs and the recurrent state is advanced only for them.
+    """
     if self._sync_checker.should_sync(self._step_number):
       self.sync()
 
+    if env_ids is None:
+      prev_state = self.next_state
+    else:
+      prev_state = self.next_state[env_ids]
     # bass the batch through pre-processing
     step_type, reward, obs, next_state = self._agent.step_preprocess(step_type, reward,
-                                                                     observation, self.next_state)
+                                                                     observation, prev_state)
     nest.assert_same_structure(self._obs_ph, observation)
     obs_feed_dict = {
         obs_ph: obs_val
@@ -223,7 +297,10 @@ class Shell:
                                 })
     if self.verbose and self._step_number % 100 == 0:
       print(step_output)
-    self._next_state = step_output.next_state
+    if env_ids is None:
+      self._next_state = step_output.next_state
+    else:
+      self._next_state[env_ids] = step_output.next_state
     self._step_number += 1
     return step_output
 
@@ -6,17 +6,19 @@ Simplify liaison.distributed.parameter_server by removing sharding
 import os
 import sys
 import time
+import uuid
 from collections import namedtuple
 from threading import Thread
 
 import liaison.utils as U
 from absl import logging
-from caraml.zmq import ZmqClient, ZmqProxyThread, ZmqServer, ZmqTimeoutError
-from liaison.distributed.parameter_server import PSRequest, PSResponse
+from caraml.zmq import (ZmqClient, ZmqProxyThread, ZmqPub, ZmqServer, ZmqTimeoutError)
+from liaison.distributed.parameter_server import (ConsistentHashRing, ParameterStore, PSRequest,
+                                                  PSResponse, _shard_key)
 
 # PublishRequest = namedtuple(
 #     'PublishRequest',
-#     ['time', 'iteration', 'variable_list', 'agent_scope', 'hash'])
+#     ['time', 'iteration', 'variable_list', 'agent_scope', 'version'])
 
 
 class ParameterPublisher(object):
@@ -29,18 +31,27 @@ class ParameterPublisher(object):
     """
         Args:
             host: IP of the ps
-            port: the port connected to the pub socket
+            port: the port connected to the pub socket or a list with
+                the port of every parameter server shard to split the
+                variables across. (see ConsistentHashRing)
         """
+    ports = port if isinstance(port, (list, tuple)) else [port]
     self._agent_scope = agent_scope
+    self._ring = ConsistentHashRing(len(ports))
+    # parameters are versioned (learner_id, # of publishes).
+    self._learner_id = uuid.uuid4().hex
+    self._n_publishes = 0
     self.alive = False
 
-    self._publisher = ZmqClient(
-        host=host,
-        port=port,
-        timeout=2,
-        serializer=U.serialize,
-        deserializer=U.deserialize,
-    )
+    self._publishers = [
+        ZmqClient(
+            host=host,
+            port=port,
+            timeout=2,
+            serializer=U.serialize,
+            deserializer=U.deserialize,
+        ) for port in ports
+    ]
 
   def publish(self, iteration, var_dict):
     """
@@ -55,17 +66,26 @@ class ParameterPublisher(object):
         'time': time.time(),
         'iteration': iteration,
         'variable_list': list(var_dict.keys()),
-        'hash': U.pyobj_hash(var_dict),
+        'version': self._next_version(),
     }
-    while True:
-      try:
-        self._publisher.request((var_dict, info))
-      except ZmqTimeoutError as e:
-        self.on_fetch_parameter_failed()
-        continue
-      break
+    shard_var_dicts = [dict() for _ in range(self._ring.n_shards)]
+    for var_name, val in var_dict.items():
+      shard_var_dicts[self._ring.shard(_shard_key(var_name))][var_name] = val
+    # every shard gets the publish (even if empty) so that all are versioned.
+    for publisher, shard_var_dict in zip(self._publishers, shard_var_dicts):
+      while True:
+        try:
+          publisher.request((shard_var_dict, info))
+        except ZmqTimeoutError as e:
+          self.on_fetch_parameter_failed()
+          continue
+        break
     self.on_fetch_parameter_success()
 
+  def _next_version(self):
+    self._n_publishes += 1
+    return (self._learner_id, self._n_publishes)
+
   def on_fetch_parameter_failed(self):
     """
             Called when connection with parameter server fails
@@ -90,14 +110,18 @@ class ParameterServer(Thread):
       Standalone script for PS node that runs in an infinite loop.
       The ParameterServer subscribes to learner to get the latest
           model parameters and serves these parameters to agents
-      It implements a simple hash based caching mechanism to avoid
+      It implements a simple version based caching mechanism to avoid
           serving duplicate parameters to agent
+      and serves only the changed variables to agents
+          that hold an older version. (see ParameterStore)
   """
 
   def __init__(
       self,
       publish_port,
       serving_port,
+      broadcast_port=None,
+      broadcast_codec=None,
       supress_output=False,
   ):
     """
@@ -105,17 +129,22 @@ class ParameterServer(Thread):
             publish_port: where learner should send parameters to.
             load_balanced: whether multiple parameter servers are sharing the
                 same address
+            broadcast_port: If set, the changed parameters are pushed to
+                the ParameterSubscribers on this port after every publish.
+            broadcast_codec: transport encoding of the broadcast parameters.
         """
     Thread.__init__(self)
     self.publish_port = publish_port
     self.serving_port = serving_port
+    self.broadcast_port = broadcast_port
+    self._broadcast_codec = broadcast_codec
     self._supress_output = supress_output
     # storage
-    self.parameters = None
-    self.param_info = None
+    self._store = ParameterStore()
     # threads
     self._subscriber = None
     self._server = None
+    self._broadcaster = None
     self._subscriber_thread = None
     self._server_thread = None
 
@@ -141,6 +170,12 @@ class ParameterServer(Thread):
         serializer=U.serialize,
         deserializer=U.deserialize,
     )
+    if self.broadcast_port:
+      self._broadcaster = ZmqPub(
+          host='*',
+          port=self.broadcast_port,
+          serializer=U.serialize,
+      )
     self._subscriber_thread = self._param_reciever.start_loop(
         handler=self._set_storage, blocking=False)
     self._server_thread = self._server.start_loop(
@@ -151,35 +186,14 @@ class ParameterServer(Thread):
     self._server_thread.join()
 
   def _set_storage(self, data):
-    self.parameters, self.param_info = data
-    logging.info('_set_storage received info: {}'.format(self.param_info))
+    self._store.set(*data)
+    logging.info('_set_storage received info: {}'.format(self._store.param_info))
+    if self._broadcaster is not None:
+      self._broadcaster.pub(topic='ps', data=self._store.broadcast_message(self._broadcast_codec))
 
   def _handle_agent_request(self, request):
     """Reply to agents' request for parameters."""
 
     request = PSRequest(**request)
     logging.info('Request received of type: %s', request.type)
-
-    if self.param_info is None:
-      return PSResponse(type='not_ready')._asdict()
-
-    if request.type == 'info':
-      return PSResponse(type='info', info=self.param_info)._asdict()
-
-    elif request.type == 'parameter':
-      if request.hash is not None:
-        if request.hash == self.param_info['hash']:  # param not changed
-          return PSResponse(type='no_change', info=self.param_info)._asdict()
-
-      params_asked_for = {
-          var_name: self.parameters[var_name.replace(
-              request.agent_scope + '/', self.param_info['agent_scope'] + '/',
-              1)]
-          for var_name in request.var_list
-      }
-      return PSResponse(type='parameters',
-                        info=self.param_info,
-                        parameters=params_asked_for)._asdict()
-
-    else:
-      raise ValueError('invalid request type received: %s' % (request.type))
+    return self._store.handle_request(request)._asdict()
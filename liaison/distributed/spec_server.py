@@ -12,8 +12,9 @@ from .trajectory import Trajectory
 
 class SpecServer(Thread):
 
-  def __init__(self, port, traj_spec, action_spec):
+  def __init__(self, port, traj_spec, action_spec, graph_obs_keys=None):
     self._traj_spec = traj_spec
+    self._graph_obs_keys = list(graph_obs_keys or [])
     self._action_spec = action_spec
     self.port = port
     super(SpecServer, self).__init__()
@@ -34,8 +35,11 @@ class SpecServer(Thread):
     self._server_thread.join()
 
   def _handle_request(self, req):
-    """req -> (batch_size, traj_length)"""
+    """req -> (batch_size, traj_length)
+
+    Returns (traj_spec, action_spec, graph_obs_keys)
+    """
     batch_size, _ = req
-    traj_spec = Trajectory.format_traj_spec(self._traj_spec, *req)
+    traj_spec = Trajectory.format_traj_spec(self._traj_spec, *req, self._graph_obs_keys)
     self._action_spec.set_shape((batch_size, ) + self._action_spec.shape[1:])
-    return traj_spec, self._action_spec
+    return traj_spec, self._action_spec, self._graph_obs_keys
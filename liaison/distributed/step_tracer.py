@@ -0,0 +1,87 @@
+"""Sampled tracing of the learner steps.
+
+A sampled step gets a full trace of its update sess.run. The host side
+spans of the step (waiting for the batch, feeding, update, publish,
+checkpoint and logging) are added to it as a separate process of the
+chrome trace. Traces go to a rolling set of files, so that the learner
+can be traced throughout a run.
+"""
+import json
+import math
+
+
+def merge_host_spans(chrome_trace, spans, step):
+  """Adds the host side spans to the chrome trace of the update.
+
+  Args:
+    chrome_trace: json str from timeline.Timeline.generate_chrome_trace_format
+    spans: List of (name, start time in secs since epoch, duration in secs)
+    step: global step of the traced step.
+  Returns:
+    chrome trace json str.
+  """
+  trace = json.loads(chrome_trace)
+  events = trace.setdefault('traceEvents', [])
+  pid = max([e['pid'] for e in events if isinstance(e.get('pid'), int)] + [-1]) + 1
+  events.append(
+      dict(name='process_name', ph='M', pid=pid, args=dict(name='Learner host (step %d)' % step)))
+  for name, start, duration in spans:
+    events.append(
+        dict(name=name, cat='host', ph='X', pid=pid, tid=0, ts=start * 1e6, dur=duration * 1e6))
+  return json.dumps(trace)
+
+
+class StepTracer:
+
+  def __init__(self, trace_every, max_traces, overhead_budget):
+    """
+    Args:
+      trace_every: Min # of steps between traced steps. 0 disables tracing.
+      max_traces: # of trace files to keep. The oldest one is overwritten.
+      overhead_budget: Max fraction of the update time to spend on the slow
+        down of the traced updates. Traced steps are spaced further apart
+        than trace_every if required.
+    """
+    self._trace_every = trace_every
+    self._max_traces = max_traces
+    self._overhead_budget = overhead_budget
+    self._next_trace_step = trace_every
+    self._n_traces = 0
+    # moving average of the untraced update time.
+    self._avg_update_time = None
+    self._tracing = False
+
+  def begin_step(self, step):
+    """Returns True if the step is to be traced."""
+    self._tracing = self._trace_every > 0 and step >= self._next_trace_step
+    return self._tracing
+
+  def end_step(self, step, update_time, timers):
+    """
+    Args:
+      step: global step at the beginning of the step.
+      update_time: time taken by the update sess.run in secs.
+      timers: dict of span name -> U.Timer of the host side spans.
+    Returns:
+      (fname, spans) for the traced step else None.
+    """
+    if not self._tracing:
+      if self._avg_update_time is None:
+        self._avg_update_time = update_time
+      else:
+        self._avg_update_time = .9 * self._avg_update_time + .1 * update_time
+      return None
+
+    self._tracing = False
+    interval = self._trace_every
+    if self._avg_update_time:
+      overhead = max(update_time - self._avg_update_time, 0.)
+      # tracing every n steps costs overhead / (n * avg_update_time).
+      interval = max(interval,
+                     int(math.ceil(overhead / (self._overhead_budget * self._avg_update_time))))
+    self._next_trace_step = step + interval
+
+    fname = 'trace_%d.json' % (self._n_traces % self._max_traces)
+    self._n_traces += 1
+    spans = [(name, timer.start, timer.to_seconds()) for name, timer in timers.items()]
+    return fname, sorted(spans, key=lambda span: span[1])
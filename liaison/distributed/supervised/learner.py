@@ -142,7 +142,7 @@ class Learner(object):
   def _get_specs(self):
     while True:
       try:
-        self._traj_spec, self._action_spec = self.spec_client.request(
+        self._traj_spec, self._action_spec, _ = self.spec_client.request(
             (self._batch_size, self._traj_length))
       except ZmqTimeoutError:
         logging.info('ZmQ timed out for the spec server. Retrying...')
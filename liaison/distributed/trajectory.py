@@ -3,13 +3,43 @@
 import copy
 import functools
 import pdb
+from collections import defaultdict, deque
 
 import numpy as np
 
 from liaison.agents import StepOutput
+from liaison.env import StepType
 from liaison.specs import ArraySpec, BoundedArraySpec
 from tensorflow.contrib.framework import nest
 
+# Episode-static observation fields are stored once per episode segment.
+# The stored leaf is a dict with
+#   STATIC_SEGMENTS_KEY: [n_segments, ...] -> value for each segment.
+#   STATIC_SEGMENT_IDS_KEY: [T + 1] -> index of the segment of each step.
+STATIC_SEGMENTS_KEY = 'static_segments'
+STATIC_SEGMENT_IDS_KEY = 'static_segment_ids'
+
+# Graph observations (dicts with GraphsTuple or BipartiteGraphsTuple fields)
+# are shipped with the padding of these fields stripped and are packed
+# into a single graph of (T + 1) * B graphs by the learner.
+# ragged field -> field with its per-graph count.
+GRAPH_RAGGED_FIELDS = dict(nodes='n_node',
+                           left_nodes='n_left_nodes',
+                           right_nodes='n_right_nodes',
+                           edges='n_edge',
+                           senders='n_edge',
+                           receivers='n_edge')
+
+
+# All keys starting with following get traj_length + 1 as the time dimension.
+T_PLUS_ONE_PATHS = ['step_type', 'reward', 'discount', 'observation', 'step_output/next_state']
+# All keys starting with following get traj_length as the time dimension.
+T_PATHS = ['step_output/action', 'step_output/logits']
+
+
+def has_t_plus_one_steps(path):
+  return any([path.startswith(x) for x in T_PLUS_ONE_PATHS])
+
 
 def expand_spec(spec):
   spec = copy.deepcopy(spec)
@@ -17,6 +47,115 @@ def expand_spec(spec):
   return spec
 
 
+def is_packed_static(v):
+  return isinstance(v, dict) and STATIC_SEGMENTS_KEY in v
+
+
+def unpack_static(v):
+  """Expands a packed static field to have a leading time dimension."""
+  if is_packed_static(v):
+    return v[STATIC_SEGMENTS_KEY][v[STATIC_SEGMENT_IDS_KEY]]
+  return v
+
+
+def _get_path(d, path):
+  for k in path.split('/'):
+    d = d[k]
+  return d
+
+
+def _replace_path(d, path, v):
+  """Returns a copy of the nested dict d with the value at path replaced."""
+  k, _, rest = path.partition('/')
+  d = dict(d)
+  d[k] = _replace_path(d[k], rest, v) if rest else v
+  return d
+
+
+def _strip_rows(rows, counts):
+  """[R, M, ...] rows padded to M -> [sum(counts), ...]"""
+  mask = np.arange(rows.shape[1]) < np.reshape(counts, (-1, 1))
+  return rows[mask]
+
+
+def strip_graph_padding(graph):
+  """Strips the padding of the ragged fields of a trajectory's graph observation.
+
+  Each ragged field [T + 1, M, ...] is replaced by the concatenation of its
+  T + 1 rows [sum(counts), ...]. Static fields are stripped per segment.
+  """
+  graph = dict(graph)
+  for field, count_field in GRAPH_RAGGED_FIELDS.items():
+    v = graph.get(field)
+    if v is None:
+      continue
+    counts = graph[count_field]
+    if is_packed_static(v):
+      assert is_packed_static(counts), 'counts of static fields must be static.'
+      graph[field] = {
+          STATIC_SEGMENTS_KEY: _strip_rows(v[STATIC_SEGMENTS_KEY], counts[STATIC_SEGMENTS_KEY]),
+          STATIC_SEGMENT_IDS_KEY: v[STATIC_SEGMENT_IDS_KEY],
+      }
+    else:
+      graph[field] = _strip_rows(v, unpack_static(counts))
+  return graph
+
+
+def _pack_rows(leaves, counts_leaves):
+  """Concatenates the stripped rows of B trajectories in time major order."""
+  values, starts, lens = [], [], []
+  base = 0
+  for v, counts in zip(leaves, counts_leaves):
+    if is_packed_static(v):
+      row_counts = counts[STATIC_SEGMENTS_KEY]
+      row_ids = v[STATIC_SEGMENT_IDS_KEY]
+      v = v[STATIC_SEGMENTS_KEY]
+    else:
+      row_counts = unpack_static(counts)
+      row_ids = np.arange(len(row_counts))
+    row_starts = base + np.cumsum(row_counts) - row_counts
+    starts.append(row_starts[row_ids])
+    lens.append(row_counts[row_ids])
+    values.append(v)
+    base += len(v)
+
+  # [T + 1, B] -> time major order of merge_first_two_dims.
+  starts = np.stack(starts, axis=1).ravel()
+  lens = np.stack(lens, axis=1).ravel()
+  indices = np.repeat(starts - (np.cumsum(lens) - lens), lens) + np.arange(lens.sum())
+  return np.concatenate(values)[indices]
+
+
+def pack_graphs(graphs, batched_graph):
+  """Packs the stripped graph observations of B trajectories.
+
+  Args:
+    graphs: List of B stripped graph observations. (see strip_graph_padding)
+    batched_graph: Batched graph observation holding the time major
+      [T + 1, B] counts.
+  Returns:
+    dict of the ragged fields of the (T + 1) * B graphs concatenated as in
+    a flattened GraphsTuple with the senders and receivers offset to index
+    into the concatenated nodes.
+  """
+  packed = {}
+  for field, count_field in GRAPH_RAGGED_FIELDS.items():
+    if graphs[0].get(field) is not None:
+      packed[field] = _pack_rows([g[field] for g in graphs], [g[count_field] for g in graphs])
+
+  if 'nodes' in batched_graph:
+    index_fields = dict(senders='n_node', receivers='n_node')
+  else:
+    index_fields = dict(senders='n_left_nodes', receivers='n_right_nodes')
+  n_edge = np.ravel(batched_graph['n_edge'])
+  for field, count_field in index_fields.items():
+    if field in packed:
+      n = np.ravel(batched_graph[count_field])
+      offsets = np.repeat(np.cumsum(n) - n, n_edge)
+      packed[field] = (packed[field] + offsets).astype(packed[field].dtype)
+  return packed
+
+
 class Trajectory(object):
   """
   Needs to collect the step environment outputs and
@@ -29,12 +168,30 @@ class Trajectory(object):
     reset: Clear the existing traj info.
   """
 
-  def __init__(
-      self,
-      obs_spec,
-      step_output_spec,
-  ):
+  def __init__(self,
+               obs_spec,
+               step_output_spec,
+               static_obs_keys=None,
+               traj_length=None,
+               graph_obs_keys=None):
+    """
+    Args:
+      static_obs_keys: List of paths (of form 'a/b') of the observation
+        fields that remain constant within an episode. These are
+        shipped once per episode segment instead of once per step.
+      traj_length: If provided, each unroll of traj_length + 1 steps is
+        written in place into preallocated per-field buffers instead of
+        being collected as a list of dicts and stacked at the end.
+        Each env keeps its own step counter in this mode, so that envs
+        can be stepped asynchronously (see `env_ids` in `add`).
+      graph_obs_keys: List of paths of the graph observations whose
+        padding is stripped before shipping. The learner packs them
+        with Trajectory.batch.
+    """
     self._trajs = None
+    self._static_obs_keys = list(static_obs_keys or [])
+    self._graph_obs_keys = list(graph_obs_keys or [])
+    self._traj_length = traj_length
     # Don't use shape in the spec since it's unknown
     self._traj_spec = dict(step_type=ArraySpec(dtype=np.int8,
                                                shape=(None, None),
@@ -47,13 +204,40 @@ class Trajectory(object):
                                               name='traj_discount_spec'),
                            observation=nest.map_structure(expand_spec, obs_spec),
                            step_output=nest.map_structure(expand_spec, step_output_spec))
+    if traj_length is not None:
+      self._setup_columnar_storage()
 
-  def start(self, step_type, reward, discount, observation, next_state):
+  def _setup_columnar_storage(self):
+    traj_spec = self._traj_spec
+    self._flat_specs = nest.flatten(traj_spec)
+    paths = nest.flatten(nest.map_structure_with_paths(lambda path, _: path, traj_spec))
+    static_paths = ['observation/' + k for k in self._static_obs_keys]
+    self._static_idx = set([i for i, path in enumerate(paths) if path in static_paths])
+    assert len(self._static_idx) == len(static_paths), 'unknown static observation keys'
+    # index of the step in the unroll at which a step's field is stored
+    # is shifted left by one for fields with traj_length time steps.
+    self._row_offset = [0 if has_t_plus_one_steps(path) else -1 for path in paths]
+    self._buf_lens = [self._traj_length + 1 + offset for offset in self._row_offset]
+    # observation spec has the leading batch dimension.
+    self._batch_size = nest.flatten(traj_spec['observation'])[0].shape[1]
+    # number of steps written so far for each env.
+    self._lens = np.zeros(self._batch_size, dtype=np.int64)
+    self._bufs = None
+    # buffers of the unrolls that were sent out. (see recycle)
+    self._free_bufs = deque()
+
+  def start(self, step_type, reward, discount, observation, next_state, env_ids=None):
     step_output = nest.map_structure(lambda *_: None, self._traj_spec['step_output'])
     step_output.update(next_state=next_state)
-    self.add(step_type, reward, discount, observation, step_output)
-
-  def add(self, step_type, reward, discount, observation, step_output):
+    self.add(step_type, reward, discount, observation, step_output, env_ids=env_ids)
+
+  def add(self, step_type, reward, discount, observation, step_output, env_ids=None):
+    """
+    Args:
+      env_ids: If provided, the arguments hold the timestep of only these
+        envs (in that order) and each of them is written at its own step
+        counter. Only supported when traj_length is set.
+    """
     traj = dict(
         step_type=step_type,
         reward=reward,
@@ -61,21 +245,94 @@ class Trajectory(object):
         observation=observation,
         step_output=dict(
             **step_output._asdict()) if isinstance(step_output, StepOutput) else step_output)
-    self._trajs.append(traj)
+    if self._traj_length is None:
+      assert env_ids is None, 'env_ids requires traj_length to be set.'
+      self._trajs.append(traj)
+    else:
+      self._write(traj, env_ids)
+
+  def _write(self, traj, env_ids):
+    """Writes a batched timestep in place into the unroll buffers."""
+    if env_ids is None:
+      # lockstep -- all envs are at the same step.
+      row_ids = np.arange(self._batch_size)
+      rows = slice(None)
+      t = self._lens[0]
+    else:
+      row_ids = rows = np.asarray(env_ids)
+      t = self._lens[rows]
+    assert np.all(t <= self._traj_length)
+    flat = nest.flatten_up_to(self._traj_spec, traj)
+    if self._static_idx:
+      # a new segment starts at every episode start
+      # and at the start of every unroll.
+      is_first = (np.asarray(traj['step_type']) == StepType.FIRST) | (t == 0)
+      prev_ids = np.where(t == 0, -1, self._segment_ids[rows, np.maximum(t - 1, 0)])
+      self._segment_ids[rows, t] = prev_ids + is_first
+      new_segments = np.flatnonzero(is_first)
+
+    for j, v in enumerate(flat):
+      if v is None:
+        continue
+      if j in self._static_idx:
+        for k in new_segments:
+          # copy since the env is free to reuse its output arrays.
+          self._segments[j][row_ids[k]].append(np.array(v[k], dtype=self._flat_specs[j].dtype))
+        continue
+      buf = self._bufs[j]
+      if buf is None:
+        # batch major so that each env's trajectory is a contiguous view.
+        buf = self._bufs[j] = np.empty((self._batch_size, self._buf_lens[j]) + np.shape(v)[1:],
+                                       dtype=self._flat_specs[j].dtype)
+      buf[rows, t + self._row_offset[j]] = v
+    self._lens[rows] += 1
 
   def reset(self):
-    self._trajs = []
+    """
+    Returns:
+      With traj_length set, the buffers of the previous unroll (or None).
+      The trajectories handed out by debatch_and_stack view into them,
+      so they are only written again once passed to recycle.
+    """
+    if self._traj_length is None:
+      self._trajs = []
+      return None
+    finished = None
+    if self._bufs is not None:
+      finished = (self._bufs, self._segment_ids)
+    if self._free_bufs:
+      self._bufs, self._segment_ids = self._free_bufs.pop()
+    else:
+      self._bufs = [None] * len(self._flat_specs)
+      self._segment_ids = np.zeros((self._batch_size, self._traj_length + 1), dtype=np.int32)
+    self._segments = {j: defaultdict(list) for j in self._static_idx}
+    self._lens[:] = 0
+    return finished
+
+  def recycle(self, bufs):
+    """Reuses the buffers returned by reset for a later unroll.
+
+    Call once the trajectories of that unroll are no longer referenced
+    (i.e. sent out). Safe to call from another thread.
+    """
+    self._free_bufs.append(bufs)
 
   @property
   def spec(self):
     return self._traj_spec
 
+  @property
+  def graph_obs_keys(self):
+    return self._graph_obs_keys
+
   @staticmethod
   def _stack(trajs, traj_spec):
     stacked_trajs = []
 
     def f(spec, *l):
-      l = list(filter(lambda k: k is not None, l))
+      l = [unpack_static(k) for k in l if k is not None]
+      if not l:
+        return None
       # copy leads to crazy cpu util
       return np.stack(l, axis=0).astype(spec.dtype, copy=False)
 
@@ -87,6 +344,9 @@ class Trajectory(object):
   def debatch_and_stack(self):
     """Remove the leading batch dimension and then stack on timestamp.
         Returns list of stacked timesteps for each batch."""
+    if self._traj_length is not None:
+      return self._debatch_columnar()
+
     traj_spec = self._traj_spec
 
     def f(arr):
@@ -116,10 +376,91 @@ class Trajectory(object):
         l[i].append(
             nest.pack_sequence_as(traj_spec, list(map(lambda k: k if k is None else k[i], d))))
 
-    return list(map(functools.partial(Trajectory._stack, traj_spec=self._traj_spec), l))
+    exps = list(map(functools.partial(Trajectory._stack, traj_spec=self._traj_spec), l))
+    if self._static_obs_keys:
+      exps = list(map(self._pack_static_obs, exps))
+    return list(map(self._strip_graph_padding, exps))
+
+  def _debatch_columnar(self):
+    assert np.all(self._lens == self._traj_length + 1)
+    # views -- no copy.
+    return [
+        self._strip_graph_padding(self._debatch_env(i, copy=False))
+        for i in range(self._batch_size)
+    ]
+
+  def _debatch_env(self, i, copy):
+    flat = []
+    for j, buf in enumerate(self._bufs):
+      if j in self._static_idx:
+        flat.append({
+            STATIC_SEGMENTS_KEY: np.stack(self._segments[j][i]),
+            STATIC_SEGMENT_IDS_KEY: self._segment_ids[i].copy() if copy else self._segment_ids[i],
+        })
+      elif buf is None:
+        flat.append(None)
+      else:
+        flat.append(buf[i].copy() if copy else buf[i])
+    return nest.pack_sequence_as(self._traj_spec, flat)
+
+  def pop_finished(self):
+    """Returns (env_ids, exps) for the envs which have a complete unroll.
+
+    Used when envs are stepped asynchronously. The step counters of the
+    returned envs are reset, so `start` should be called for them next.
+    """
+    env_ids = np.flatnonzero(self._lens == self._traj_length + 1)
+    # copy since the rows are reused by the next unroll of the env.
+    exps = [self._strip_graph_padding(self._debatch_env(i, copy=True)) for i in env_ids]
+    for i in env_ids:
+      for j in self._static_idx:
+        self._segments[j][i] = []
+    self._lens[env_ids] = 0
+    return env_ids, exps
+
+  def _strip_graph_padding(self, exp):
+    for key in self._graph_obs_keys:
+      path = 'observation/' + key
+      exp = _replace_path(exp, path, strip_graph_padding(_get_path(exp, path)))
+    return exp
+
+  def _pack_static_obs(self, exp):
+    """Replace the static observation fields with one value per episode segment."""
+    # a new segment begins at every episode start.
+    is_first = exp['step_type'] == StepType.FIRST
+    is_first[0] = True
+    starts = np.flatnonzero(is_first)
+    segment_ids = np.int32(np.cumsum(is_first) - 1)
+
+    for path in self._static_obs_keys:
+      d = exp['observation']
+      keys = path.split('/')
+      for k in keys[:-1]:
+        d = d[k]
+      d[keys[-1]] = {
+          STATIC_SEGMENTS_KEY: d[keys[-1]][starts],
+          STATIC_SEGMENT_IDS_KEY: segment_ids,
+      }
+    return exp
 
   @staticmethod
-  def batch(trajs, traj_spec):
+  def batch(trajs, traj_spec, graph_obs_keys=None):
+    """
+    Args:
+      graph_obs_keys: Paths of the stripped graph observations of the
+        trajectories. (see Trajectory.graph_obs_keys)
+    """
+    graphs = {}
+    for key in graph_obs_keys or []:
+      path = 'observation/' + key
+      graphs[path] = [_get_path(traj, path) for traj in trajs]
+      # ragged fields can't be stacked -- packed below.
+      trajs = [
+          _replace_path(traj, path,
+                        {k: None if k in GRAPH_RAGGED_FIELDS else v
+                         for k, v in graph.items()}) for traj, graph in zip(trajs, graphs[path])
+      ]
+
     batched_trajs = Trajectory._stack(trajs, traj_spec)
 
     def f(l):
@@ -127,24 +468,34 @@ class Trajectory(object):
       return None if l is None else np.swapaxes(l, 0, 1)
 
     batched_trajs = nest.map_structure_up_to(traj_spec, f, batched_trajs)
+    for path, l in graphs.items():
+      batched_graph = _get_path(batched_trajs, path)
+      batched_graph.update(pack_graphs(l, batched_graph))
     return batched_trajs
 
   def __len__(self):
+    if self._traj_length is not None:
+      return int(self._lens.max())
     if self._trajs:
       return len(self._trajs)
     else:
       return 0
 
   @staticmethod
-  def format_traj_spec(traj_spec, bs, traj_length):
+  def format_traj_spec(traj_spec, bs, traj_length, graph_obs_keys=None):
     """Fills in the missing shape fields of the traj spec."""
-
-    # All keys starting with following should get traj_length first dimension
-    t_plus_one = ['step_type', 'reward', 'discount', 'observation', 'step_output/next_state']
-    t = ['step_output/action', 'step_output/logits']
+    packed_paths = [
+        'observation/%s/%s' % (key, field)
+        for key in graph_obs_keys or []
+        for field in GRAPH_RAGGED_FIELDS
+    ]
+    traj_spec = copy.deepcopy(traj_spec)
 
     def f(path, v):
-      if any([path.startswith(x) for x in t_plus_one]):
+      if path in packed_paths:
+        # concatenated across the graphs. (see batch)
+        v.set_shape((None, ) + v.shape[3:])
+      elif has_t_plus_one_steps(path):
         v.set_shape((traj_length + 1, bs) + v.shape[2:])
       else:
         v.set_shape((traj_length, bs) + v.shape[2:])
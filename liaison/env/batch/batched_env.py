@@ -43,6 +43,8 @@ class BatchedEnv(Env):
     self._env_configs = env_configs
     self._env_class = env_class
     self.seed = seed
+    # output arrays reused across calls to _stack_ts.
+    self._ts_buffers = None
 
   def _stack_specs(self, specs):
     return nest.map_structure(stack_specs, *specs)
@@ -70,16 +72,33 @@ class BatchedEnv(Env):
   def action_spec(self):
     return self._action_spec
 
-  def _stack_ts(self, timesteps):
-    """Should be called after _make_step_spec."""
-
-    dict_tss = []
-    for ts in timesteps:
-      dict_tss.append(dict(ts._asdict()))
-
-    def f(spec, *l):
-      return np.stack(l, axis=0).astype(spec.dtype)
-
-    stacked_ts = nest.map_structure_up_to(self._step_spec, f, self._step_spec,
-                                          *dict_tss)
-    return TimeStep(**stacked_ts)
+  def _stack_ts(self, timesteps, reuse_buffers=False):
+    """Should be called after _make_step_spec.
+
+    Each env's output is copied once into its row of the batched array
+    (casting to the spec dtype on the way if it differs).
+
+    If reuse_buffers is set, the batched arrays are allocated once and
+    reused across calls -- the returned timestep is only valid until the
+    next call.
+    """
+    flat_specs = nest.flatten(self._step_spec)
+    flat_tss = [nest.flatten_up_to(self._step_spec, dict(ts._asdict())) for ts in timesteps]
+
+    if reuse_buffers:
+      if self._ts_buffers is None:
+        self._ts_buffers = [None] * len(flat_specs)
+      bufs = self._ts_buffers
+    else:
+      bufs = [None] * len(flat_specs)
+
+    stacked = []
+    for j, spec in enumerate(flat_specs):
+      shape = (len(flat_tss), ) + np.shape(flat_tss[0][j])
+      buf = bufs[j]
+      if buf is None or buf.shape != shape:
+        buf = bufs[j] = np.empty(shape, dtype=spec.dtype)
+      for i, flat_ts in enumerate(flat_tss):
+        buf[i] = flat_ts[j]
+      stacked.append(buf)
+    return TimeStep(**nest.pack_sequence_as(self._step_spec, stacked))
@@ -3,30 +3,122 @@
 from __future__ import absolute_import, division, print_function
 
 import multiprocessing as mp
+import os
+import tempfile
 import threading
 from multiprocessing import Queue
+from queue import Empty
 
+import numpy as np
+from liaison.env import TimeStep
 from liaison.env.batch import BaseBatchedEnv
+from tensorflow.contrib.framework import nest
+
+# Control message sent to workers to write the timestep returned by an env
+# method into the shared memory slab instead of sending it over the queue.
+_SHM_CALL = '__shm_call__'
+# Control message sent to workers to attach to the shared memory slab.
+_SHM_ATTACH = '__shm_attach__'
+# Control message sent to workers to call an env method and post
+# the result on the common ready queue tagged with the worker id.
+_ASYNC_CALL = '__async_call__'
+
+_SHM_ALIGNMENT = 64
+
+
+def _mk_shared_arrays(fname, layout, create):
+  """Lays out one array per (shape, dtype) in layout in a memory mapped file.
+
+  The file should be on a tmpfs (/dev/shm) so that the mapping is backed by
+  shared memory.
+  """
+  offsets = []
+  total = 0
+  for shape, dtype in layout:
+    offsets.append(total)
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    total += -(-nbytes // _SHM_ALIGNMENT) * _SHM_ALIGNMENT
+
+  mm = np.memmap(fname, dtype=np.uint8, mode='w+' if create else 'r+', shape=(max(total, 1), ))
+  return [
+      np.ndarray(shape, dtype=dtype, buffer=mm, offset=offset)
+      for (shape, dtype), offset in zip(layout, offsets)
+  ]
 
 
 class EnvWorker:
 
-  def __init__(self, send_queue, recv_queue, id, seed, env_class, env_config):
+  def __init__(self, send_queue, recv_queue, ready_queue, id, seed, env_class, env_config):
     self._send_queue = send_queue
     self._recv_queue = recv_queue
+    self._ready_queue = ready_queue
     self._id = id
     self._env = env_class(id=self._id, seed=seed, **env_config)
+    # set after _SHM_ATTACH is received.
+    self._step_spec = None
+    self._shm_slots = None
     self._start()
 
   def _start(self):
     while True:
       func_name, args, kwargs = self._recv_queue.get()
-      self._send_queue.put([getattr(self._env, func_name)(*args, **kwargs)])
+      if func_name == _SHM_ATTACH:
+        self._attach_shared_memory(*args)
+        self._send_queue.put([None])
+      elif func_name == _SHM_CALL:
+        func_name, args, kwargs = args
+        ts = getattr(self._env, func_name)(*args, **kwargs)
+        self._write_to_shared_memory(ts)
+        # only a small control message goes back over the queue.
+        self._send_queue.put([None])
+      elif func_name == _ASYNC_CALL:
+        func_name, args, kwargs = args
+        ts = getattr(self._env, func_name)(*args, **kwargs)
+        if self._shm_slots is None:
+          self._ready_queue.put((self._id, ts))
+        else:
+          self._write_to_shared_memory(ts)
+          self._ready_queue.put((self._id, None))
+      else:
+        self._send_queue.put([getattr(self._env, func_name)(*args, **kwargs)])
+
+  def _attach_shared_memory(self, fname, layout, step_spec):
+    self._step_spec = step_spec
+    # this env's slot in each of the batched arrays.
+    # (slice + reshape to get a view even for 1-D arrays)
+    self._shm_slots = [
+        arr[self._id:self._id + 1].reshape(arr.shape[1:])
+        for arr in _mk_shared_arrays(fname, layout, create=False)
+    ]
+
+  def _write_to_shared_memory(self, ts):
+    flat = nest.flatten_up_to(self._step_spec, dict(ts._asdict()))
+    for slot, v in zip(self._shm_slots, flat):
+      slot[...] = v
 
 
 class BatchedEnv(BaseBatchedEnv):
 
-  def __init__(self, n_envs, env_class, env_configs, seed, use_threads=False, **kwargs):
+  def __init__(self,
+               n_envs,
+               env_class,
+               env_configs,
+               seed,
+               use_threads=False,
+               use_shared_memory=False,
+               **kwargs):
+    """
+    Args:
+      use_shared_memory: If true, workers write their timesteps directly into
+        a shared memory slab laid out from the step spec, and step/reset
+        return views into the slab. The returned timestep is only valid
+        until the next call to step/reset -- callers must copy whatever
+        they want to keep.
+
+    Besides the lockstep `step`, envs can be stepped asynchronously with
+    `async_send` and `async_recv`, which return as soon as a subset of
+    the envs is done instead of waiting for the slowest one.
+    """
 
     super(BatchedEnv, self).__init__(n_envs, env_class, env_configs, seed)
 
@@ -39,11 +131,19 @@ class BatchedEnv(BaseBatchedEnv):
     self._workers = []
     self._send_queues = []
     self._recv_queues = []
+    # shared by all the workers for async calls.
+    self._ready_queue = Queue(n_envs)
+    # ids of the envs with an async call in flight.
+    self._pending = set()
     for i in range(self._n_workers):
       send_queue = Queue(1)
       recv_queue = Queue(1)
       worker = Runnable(target=EnvWorker,
-                        args=(recv_queue, send_queue, i, seed, env_class, env_configs[i]))
+                        args=(recv_queue, send_queue, self._ready_queue, i, seed, env_class,
+                              env_configs[i]))
+      if use_threads:
+        # workers loop forever -- don't hold up the exit.
+        worker.daemon = True
       worker.start()
       self._workers.append(worker)
       self._send_queues.append(send_queue)
@@ -53,11 +153,35 @@ class BatchedEnv(BaseBatchedEnv):
     self._setup_action_spec()
 
     self._make_step_spec(self._obs_spec)
+    self._shm_ts = None
+    if use_shared_memory:
+      self._setup_shared_memory()
     self.set_seed(seed)
 
+  def _setup_shared_memory(self):
+    step_spec = self._step_spec
+    paths = nest.flatten(nest.map_structure_with_paths(lambda path, _: path, step_spec))
+    layout = []
+    for path, spec in zip(paths, nest.flatten(step_spec)):
+      if path.startswith('observation'):
+        # observation spec already has the batch dimension.
+        layout.append((spec.shape, spec.dtype))
+      else:
+        layout.append(((self._n_workers, ) + spec.shape, spec.dtype))
+
+    shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    fd, fname = tempfile.mkstemp(prefix='liaison_batched_env_', dir=shm_dir)
+    os.close(fd)
+    arrays = _mk_shared_arrays(fname, layout, create=True)
+    self._send_to_workers(_SHM_ATTACH, [(fname, layout, step_spec)] * self._n_workers)
+    # all workers hold the mapping now.
+    os.remove(fname)
+    self._shm_ts = TimeStep(**nest.pack_sequence_as(step_spec, arrays))
+
   def _send_to_workers(self, method, argss=None, kwargss=None):
     # argss should be list of args
 
+    assert not self._pending, 'Call async_recv for all the envs stepped with async_send first.'
     n_workers = self._n_workers
     if argss is None:
       argss = [[]] * n_workers
@@ -77,18 +201,78 @@ class BatchedEnv(BaseBatchedEnv):
       results.append(msg[0])
     return results
 
+  def _call_into_shared_memory(self, method, argss=None):
+    if argss is None:
+      argss = [[]] * self._n_workers
+    self._send_to_workers(_SHM_CALL, [(method, args, {}) for args in argss])
+    return self._shm_ts
+
   def _setup_obs_spec(self):
     self._obs_spec = self._stack_specs(self._send_to_workers('observation_spec'))
 
   def _setup_action_spec(self):
     self._action_spec = self._stack_specs(self._send_to_workers('action_spec'))
 
+  def static_observation_keys(self):
+    return self._send_to_workers('static_observation_keys')[0]
+
+  def graph_observation_keys(self):
+    return self._send_to_workers('graph_observation_keys')[0]
+
   def step(self, action):
+    if self._shm_ts is not None:
+      return self._call_into_shared_memory('step', [(act, ) for act in action])
     return self._stack_ts(self._send_to_workers('step', [(act, ) for act in action]))
 
   def reset(self):
+    if self._shm_ts is not None:
+      return self._call_into_shared_memory('reset')
     return self._stack_ts(self._send_to_workers('reset'))
 
+  def async_send(self, action, env_ids):
+    """Starts stepping the envs in env_ids without waiting for them.
+
+    Args:
+      action: actions for the envs in env_ids (in that order).
+      env_ids: ids of the envs to step. None of these should have
+        a step in flight.
+    """
+    assert len(action) == len(env_ids)
+    for act, i in zip(action, env_ids):
+      assert i not in self._pending
+      self._pending.add(i)
+      self._send_queues[i].put([_ASYNC_CALL, ('step', (act, ), {}), {}])
+
+  def async_recv(self, min_envs=1):
+    """Waits for at least min_envs of the in flight envs to finish their step.
+
+    Returns:
+      (env_ids, ts) where env_ids is a sorted array of the ids of the
+      envs that are done and ts is the timestep batched over env_ids.
+    """
+    assert self._pending, 'No envs to receive from.'
+    min_envs = min(min_envs, len(self._pending))
+    results = {}
+    while len(results) < min_envs:
+      i, ts = self._ready_queue.get()
+      results[i] = ts
+    # pick up the stragglers that finished in the meantime.
+    while True:
+      try:
+        i, ts = self._ready_queue.get_nowait()
+      except Empty:
+        break
+      results[i] = ts
+
+    env_ids = np.array(sorted(results))
+    self._pending.difference_update(results)
+    if self._shm_ts is None:
+      return env_ids, self._stack_ts([results[i] for i in env_ids])
+    # gather the rows of the ready envs before they are overwritten.
+    return env_ids, TimeStep(
+        **nest.map_structure_up_to(self._step_spec, lambda v: v[env_ids],
+                                   dict(self._shm_ts._asdict())))
+
   def set_seed(self, seed):
     return self._send_to_workers('set_seed', [(seed, )] * self._n_workers)
 
@@ -7,9 +7,16 @@ from liaison.env.batch import BaseBatchedEnv
 
 class BatchedEnv(BaseBatchedEnv):
 
-  def __init__(self, n_envs, env_class, env_configs, seed, **kwargs):
+  def __init__(self, n_envs, env_class, env_configs, seed, reuse_buffers=False, **kwargs):
+    """
+    Args:
+      reuse_buffers: If true, step/reset write into the same output arrays
+        on every call. The returned timestep is only valid until the next
+        call to step/reset -- callers must copy whatever they want to keep.
+    """
 
     super(BatchedEnv, self).__init__(n_envs, env_class, env_configs, seed)
+    self._reuse_buffers = reuse_buffers
     self._envs = []
     for i in range(n_envs):
       env = env_class(id=i, seed=seed, **env_configs[i])
@@ -29,7 +36,7 @@ class BatchedEnv(BaseBatchedEnv):
       ts = env.reset()
       timesteps.append(ts)
 
-    return self._stack_ts(timesteps)
+    return self._stack_ts(timesteps, self._reuse_buffers)
 
   def step(self, action):
     timesteps = []
@@ -37,7 +44,13 @@ class BatchedEnv(BaseBatchedEnv):
       ts = env.step(action[i])
       timesteps.append(ts)
 
-    return self._stack_ts(timesteps)
+    return self._stack_ts(timesteps, self._reuse_buffers)
+
+  def static_observation_keys(self):
+    return self._envs[0].static_observation_keys()
+
+  def graph_observation_keys(self):
+    return self._envs[0].graph_observation_keys()
 
   def set_seeds(self, seed):
     for env in self._envs:
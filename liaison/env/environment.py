@@ -136,6 +136,29 @@ class Env(object):
       An `ArraySpec`, or a nested dict, list or tuple of `ArraySpec`s.
     """
 
+  def static_observation_keys(self):
+    """Optional method that lists the episode-static observation fields.
+
+    Fields listed here must not change between `reset` calls. They are
+    shipped once per episode segment rather than once per step.
+
+    Returns:
+      A list of paths of form 'a/b' into the observation structure.
+    """
+    return []
+
+  def graph_observation_keys(self):
+    """Optional method that lists the padded graph observations.
+
+    Each of these is a dict of GraphsTuple or BipartiteGraphsTuple fields
+    with the nodes and edges padded to a fixed size. Their padding can
+    be stripped before the trajectories are shipped.
+
+    Returns:
+      A list of paths of form 'a/b' into the observation structure.
+    """
+    return []
+
   def step_spec(self):
     """Optional method that defines fields returned by `step`.
 
@@ -14,6 +14,7 @@ import scipy
 import tree as nest
 from liaison.daper.dataset_constants import LENGTH_MAP, NORMALIZATION_CONSTANTS
 from liaison.daper.milp.primitives import IntegerVariable, MIPInstance
+from liaison.distributed.global_step import GLOBAL_STEP_FILE_ENV_VAR
 from liaison.env import Env as BaseEnv
 from liaison.env.environment import restart, termination, transition
 from liaison.env.utils.rins import *
@@ -155,7 +156,7 @@ class Env(BaseEnv):
     self._prev_mean_work = np.nan
     self._prev_k = np.nan
     self._reset_next_step = True
-    if 'SYMPH_PS_SERVING_HOST' in os.environ:
+    if 'SYMPH_PS_SERVING_HOST' in os.environ or GLOBAL_STEP_FILE_ENV_VAR in os.environ:
       self._global_step_fetcher = GlobalStepFetcher(min_request_spacing=4)
     else:
       self._global_step_fetcher = None
@@ -708,6 +709,20 @@ class Env(BaseEnv):
 
     return nest.map_structure_with_path(mk_spec, obs)
 
+  def static_observation_keys(self):
+    # graph structure is computed once per reset in _static_graph_features
+    keys = []
+    if self.config.make_obs_for_graphnet or self.config.make_obs_for_bipartite_graphnet:
+      keys += ['graph_features/' + k for k in ['edges', 'senders', 'receivers', 'n_edge']]
+    if self.config.make_obs_for_graphnet:
+      keys += ['var_type_mask', 'constraint_type_mask', 'obj_type_mask']
+    return keys
+
+  def graph_observation_keys(self):
+    if self.config.make_obs_for_graphnet or self.config.make_obs_for_bipartite_graphnet:
+      return ['graph_features']
+    return []
+
   def action_spec(self):
     return BoundedArraySpec((),
                             np.int32,
@@ -8,6 +8,7 @@ from liaison.daper.dataset_constants import DATASET_INFO_PATH, DATASET_PATH
 from liaison.daper.milp.primitives import relax_integral_constraints
 from liaison.daper.milp.scip_utils import del_scip_model
 from liaison.distributed import ParameterClient
+from liaison.distributed.global_step import get_shared_global_step
 from liaison.utils import ConfigDict
 from pyscipopt import Model
 
@@ -75,8 +76,13 @@ def load_pickled_features(dataset, dataset_type, graph_idx):
 class GlobalStepFetcher:
   # fetches global step value from the parameter server.
   # caches to avoid overloading the remote server.
+  # If the actor shares the global step (see global_step.py) it's read from
+  # there instead.
 
   def __init__(self, min_request_spacing=4):
+    self._shared_global_step = get_shared_global_step()
+    if self._shared_global_step is not None:
+      return
     self._ps_client = ParameterClient(host=os.environ['SYMPH_PS_SERVING_HOST'],
                                       port=os.environ['SYMPH_PS_SERVING_PORT'],
                                       agent_scope=None,
@@ -87,6 +93,8 @@ class GlobalStepFetcher:
     self._prev_response = 0
 
   def get(self):
+    if self._shared_global_step is not None:
+      return self._shared_global_step.get()
     if time.time() - self._prev_time >= self._min_request_spacing:
       info = self._ps_client.fetch_info_no_retry()
       if info:
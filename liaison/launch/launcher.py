@@ -85,6 +85,8 @@ class Launcher:
       self.run_learner()
     elif component_name == 'ps':
       self.run_ps()
+    elif component_name == 'ps_shard':
+      self.run_ps_shard(shard_id=component_id)
     elif component_name == 'replay':
       self.run_replay()
     elif component_name == 'replay_loadbalancer':
@@ -139,6 +141,7 @@ class Launcher:
 
     shell_config = dict(agent_class=agent_class,
                         agent_config=agent_config,
+                        ps_n_shards=self.sess_config.ps.n_shards,
                         **self.sess_config.shell)
 
     actor_config = dict(
@@ -189,6 +192,7 @@ class Launcher:
     agent_config.update(evaluation_mode=True)
     shell_config = dict(agent_class=agent_class,
                         agent_config=agent_config,
+                        ps_n_shards=self.sess_config.ps.n_shards,
                         **self.sess_config.shell)
 
     env_configs = []
@@ -276,6 +280,8 @@ class Launcher:
                       loggers=loggers,
                       var_loggers=var_loggers,
                       system_loggers=self._setup_learner_system_loggers(),
+                      ps_n_shards=self.sess_config.ps.n_shards,
+                      replay_n_shards=self.sess_config.replay.n_shards,
                       **self.sess_config.learner)
     learner.main()
 
@@ -283,9 +289,34 @@ class Launcher:
     """
         Lauches the parameter server process.
         Serves parameters to agents
+        Every shard runs in its own process.
     """
-    server = SimpleParameterServer(publish_port=os.environ['SYMPH_PS_PUBLISHING_PORT'],
-                                   serving_port=os.environ['SYMPH_PS_SERVING_PORT'])
+    n_shards = self.sess_config.ps.n_shards
+    if self.sess_config.shell.ps_subscribe and n_shards != 1:
+      raise ValueError('shell.ps_subscribe is not supported with ps.n_shards > 1')
+    if n_shards == 1:
+      self.run_ps_shard(shard_id=0)
+    else:
+      U.wait_for_popen([self.run_component(f'ps_shard-{i}') for i in range(n_shards)])
+
+  def run_ps_shard(self, shard_id):
+    """
+        Launches a single parameter server shard.
+
+        Args:
+            shard_id: The shard of the variables to serve
+                (see ConsistentHashRing)
+    """
+    shell_config = self.sess_config.shell
+    if shell_config.ps_subscribe:
+      broadcast_port = os.environ['SYMPH_PS_BROADCAST_PORT']
+    else:
+      broadcast_port = None
+    # every shard gets its own ports from create_programs.setup_network.
+    server = SimpleParameterServer(publish_port=U.get_service_port('ps-publishing', shard_id),
+                                   serving_port=U.get_service_port('ps-serving', shard_id),
+                                   broadcast_port=broadcast_port,
+                                   broadcast_codec=shell_config.ps_client_codec)
     server.start()
     server.join()
 
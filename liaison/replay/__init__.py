@@ -1,4 +1,5 @@
 from .base import *
 from .fifo_replay import FIFOReplay
+from .prioritized_replay import Replay as PrioritizedReplay
 from .replay_load_balancer import ReplayLoadBalancer
 from .uniform_replay import Replay as UniformReplay
@@ -1,52 +1,33 @@
 import os
-import sys
+import threading
 import time
-from collections import Mapping, Set, deque
-from numbers import Number
 
 import liaison.utils as U
 from absl import logging
 from caraml.zmq import ZmqServer
 from liaison.distributed import ExperienceCollectorServer
 from liaison.distributed.exp_serializer import get_deserializer, get_serializer
+from liaison.replay.disk_storage import DiskStorage
 from liaison.utils import ConfigDict
 from tensorplex import LoggerplexClient, TensorplexClient
 
 
-def getsize(obj_0):
-  """Recursively iterate to sum size of object & members."""
-  _seen_ids = set()
-  zero_depth_bases = (str, bytes, Number, range, bytearray)
-  iteritems = 'items'
-
-  def inner(obj):
-    obj_id = id(obj)
-    if obj_id in _seen_ids:
-      return 0
-    _seen_ids.add(obj_id)
-    size = sys.getsizeof(obj)
-    if isinstance(obj, zero_depth_bases):
-      pass  # bypass remaining control flow and return
-    elif isinstance(obj, (tuple, list, Set, deque)):
-      size += sum(inner(i) for i in obj)
-    elif isinstance(obj, Mapping) or hasattr(obj, iteritems):
-      size += sum(inner(k) + inner(v) for k, v in getattr(obj, iteritems)())
-    # Check for custom object instances - may subclass above too
-    if hasattr(obj, '__dict__'):
-      size += inner(vars(obj))
-    if hasattr(obj, '__slots__'):  # can have __slots__ with __dict__
-      size += sum(inner(getattr(obj, s)) for s in obj.__slots__ if hasattr(obj, s))
-    return size
-
-  return inner(obj_0)
-
-
 class ReplayUnderFlowException(Exception):
 
   def __init__(self, message=''):
     super().__init__(message)
 
 
+class MemoryHandle(object):
+  """Stored in the replay memory in place of the experience if the disk
+  tier is disabled. Carries the size of the experience to release."""
+  __slots__ = ['exp', 'nbytes']
+
+  def __init__(self, exp, nbytes):
+    self.exp = exp
+    self.nbytes = nbytes
+
+
 class Replay:
   """
         Important: When extending this class, make sure to follow the init
@@ -60,9 +41,39 @@ class Replay:
                compress_before_send,
                load_balanced=True,
                index=0,
+               sample_wait_timeout=1.0,
+               disk_tier=None,
                **kwargs):
+    """
+    Args:
+      sample_wait_timeout: Sample requests waiting for data are woken up on
+        every insert, and at least every sample_wait_timeout seconds to
+        recheck the conditions that can change without an insert.
+      disk_tier: If enabled, experiences are spilled to memory-mapped
+        segment files under disk_tier.dirname and subclasses get
+        DiskHandles to store instead of MemoryHandles. (see DiskStorage)
+    """
     self.config = ConfigDict(kwargs)
     self.index = index
+    self._compress_before_send = compress_before_send
+
+    # notified on every insert.
+    self._sample_cv = threading.Condition()
+    self._n_inserts = 0
+    self._sample_wait_timeout = sample_wait_timeout
+
+    # nbytes of the experiences in memory. (the disk tier keeps its own)
+    self._memory_bytes = 0
+    self._memory_bytes_lock = threading.Lock()
+
+    if disk_tier and disk_tier.enabled:
+      self._disk = DiskStorage(os.path.join(disk_tier.dirname, 'replay_%d' % index),
+                               segment_bytes=disk_tier.segment_size_MB * 2**20,
+                               cache_size=disk_tier.cache_size,
+                               compress=disk_tier.compress,
+                               min_live_ratio=disk_tier.min_live_ratio)
+    else:
+      self._disk = None
 
     if load_balanced:
       collector_port = os.environ['SYMPH_COLLECTOR_BACKEND_PORT']
@@ -113,7 +124,9 @@ class Replay:
         Includes passive evict logic if memory capacity is exceeded.
 
         Args:
-            exp_dict: {[obs], action, reward, done, info}
+            exp_dict: MemoryHandle of {[obs], action, reward, done, info}
+              or its DiskHandle if the disk tier is enabled.
+              Use self.load to get the experience back.
         """
     raise NotImplementedError
 
@@ -148,40 +161,90 @@ class Replay:
   def __len__(self):
     raise NotImplementedError
 
+  def load(self, exp_dict):
+    """
+        Returns the experience for an item passed to insert.
+        Subclasses should call this on the items they sample.
+        """
+    if self._disk is None:
+      return exp_dict.exp
+    return self._disk.get(exp_dict)
+
+  def release(self, exp_dict):
+    """
+        Subclasses should call this for every experience
+        that leaves the memory (evicted, overwritten or sampled out)
+        to keep the memory size accounting up to date.
+        Items that are sampled out should be loaded first.
+        """
+    if self._disk is not None:
+      self._disk.release(exp_dict)
+      return
+    with self._memory_bytes_lock:
+      self._memory_bytes -= exp_dict.nbytes
+      # releasing twice is a no-op.
+      exp_dict.nbytes = 0
+
+  @property
+  def memory_bytes(self):
+    """Total size of the arrays of the experiences in memory."""
+    if self._disk is not None:
+      # the rest are paged out to the segment files.
+      return self._disk.cache_nbytes
+    return self._memory_bytes
+
   # ======================== internal methods ========================
   def _sample_request_handler(self, req):
     """
     Handle requests to the learner
-    https://stackoverflow.com/questions/29082268/python-time-sleep-vs-event-wait
-    Since we don't have external notify, we'd better just use sleep
+    Blocks on self._sample_cv till there is enough data to sample.
     """
     # batch_size = U.deserialize(req)
     batch_size = req
     U.assert_type(batch_size, int)
-    while not self.start_sample_condition():
-      time.sleep(0.01)
+    with self._sample_cv:
+      while not self.start_sample_condition():
+        self._sample_cv.wait(self._sample_wait_timeout)
     self.cumulative_sampled_count += batch_size
     self.cumulative_request_count += 1
 
     with self.sample_time.time():
       while True:
+        n_inserts = self._n_inserts
         try:
           sample = self.sample(batch_size)
           break
         except ReplayUnderFlowException:
-          time.sleep(1e-3)
+          # wait for the next insert.
+          with self._sample_cv:
+            self._sample_cv.wait_for(lambda: self._n_inserts != n_inserts,
+                                     self._sample_wait_timeout)
 
     with self.serialize_time.time():
       return sample
     # return U.serialize(sample)
 
-  def _insert_wrapper(self, exp):
+  def _insert_wrapper(self, exp, nbytes):
     """
             Allows us to do some book keeping in the base class
+
+            Args:
+              nbytes: size of the arrays in exp (computed by the collector).
         """
     self.cumulative_collected_count += 1
+    self.per_sample_size = nbytes
+    if self._disk is not None:
+      exp = self._disk.put(exp, nbytes)
+    else:
+      exp = MemoryHandle(exp, nbytes)
+      with self._memory_bytes_lock:
+        self._memory_bytes += nbytes
     with self.insert_time.time():
       self.insert(exp)
+    # wake up the waiting sample requests.
+    with self._sample_cv:
+      self._n_inserts += 1
+      self._sample_cv.notify_all()
 
   def _get_tensorplex_client(self, client_id):
     host = os.environ['SYMPH_TENSORPLEX_SYSTEM_HOST']
@@ -286,6 +349,9 @@ class Replay:
 
     if hasattr(self, 'per_sample_size'):
       core_metrics['per_sample_size_MB'] = self.per_sample_size / 1e6
+    core_metrics['memory_size_MB'] = self.memory_bytes / 1e6
+    if self._disk is not None:
+      core_metrics['disk_size_MB'] = self._disk.nbytes / 1e6
     serialize_load = serialize_time * handle_sample_request_speed / time_elapsed
     collect_exp_load = insert_time * exp_in_speed / time_elapsed
     sample_exp_load = sample_time * handle_sample_request_speed / time_elapsed
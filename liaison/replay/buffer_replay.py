@@ -20,13 +20,21 @@ class Replay(BaseReplay):
   def insert(self, exp_dict):
     # appends to the right end of the queue
     with self.lock:
+      if len(self._memory) == self._memory.maxlen:
+        # the left end is dropped on append.
+        self.release(self._memory[0])
       self._memory.append(exp_dict)
 
   def sample(self, batch_size):
     with self.lock:
       if len(self._memory) < batch_size:
         raise ReplayUnderFlowException()
-      return [self._memory.popleft() for _ in range(batch_size)]
+      response = []
+      for _ in range(batch_size):
+        item = self._memory.popleft()
+        response.append(self.load(item))
+        self.release(item)
+      return response
 
   def evict(self):
     raise NotImplementedError('no support for eviction in uniform replay mode')
@@ -0,0 +1,178 @@
+"""On-disk tier for replay memory.
+
+Experiences are serialized (see exp_serializer) into append-only
+memory-mapped segment files and paged back in when sampled. A small LRU
+cache of deserialized experiences fronts the segments.
+
+Once less than min_live_ratio of a full segment is live, the live
+experiences are copied to the segment being written and the segment is
+dropped, so the files stay within ~1 / min_live_ratio of the live
+experiences (plus the segment being written).
+"""
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+import liaison.utils as U
+from liaison.distributed.exp_serializer import get_deserializer, get_serializer
+
+
+class DiskHandle(object):
+  """Location of a serialized experience. Stored in the replay memory
+  in place of the experience.
+
+  Holds on to its segment so that it can be read even if the segment is
+  dropped concurrently (the mapping outlives the file). segment and
+  offset change when the experience is moved by a compaction.
+  nbytes is the size of the arrays of the experience once it's in memory.
+  """
+  __slots__ = ['segment', 'offset', 'length', 'nbytes']
+
+  def __init__(self, segment, offset, length, nbytes=0):
+    self.segment = segment
+    self.offset = offset
+    self.length = length
+    self.nbytes = nbytes
+
+
+class _Segment(object):
+
+  def __init__(self, fname, size):
+    self.fname = fname
+    with open(fname, 'wb+') as f:
+      f.truncate(size)
+      self.mm = mmap.mmap(f.fileno(), size)
+    self.size = size
+    # handles of the live experiences in the segment.
+    self.handles = set()
+    self.live_bytes = 0
+
+
+class DiskStorage(object):
+
+  def __init__(self, dirname, segment_bytes, cache_size, compress=True, min_live_ratio=.5):
+    """
+    Args:
+      dirname: Folder for the segment files. Should be on a local disk.
+      segment_bytes: Size of each segment file.
+      cache_size: # of deserialized experiences to keep in memory.
+      min_live_ratio: Compact the full segments with less than this
+        fraction of their bytes live.
+    """
+    U.f_mkdir(dirname)
+    self._dirname = dirname
+    self._segment_bytes = segment_bytes
+    self._cache_size = cache_size
+    self._min_live_ratio = min_live_ratio
+    self._serialize = get_serializer(compress)
+    self._deserialize = get_deserializer(compress)
+    self._cache = OrderedDict()
+    self._cache_nbytes = 0
+    self._next_segment_id = 0
+    self._cur = None  # segment being written.
+    self._offset = 0
+    self._nbytes = 0
+    self._lock = threading.Lock()
+
+  @property
+  def nbytes(self):
+    """Total size of the live experiences on disk."""
+    return self._nbytes
+
+  @property
+  def cache_nbytes(self):
+    """Total size of the arrays of the experiences in the cache."""
+    return self._cache_nbytes
+
+  def put(self, exp, nbytes=0):
+    """
+    Args:
+      nbytes: size of the arrays in exp to account for while it's cached.
+    """
+    buf = self._serialize(exp)
+    with self._lock:
+      handle = DiskHandle(None, 0, len(buf), nbytes)
+      self._write(handle, buf)
+      self._nbytes += handle.length
+      self._add_to_cache(handle, exp)
+    return handle
+
+  def get(self, handle):
+    with self._lock:
+      if handle in self._cache:
+        self._cache.move_to_end(handle)
+        return self._cache[handle]
+      # read from where the experience is now. (see _compact)
+      mm = handle.segment.mm
+      start = handle.offset
+      end = start + handle.length
+    # arrays are rebuilt on top of the mapped pages.
+    exp = self._deserialize(memoryview(mm)[start:end])
+    with self._lock:
+      self._add_to_cache(handle, exp)
+    return exp
+
+  def release(self, handle):
+    with self._lock:
+      if handle in self._cache:
+        del self._cache[handle]
+        self._cache_nbytes -= handle.nbytes
+      self._nbytes -= handle.length
+      segment = handle.segment
+      segment.handles.discard(handle)
+      segment.live_bytes -= handle.length
+      if segment is not self._cur:
+        self._maybe_compact(segment)
+
+  def _add_to_cache(self, handle, exp):
+    if handle not in self._cache:
+      self._cache_nbytes += handle.nbytes
+    self._cache[handle] = exp
+    self._cache.move_to_end(handle)
+    while len(self._cache) > self._cache_size:
+      evicted, _ = self._cache.popitem(last=False)
+      self._cache_nbytes -= evicted.nbytes
+
+  def _write(self, handle, buf):
+    """Appends buf to the segment being written and points handle to it."""
+    n = len(buf)
+    if self._cur is None or self._offset + n > self._cur.size:
+      self._new_segment(n)
+    segment = self._cur
+    segment.mm[self._offset:self._offset + n] = buf
+    segment.handles.add(handle)
+    segment.live_bytes += n
+    handle.segment = segment
+    handle.offset = self._offset
+    self._offset += n
+
+  def _new_segment(self, min_size):
+    full = self._cur
+    fname = os.path.join(self._dirname, 'segment_%06d' % self._next_segment_id)
+    self._next_segment_id += 1
+    self._cur = _Segment(fname, max(self._segment_bytes, min_size))
+    self._offset = 0
+    if full is not None:
+      self._maybe_compact(full)
+
+  def _maybe_compact(self, segment):
+    """Drops a full segment that is empty or compacts it if it's mostly dead."""
+    if not segment.handles:
+      self._drop_segment(segment)
+    elif segment.live_bytes < self._min_live_ratio * segment.size:
+      self._compact(segment)
+
+  def _compact(self, segment):
+    handles = list(segment.handles)
+    segment.handles.clear()
+    for handle in handles:
+      # copied out since the segment is about to be dropped.
+      buf = segment.mm[handle.offset:handle.offset + handle.length]
+      self._write(handle, buf)
+    self._drop_segment(segment)
+
+  def _drop_segment(self, segment):
+    # The mapping itself is released once the handles and the
+    # experiences viewing it (sampled but not yet sent out) are gone.
+    os.remove(segment.fname)
@@ -30,10 +30,18 @@ class FIFOReplay(Replay):
 
   def insert(self, exp_tuple):
     # appends to the right end of the queue
+    if len(self._memory) == self._memory.maxlen:
+      # the left end is dropped on append.
+      self.release(self._memory[0])
     self._memory.append(exp_tuple)
 
   def sample(self, batch_size):
-    return [self._memory.popleft() for _ in range(batch_size)]
+    response = []
+    for _ in range(batch_size):
+      item = self._memory.popleft()
+      response.append(self.load(item))
+      self.release(item)
+    return response
 
   def evict(self):
     raise NotImplementedError('no support for eviction in FIFO mode')
@@ -1,48 +1,96 @@
-import random
 import threading
 from collections import deque
 
 import liaison.utils as U
+import numpy as np
 from absl import logging
 from liaison.replay.base import Replay as BaseReplay
-from liaison.replay.base import ReplayUnderFlowException, getsize
+from liaison.replay.base import ReplayUnderFlowException
 
 
 class Replay(BaseReplay):
+  """Uniform replay that drops an experience once it's sampled k times.
+
+  Live experiences are kept packed in the first `len(self)` slots of a
+  fixed size array. An experience is removed by moving the last live
+  one into its slot, so that sampling and eviction are O(batch_size).
+  """
 
   def __init__(self, seed, max_times_sampled, **kwargs):
     super().__init__(seed=seed, **kwargs)
-    self._memory = deque(maxlen=self.config.memory_size)
-    self._freq_access = deque(maxlen=self.config.memory_size + 3)
+    self._capacity = self.config.memory_size
     self.k = max_times_sampled
+    self._items = [None] * self._capacity
+    # number of times the experience in each slot can still be sampled.
+    self._remaining = np.zeros(self._capacity, dtype=np.int64)
+    # insertion id of the experience in each slot.
+    self._slot_ids = np.zeros(self._capacity, dtype=np.int64)
+    # insertion id -> slot for live experiences.
+    self._id_to_slot = {}
+    # insertion ids oldest first for eviction. (ids of
+    # experiences sampled out already are pruned lazily)
+    self._fifo = deque()
+    self._next_id = 0
+    self._size = 0
     self.lock = threading.Lock()
-    self._next_idx = 0
     self.set_seed(seed)
     if self._evict_interval:
       raise Exception("evict interval should be None for uniform replay.")
 
   def insert(self, exp_dict):
-    # appends to the right end of the queue
-    self.per_sample_size = getsize(exp_dict)
     with self.lock:
-      self._memory.append(exp_dict)
-      self._freq_access.append(0)
+      if self._size == self._capacity:
+        self._evict_oldest()
+      slot = self._size
+      self._size += 1
+      self._items[slot] = exp_dict
+      self._remaining[slot] = self.k
+      self._slot_ids[slot] = self._next_id
+      self._id_to_slot[self._next_id] = slot
+      self._fifo.append(self._next_id)
+      self._next_id += 1
+      # stale ids behind a long lived head are dropped in one pass
+      # once they outnumber the live ones.
+      if len(self._fifo) > 2 * self._capacity:
+        self._fifo = deque(i for i in self._fifo if i in self._id_to_slot)
 
   def sample(self, batch_size):
     with self.lock:
-      if len(self._memory) < batch_size:
+      if self._size < batch_size:
         raise ReplayUnderFlowException()
 
-      indices = [random.randint(0, len(self._memory) - 1) for _ in range(batch_size)]
-      response = [self._memory[i] for i in indices]
-      for i in sorted(indices, reverse=True):
-        self._freq_access[i] += 1
-        if self._freq_access[i] >= self.k:
-          # pop the element
-          del self._freq_access[i]
-          del self._memory[i]
+      indices = self._rng.randint(self._size, size=batch_size)
+      response = [self.load(self._items[i]) for i in indices]
+      np.subtract.at(self._remaining, indices, 1)
+      # remove in descending order so that the last live slot
+      # that's moved into a removed slot is never sampled out itself.
+      for i in np.unique(indices)[::-1]:
+        if self._remaining[i] <= 0:
+          self._remove(i)
       return response
 
+  def _evict_oldest(self):
+    while True:
+      item_id = self._fifo.popleft()
+      if item_id in self._id_to_slot:
+        self._remove(self._id_to_slot[item_id])
+        return
+
+  def _remove(self, slot):
+    """Removes the experience in slot by moving the last live one into it."""
+    self.release(self._items[slot])
+    del self._id_to_slot[int(self._slot_ids[slot])]
+    last = self._size - 1
+    if slot != last:
+      self._items[slot] = self._items[last]
+      self._remaining[slot] = self._remaining[last]
+      self._slot_ids[slot] = self._slot_ids[last]
+      self._id_to_slot[int(self._slot_ids[slot])] = slot
+    self._items[last] = None
+    self._size = last
+    while self._fifo and self._fifo[0] not in self._id_to_slot:
+      self._fifo.popleft()
+
   def evict(self):
     raise NotImplementedError('no support for eviction in uniform replay mode')
 
@@ -50,7 +98,7 @@ class Replay(BaseReplay):
     return len(self) > self.config.sampling_start_size
 
   def __len__(self):
-    return len(self._memory)
+    return self._size
 
   def set_seed(self, seed):
-    random.seed(seed)
+    self._rng = np.random.RandomState(seed)
@@ -0,0 +1,130 @@
+import threading
+
+import liaison.utils as U
+import numpy as np
+from caraml.zmq import ZmqServer
+from liaison.distributed.exp_serializer import get_deserializer, get_serializer
+from liaison.distributed.priority_sender import (IS_WEIGHT_KEY, REPLAY_KEY,
+                                                 UPDATE_PRIORITIES_REQUEST)
+from liaison.replay.base import Replay as BaseReplay
+from liaison.replay.base import ReplayUnderFlowException
+from liaison.replay.sum_tree import SumTree
+
+
+class Replay(BaseReplay):
+  """Proportional prioritized replay backed by a sum-tree.
+
+  New experience is inserted with the max priority seen so far. Every
+  sampled experience is tagged under REPLAY_KEY with
+  (replay index, slot, generation) which the learner sends back along with
+  the new priorities (see PrioritySender), and under IS_WEIGHT_KEY with
+  its importance-sampling weight (N * P(i))^-beta normalized by the max
+  weight in the batch. Every shard serves the updates
+  for its own slots on its own priority port (see U.shard_service_name),
+  since the sampler channel is load balanced across the shards. Updates for slots that have
+  since been overwritten are dropped.
+  """
+
+  def __init__(self,
+               seed,
+               priority_exponent=0.6,
+               priority_eps=1e-6,
+               importance_sampling_exponent=0.4,
+               **kwargs):
+    super().__init__(seed=seed, **kwargs)
+    self._capacity = self.config.memory_size
+    self._memory = [None] * self._capacity
+    # bumped every time a slot is overwritten.
+    self._generations = np.zeros(self._capacity, dtype=np.int64)
+    self._tree = SumTree(self._capacity)
+    self._alpha = priority_exponent
+    self._eps = priority_eps
+    self._beta = importance_sampling_exponent
+    self._max_priority = 1.0
+    self._next_idx = 0
+    self._size = 0
+    self.lock = threading.Lock()
+    self.set_seed(seed)
+    if self._evict_interval:
+      raise Exception("evict interval should be None for prioritized replay.")
+    self._priority_server = ZmqServer(host='*',
+                                      port=U.get_service_port('priority', self.index),
+                                      serializer=get_serializer(self._compress_before_send),
+                                      deserializer=get_deserializer(self._compress_before_send))
+    self._priority_thread = None
+
+  def start_threads(self):
+    super().start_threads()
+    self.start_priority_thread()
+
+  def join(self):
+    super().join()
+    self._priority_thread.join()
+
+  def start_priority_thread(self):
+    if self._priority_thread is not None:
+      raise RuntimeError('priority thread already running')
+    self._priority_thread = U.start_thread(self._priority_server.start_loop,
+                                           kwargs=dict(handler=self._priority_request_handler,
+                                                       blocking=True))
+    return self._priority_thread
+
+  def insert(self, exp_dict):
+    with self.lock:
+      idx = self._next_idx
+      if self._memory[idx] is not None:
+        self.release(self._memory[idx])
+      self._memory[idx] = exp_dict
+      self._generations[idx] += 1
+      self._tree.update([idx], [self._max_priority**self._alpha])
+      self._next_idx = (idx + 1) % self._capacity
+      self._size = min(self._size + 1, self._capacity)
+
+  def sample(self, batch_size):
+    with self.lock:
+      if self._size < batch_size:
+        raise ReplayUnderFlowException()
+
+      indices = self._tree.sample(batch_size, self._rng)
+      probs = self._tree.get(indices) / self._tree.total
+      weights = (self._size * probs)**-self._beta
+      weights /= weights.max()
+      response = []
+      for i, w in zip(indices, weights):
+        # shallow copy to not tag the stored experience.
+        exp = dict(self.load(self._memory[i]))
+        exp[REPLAY_KEY] = (self.index, int(i), int(self._generations[i]))
+        exp[IS_WEIGHT_KEY] = float(w)
+        response.append(exp)
+      return response
+
+  def update_priorities(self, replay_keys, priorities):
+    priorities = np.abs(np.asarray(priorities, dtype=np.float64)) + self._eps
+    with self.lock:
+      idx = []
+      vals = []
+      for (index, i, generation), p in zip(replay_keys, priorities):
+        if index == self.index and self._generations[i] == generation:
+          idx.append(i)
+          vals.append(p)
+      if idx:
+        vals = np.asarray(vals)
+        self._max_priority = max(self._max_priority, vals.max())
+        self._tree.update(idx, vals**self._alpha)
+
+  def evict(self):
+    raise NotImplementedError('no support for eviction in prioritized replay mode')
+
+  def start_sample_condition(self):
+    return len(self) > self.config.sampling_start_size
+
+  def __len__(self):
+    return self._size
+
+  def set_seed(self, seed):
+    self._rng = np.random.RandomState(seed)
+
+  def _priority_request_handler(self, req):
+    request_type, replay_keys, priorities = req
+    assert request_type == UPDATE_PRIORITIES_REQUEST
+    self.update_priorities(replay_keys, priorities)
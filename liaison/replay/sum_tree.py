@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class SumTree:
+  """Array backed binary tree where every node holds the sum of its children.
+
+  The leaves hold the (non-negative) priorities of the `capacity` slots.
+  Node i has children 2i and 2i + 1, the root is node 1 and the leaves
+  start at index `self._n_leaves` (capacity rounded up to a power of two).
+  Both updates and sampling are O(log n) and vectorized across the batch.
+  """
+
+  def __init__(self, capacity):
+    assert capacity >= 1
+    self._capacity = capacity
+    self._n_leaves = 1 << int(np.ceil(np.log2(capacity)))
+    self._depth = int(np.log2(self._n_leaves))
+    self._tree = np.zeros(2 * self._n_leaves, dtype=np.float64)
+
+  @property
+  def capacity(self):
+    return self._capacity
+
+  @property
+  def total(self):
+    return self._tree[1]
+
+  def get(self, idx):
+    return self._tree[np.asarray(idx) + self._n_leaves]
+
+  def update(self, idx, priorities):
+    """Sets the priorities of the slots in idx."""
+    idx = np.asarray(idx, dtype=np.int64) + self._n_leaves
+    self._tree[idx] = priorities
+    for _ in range(self._depth):
+      idx = np.unique(idx // 2)
+      self._tree[idx] = self._tree[2 * idx] + self._tree[2 * idx + 1]
+
+  def find(self, targets):
+    """Returns the slot where the prefix sum of the priorities crosses each target."""
+    targets = np.array(targets, dtype=np.float64)
+    idx = np.ones(len(targets), dtype=np.int64)
+    for _ in range(self._depth):
+      left = 2 * idx
+      left_sum = self._tree[left]
+      # never walk into an empty subtree due to round-off.
+      go_right = (targets >= left_sum) & (self._tree[left + 1] > 0)
+      targets = np.where(go_right, targets - left_sum, targets)
+      idx = np.where(go_right, left + 1, left)
+    return idx - self._n_leaves
+
+  def sample(self, batch_size, rng=np.random):
+    """Samples batch_size slots with probability proportional to their priority.
+
+    The [0, total) range is split into batch_size equal strata with one
+    sample drawn from each.
+    """
+    assert self.total > 0
+    bounds = np.arange(batch_size, dtype=np.float64) + rng.uniform(size=batch_size)
+    return self.find(bounds * (self.total / batch_size))
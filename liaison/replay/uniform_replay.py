@@ -1,38 +1,54 @@
-import random
 import threading
-from collections import deque
 
-import liaison.utils as U
+import numpy as np
 from absl import logging
 from liaison.replay.base import Replay as BaseReplay
-from liaison.replay.base import ReplayUnderFlowException, getsize
+from liaison.replay.base import ReplayUnderFlowException
 
 
 class Replay(BaseReplay):
+  """Uniform replay over a ring buffer of the last memory_size experiences.
+
+  Inserts (collector thread) only take self._slot_lock to swap the
+  experience of a slot and release the overwritten one, and samples
+  (sampler thread) only to load the picked slots, so that a handle is
+  never released while it's being loaded (with the disk tier, that would
+  page the released experience back into the cache). The only writer
+  stores the experience in its slot before publishing it by bumping
+  self._size. A reader that races with an insert may get the newer
+  experience of a just overwritten slot, which is as good a uniform
+  sample.
+  """
 
   def __init__(self, seed, **kwargs):
     super().__init__(seed=seed, **kwargs)
-    self._memory = deque(maxlen=self.config.memory_size)
-    self.lock = threading.Lock()
+    self._capacity = self.config.memory_size
+    self._memory = [None] * self._capacity
     self._next_idx = 0
+    self._size = 0
+    self._slot_lock = threading.Lock()
     self.set_seed(seed)
     if self._evict_interval:
       raise Exception("evict interval should be None for uniform replay.")
 
   def insert(self, exp_dict):
-    # appends to the right end of the queue
-    self.per_sample_size = getsize(exp_dict)
-    with self.lock:
-      self._memory.append(exp_dict)
+    idx = self._next_idx
+    with self._slot_lock:
+      if self._memory[idx] is not None:
+        self.release(self._memory[idx])
+      self._memory[idx] = exp_dict
+    self._next_idx = (idx + 1) % self._capacity
+    if self._size < self._capacity:
+      self._size += 1
 
   def sample(self, batch_size):
-    with self.lock:
-      if len(self._memory) < batch_size:
-        raise ReplayUnderFlowException()
+    size = self._size
+    if size < batch_size:
+      raise ReplayUnderFlowException()
 
-      indices = [random.randint(0, len(self._memory) - 1) for _ in range(batch_size)]
-      response = [self._memory[i] for i in indices]
-      return response
+    indices = self._rng.randint(size, size=batch_size)
+    with self._slot_lock:
+      return [self.load(self._memory[i]) for i in indices]
 
   def evict(self):
     raise NotImplementedError('no support for eviction in uniform replay mode')
@@ -41,7 +57,7 @@ class Replay(BaseReplay):
     return len(self) > self.config.sampling_start_size
 
   def __len__(self):
-    return len(self._memory)
+    return self._size
 
   def set_seed(self, seed):
-    random.seed(seed)
+    self._rng = np.random.RandomState(seed)
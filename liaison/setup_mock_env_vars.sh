@@ -6,6 +6,7 @@ l=(
     'collector-backend'
     'sampler-frontend'
     'sampler-backend'
+    'priority'
     'parameter-publish'
     'prefetch-queue'
     'tensorplex'
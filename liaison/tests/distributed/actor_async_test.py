@@ -0,0 +1,123 @@
+"""Compares the unrolls of async env stepping in the actor with lockstep."""
+
+import time
+from collections import defaultdict
+
+import numpy as np
+from absl.testing import absltest
+from liaison.agents import StepOutput
+from liaison.distributed.actor import Actor
+from liaison.env import Env as BaseEnv
+from liaison.env.environment import restart, transition
+from liaison.specs import ArraySpec, BoundedArraySpec
+from tensorflow.contrib.framework import nest
+
+B = 4
+TRAJ_LENGTH = 3
+N_UNROLLS = 100
+
+
+class SlowCounterEnv(BaseEnv):
+  """Counts the steps taken. Env 0 is much slower to step than the rest."""
+
+  def __init__(self, id, seed):
+    self._id = id
+    self._t = 0
+
+  def _obs(self):
+    return dict(count=np.full(2, self._t, np.float32), id=np.int32(self._id))
+
+  def reset(self):
+    self._t = 0
+    return restart(self._obs())
+
+  def step(self, action):
+    time.sleep(.01 if self._id == 0 else .002)
+    self._t += 1
+    return transition(np.float32(10 * self._id + action), self._obs())
+
+  def observation_spec(self):
+    return dict(count=ArraySpec((2, ), np.float32, name='count'),
+                id=ArraySpec((), np.int32, name='id'))
+
+  def action_spec(self):
+    return BoundedArraySpec((), np.int32, minimum=0, maximum=9, name='action')
+
+  def set_seed(self, seed):
+    pass
+
+
+class CountingShell:
+  """Acts with the # of steps the shell took for each env so far."""
+
+  def __init__(self, action_spec, obs_spec, seed, batch_size, **kwargs):
+    self.next_state = np.zeros(batch_size, dtype=np.int32)
+    self.global_step = None
+
+  def step(self, step_type, reward, observation, env_ids=None):
+    if env_ids is None:
+      env_ids = np.arange(len(self.next_state))
+    # envs report their id in the observation.
+    np.testing.assert_array_equal(observation['id'], env_ids)
+    self.next_state[env_ids] += 1
+    action = self.next_state[env_ids] % 10
+    return StepOutput(action=action,
+                      logits=np.float32(action)[:, None],
+                      next_state=self.next_state[env_ids].copy())
+
+  def step_output_spec(self):
+    return dict(action=ArraySpec((None, ), np.int32, name='action'),
+                logits=ArraySpec((None, 1), np.float32, name='logits'),
+                next_state=ArraySpec((None, ), np.int32, name='next_state'))
+
+
+class RecordingActor(Actor):
+  """Keeps the experiences of each env instead of sending them."""
+
+  def _setup_exp_sender(self):
+    self.exps = defaultdict(list)
+
+  def _send_experiences(self, exps):
+    for exp in exps:
+      self.exps[int(exp['observation']['id'][0])].append(exp)
+
+
+class ActorAsyncTest(absltest.TestCase):
+
+  def _run_actor(self, use_async_envs, use_shared_memory_envs=False):
+    return RecordingActor(actor_id=1,
+                          shell_class=CountingShell,
+                          shell_config={},
+                          env_class=SlowCounterEnv,
+                          env_configs=[{}] * B,
+                          traj_length=TRAJ_LENGTH,
+                          seed=42,
+                          system_loggers=[],
+                          batch_size=B,
+                          n_unrolls=N_UNROLLS,
+                          use_parallel_envs=True,
+                          use_threaded_envs=True,
+                          use_shared_memory_envs=use_shared_memory_envs,
+                          use_async_envs=use_async_envs,
+                          async_min_ready_envs=1)
+
+  def testMatchesLockstep(self):
+    lockstep_exps = self._run_actor(use_async_envs=False).exps
+    for use_shared_memory_envs in [False, True]:
+      exps = self._run_actor(use_async_envs=True,
+                             use_shared_memory_envs=use_shared_memory_envs).exps
+      # the fast envs get through more unrolls than the slow one.
+      self.assertGreater(len(exps[1]), len(exps[0]))
+      for i in range(B):
+        self.assertNotEmpty(exps[i])
+        for exp, lockstep_exp in zip(exps[i], lockstep_exps[i]):
+          nest.map_structure(np.testing.assert_array_equal, exp, lockstep_exp)
+        # every unroll restarts from the last step of the previous one.
+        for prev_exp, exp in zip(exps[i], exps[i][1:]):
+          np.testing.assert_array_equal(exp['observation']['count'][0],
+                                        prev_exp['observation']['count'][-1])
+          self.assertTrue(np.all(exp['observation']['id'] == i))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -61,7 +61,7 @@ class DummyPS:
         'time': time.time(),
         'iteration': 0,
         'variable_list': [],
-        'hash': U.pyobj_hash({}),
+        'version': ('dummy_learner', 1),
     }
 
     self._server = ZmqServer(
@@ -83,8 +83,8 @@ class DummyPS:
       return PSResponse(type='info')._asdict()
 
     elif request.type == 'parameter':
-      if request.hash is not None:
-        if request.hash == self.param_info['hash']:  # param not changed
+      if request.version is not None:
+        if tuple(request.version) == self.param_info['version']:  # param not changed
           return PSResponse(type='no_change', info=self.param_info)._asdict()
 
       return PSResponse(type='parameters', info=self.param_info,
@@ -106,7 +106,7 @@ class ActorTest(absltest.TestCase):
   def _setup_exp_collector(self):
     exp_server = ExperienceCollectorServer(host=_LOCALHOST,
                                            port=COLLECTOR_FRONTEND_PORT,
-                                           exp_handler=lambda k: None,
+                                           exp_handler=lambda *_: None,
                                            load_balanced=False)
     exp_server.daemon = True
     exp_server.start()
@@ -0,0 +1,86 @@
+import os
+import tempfile
+
+import numpy as np
+from absl.testing import absltest
+from liaison.distributed.data_fetcher import (BatchSlot, LearnerDataPrefetcher, read_batch,
+                                              write_batch)
+
+_LOCALHOST = 'localhost'
+
+
+def _combine(l):
+  if l is None:
+    # kills the worker.
+    os._exit(1)
+  return dict(x=np.stack(l))
+
+
+class BatchSlotTest(absltest.TestCase):
+
+  def setUp(self):
+    fd, self._fname = tempfile.mkstemp()
+    os.close(fd)
+
+  def tearDown(self):
+    os.remove(self._fname)
+
+  def testRoundTrip(self):
+    rng = np.random.RandomState(42)
+    # time major views are not contiguous.
+    nodes = np.swapaxes(rng.randn(2, 5, 3, 4).astype(np.float32), 0, 1)
+    batch = dict(observation=dict(nodes=nodes, n_node=np.arange(10, dtype=np.int32)),
+                 step_type=np.ones((5, 2), np.int8),
+                 replay_keys=[(0, 1), (0, 2)])
+    skeleton, offsets = write_batch(batch, BatchSlot(self._fname))
+    # read from another mapping of the slot.
+    out = read_batch(skeleton, offsets, BatchSlot(self._fname))
+    np.testing.assert_array_equal(out['observation']['nodes'], nodes)
+    np.testing.assert_array_equal(out['observation']['n_node'], np.arange(10))
+    self.assertEqual(out['observation']['n_node'].dtype, np.int32)
+    np.testing.assert_array_equal(out['step_type'], batch['step_type'])
+    self.assertEqual(out['replay_keys'], [(0, 1), (0, 2)])
+
+  def testSlotGrows(self):
+    writer = BatchSlot(self._fname)
+    reader = BatchSlot(self._fname)
+    small = dict(x=np.ones(4))
+    read_batch(*write_batch(small, writer), reader)
+
+    big = dict(x=np.arange(1 << 16, dtype=np.float64))
+    out = read_batch(*write_batch(big, writer), reader)
+    np.testing.assert_array_equal(out['x'], big['x'])
+
+
+class CombineWorkersTest(absltest.TestCase):
+
+  def _get_fetcher(self):
+    os.environ.update(
+        dict(SYMPH_SAMPLER_FRONTEND_HOST=_LOCALHOST,
+             SYMPH_SAMPLER_FRONTEND_PORT='6080',
+             SYMPH_PREFETCH_QUEUE_PORT='6081'))
+    fetcher = LearnerDataPrefetcher(batch_size=2,
+                                    prefetch_batch_size=1,
+                                    combine_trajs=_combine,
+                                    max_prefetch_queue=4,
+                                    prefetch_processes=1,
+                                    prefetch_threads_per_process=1,
+                                    tmp_dir=tempfile.gettempdir(),
+                                    compress_before_send=False,
+                                    combine_processes=1)
+    # not started to feed the trajectories directly.
+    fetcher._start_combine_workers()
+    return fetcher
+
+  def testWorkerDeathRaises(self):
+    fetcher = self._get_fetcher()
+    fetcher._traj_queue.put([np.ones(3), np.zeros(3)])
+    np.testing.assert_array_equal(fetcher.get()['x'], [np.ones(3), np.zeros(3)])
+
+    fetcher._traj_queue.put(None)
+    with self.assertRaisesRegex(RuntimeError, 'died'):
+      fetcher.get()
+
+
+if __name__ == '__main__':
+  absltest.main()
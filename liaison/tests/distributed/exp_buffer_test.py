@@ -0,0 +1,30 @@
+"""Tests for the dedup hashing in ExpBuffer."""
+
+import numpy as np
+from absl.testing import absltest
+from liaison.distributed.exp_sender import ExpBuffer
+
+
+class ExpBufferTest(absltest.TestCase):
+
+  def testDedup(self):
+    buf = ExpBuffer(min_hash_bytes=64)
+    edges = np.random.rand(1000, 1).astype(np.float32)
+    for i in range(4):
+      buf.add(dict(obs=dict(edges=edges.copy(), step=np.int32(i), small=np.zeros(2))), {})
+    exp_list, storage = buf.flush()
+    self.assertLen(storage, 1)
+    hashes = set([exp['obs_hash']['edges'] for exp in exp_list])
+    self.assertLen(hashes, 1)
+    # small leaves are inlined.
+    self.assertEqual(exp_list[3]['obs_hash']['step'], 3)
+    self.assertIsInstance(exp_list[3]['obs_hash']['small'], np.ndarray)
+
+  def testHashKeyedOnDtypeAndShape(self):
+    arr = np.zeros(256, dtype=np.int32)
+    self.assertNotEqual(ExpBuffer._hash_leaf(arr), ExpBuffer._hash_leaf(arr.view(np.float32)))
+    self.assertNotEqual(ExpBuffer._hash_leaf(arr), ExpBuffer._hash_leaf(arr.reshape(16, 16)))
+
+
+if __name__ == '__main__':
+  absltest.main()
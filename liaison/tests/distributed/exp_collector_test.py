@@ -0,0 +1,51 @@
+"""Sends experience through a real ExpSender/ExperienceCollectorServer pair."""
+
+import queue
+
+import numpy as np
+from absl.testing import absltest
+from liaison.distributed.exp_collector import ExperienceCollectorServer
+from liaison.distributed.exp_sender import ExpSender
+
+COLLECTOR_HOST = 'localhost'
+COLLECTOR_PORT = 6010
+
+
+class ExpCollectorTest(absltest.TestCase):
+
+  def _start_collector(self, compress):
+    received = queue.Queue()
+    collector = ExperienceCollectorServer(
+        host='*',
+        port=COLLECTOR_PORT + int(compress),
+        exp_handler=lambda exp, nbytes: received.put((exp, nbytes)),
+        compress_before_send=compress,
+        load_balanced=False)
+    collector.daemon = True
+    collector.start()
+    return received
+
+  def testTwoFlushes(self):
+    for compress in [False, True]:
+      received = self._start_collector(compress)
+      sender = ExpSender(host=COLLECTOR_HOST,
+                         port=COLLECTOR_PORT + int(compress),
+                         flush_iteration=None,
+                         compress_before_send=compress,
+                         manual_flush=True,
+                         min_hash_bytes=64)
+      nodes = np.random.rand(100, 16).astype(np.float32)
+      for i in range(2):
+        sender.send(dict(obs=dict(nodes=nodes + i)), dict(step=i))
+        # the second flush fails on the REQ socket without the ack.
+        sender.flush()
+
+      for i in range(2):
+        exp, nbytes = received.get(timeout=10)
+        self.assertEqual(exp['step'], i)
+        np.testing.assert_array_equal(exp['obs']['nodes'], nodes + i)
+        self.assertEqual(nbytes, nodes.nbytes)
+
+
+if __name__ == '__main__':
+  absltest.main()
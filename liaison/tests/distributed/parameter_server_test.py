@@ -19,8 +19,7 @@ SYMPH_PARAMETER_PUBLISH_PORT = "6000"
 
 N_SHARDS = 4
 SYMPH_PS_FRONTEND_HOST = "localhost"
-SYMPH_PS_FRONTEND_PORT = "6001"
-SYMPH_PS_BACKEND_PORT = "6002"
+SYMPH_PS_FRONTEND_PORTS = ["6001", "6002", "6003", "6004"]
 
 
 class ParameterServerTest(tf.test.TestCase):
@@ -28,10 +27,11 @@ class ParameterServerTest(tf.test.TestCase):
   def _get_ps_publisher(self):
 
     return ParameterPublisher(port=SYMPH_PARAMETER_PUBLISH_PORT,
-                              agent_scope='learner')
+                              agent_scope='learner',
+                              n_shards=N_SHARDS)
 
   def _get_ps_client(self):
-    return ParameterClient(port=SYMPH_PS_FRONTEND_PORT,
+    return ParameterClient(port=SYMPH_PS_FRONTEND_PORTS,
                            host=SYMPH_PS_FRONTEND_HOST,
                            timeout=0.1,
                            agent_scope='shell')
@@ -41,10 +41,14 @@ class ParameterServerTest(tf.test.TestCase):
 
   def _setup_env(self):
     os.environ.update(
-        dict(SYMPH_PS_FRONTEND_PORT=SYMPH_PS_FRONTEND_PORT,
-             SYMPH_PS_BACKEND_PORT=SYMPH_PS_BACKEND_PORT,
-             SYMPH_PARAMETER_PUBLISH_PORT=SYMPH_PARAMETER_PUBLISH_PORT,
+        dict(SYMPH_PARAMETER_PUBLISH_PORT=SYMPH_PARAMETER_PUBLISH_PORT,
              SYMPH_PARAMETER_PUBLISH_HOST=SYMPH_PARAMETER_PUBLISH_HOST))
+    # shard 0 uses the plain service name. (see U.shard_service_name)
+    os.environ.update(
+        dict(SYMPH_PS_FRONTEND_PORT=SYMPH_PS_FRONTEND_PORTS[0],
+             SYMPH_PS_FRONTEND_1_PORT=SYMPH_PS_FRONTEND_PORTS[1],
+             SYMPH_PS_FRONTEND_2_PORT=SYMPH_PS_FRONTEND_PORTS[2],
+             SYMPH_PS_FRONTEND_3_PORT=SYMPH_PS_FRONTEND_PORTS[3]))
 
   def testSetup(self):
     self._setup_env()
@@ -65,7 +69,7 @@ class ParameterServerTest(tf.test.TestCase):
           'learner/y': np.array(i, dtype=np.int32)
       }
       pub.publish(i, var_dict)
-      vars_to_fetch = ['shell/x']
+      vars_to_fetch = ['shell/x', 'shell/y']
       while True:
         param, info = cli.fetch_parameter_with_info(vars_to_fetch)
         if info is None:
@@ -0,0 +1,86 @@
+import numpy as np
+from absl.testing import absltest, parameterized
+from liaison.distributed.parameter_codec import decode, decode_parameters, encode
+from liaison.distributed.parameter_server import (ConsistentHashRing, ParameterStore, PSRequest)
+
+
+def _info(iteration, learner_id='learner_0'):
+  return dict(agent_scope='learner', version=(learner_id, iteration))
+
+
+def _request(version=None, codec=None):
+  return PSRequest(type='parameter',
+                   var_list=['shell/w:0', 'shell/b:0'],
+                   agent_scope='shell',
+                   version=version,
+                   codec=codec)
+
+
+class ParameterStoreTest(parameterized.TestCase):
+
+  def testNotReady(self):
+    self.assertEqual(ParameterStore().handle_request(_request()).type, 'not_ready')
+
+  def testDelta(self):
+    store = ParameterStore()
+    w = np.ones((4, 4), dtype=np.float32)
+    store.set({'learner/w:0': w, 'learner/b:0': np.zeros(4)}, _info(1))
+    response = store.handle_request(_request())
+    self.assertEqual(sorted(response.parameters.keys()), ['shell/b:0', 'shell/w:0'])
+    version = response.info['version']
+
+    self.assertEqual(store.handle_request(_request(version)).type, 'no_change')
+
+    store.set({'learner/w:0': w.copy(), 'learner/b:0': np.ones(4)}, _info(2))
+    response = store.handle_request(_request(version))
+    self.assertEqual(list(response.parameters.keys()), ['shell/b:0'])
+    np.testing.assert_array_equal(response.parameters['shell/b:0'], np.ones(4))
+
+    # iterations of another learner are not comparable.
+    store.set({'learner/w:0': w, 'learner/b:0': np.ones(4)}, _info(3, 'learner_1'))
+    response = store.handle_request(_request(version))
+    self.assertLen(response.parameters, 2)
+
+  def testBroadcastMessage(self):
+    store = ParameterStore()
+    w = np.ones((4, 4), dtype=np.float32)
+    store.set({'learner/w:0': w, 'learner/b:0': np.zeros(4)}, _info(1))
+    base_version, params, _ = store.broadcast_message(None)
+    self.assertIsNone(base_version)
+    self.assertLen(params, 2)
+
+    store.set({'learner/w:0': w, 'learner/b:0': np.ones(4)}, _info(2))
+    base_version, params, info = store.broadcast_message(None)
+    self.assertEqual(base_version, ('learner_0', 1))
+    self.assertEqual(list(params.keys()), ['learner/b:0'])
+    self.assertEqual(info['version'], ('learner_0', 2))
+
+  def testConsistentHashRing(self):
+    keys = ['layer_%d/w:0' % i for i in range(1000)]
+    ring = ConsistentHashRing(4)
+    shards = [ring.shard(k) for k in keys]
+    self.assertEqual(shards, [ConsistentHashRing(4).shard(k) for k in keys])
+    self.assertLen(set(shards), 4)
+    # adding a shard moves keys only to the new shard.
+    ring5 = ConsistentHashRing(5)
+    for k, shard in zip(keys, shards):
+      self.assertIn(ring5.shard(k), [shard, 4])
+
+  @parameterized.parameters((None, 0), ('lz4', 0), ('fp16', 1e-3), ('bf16', 1e-2))
+  def testCodec(self, codec, rtol):
+    store = ParameterStore()
+    w = np.random.RandomState(42).randn(64, 64).astype(np.float32)
+    b = np.arange(4, dtype=np.int64)
+    store.set({'learner/w:0': w, 'learner/b:0': b}, _info(1))
+    params = decode_parameters(store.handle_request(_request(codec=codec)).parameters)
+    self.assertEqual(params['shell/w:0'].dtype, np.float32)
+    np.testing.assert_allclose(params['shell/w:0'], w, rtol=rtol)
+    np.testing.assert_array_equal(params['shell/b:0'], b)
+
+  def testScalar(self):
+    for codec in ['lz4', 'fp16', 'bf16']:
+      self.assertEqual(decode(encode(np.float32(2.5), codec)), 2.5)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,60 @@
+import os
+import time
+
+import numpy as np
+from absl.testing import absltest
+from liaison.distributed import (ParameterClient, ParameterSubscriber, SimpleParameterPublisher,
+                                 SimpleParameterServer)
+
+_LOCALHOST = 'localhost'
+PUBLISH_PORT = '6010'
+SERVING_PORT = '6011'
+BROADCAST_PORT = '6012'
+N_SUBSCRIBERS = 16
+VAR_NAMES = ['shell/w:0', 'shell/b:0']
+
+
+class ParameterSubscriberTest(absltest.TestCase):
+
+  def _wait_for(self, subscribers, version):
+    for _ in range(100):
+      if all(sub._version == version for sub in subscribers):
+        return
+      time.sleep(.1)
+    self.fail('Subscribers did not receive version %s' % (version, ))
+
+  def testBroadcast(self):
+    server = SimpleParameterServer(publish_port=PUBLISH_PORT,
+                                   serving_port=SERVING_PORT,
+                                   broadcast_port=BROADCAST_PORT,
+                                   broadcast_codec='lz4')
+    server.daemon = True
+    server.start()
+    publisher = SimpleParameterPublisher(host=_LOCALHOST, port=PUBLISH_PORT, agent_scope='learner')
+    w = np.ones((64, 64), dtype=np.float32)
+    publisher.publish(0, {'learner/w:0': w, 'learner/b:0': np.zeros(4)})
+
+    subscribers = []
+    for _ in range(N_SUBSCRIBERS):
+      client = ParameterClient(host=_LOCALHOST, port=SERVING_PORT, agent_scope='shell')
+      subscribers.append(
+          ParameterSubscriber(host=_LOCALHOST,
+                              port=BROADCAST_PORT,
+                              ps_client=client,
+                              agent_scope='shell',
+                              var_names=VAR_NAMES))
+    for sub in subscribers:
+      # first call pulls everything.
+      self.assertEqual(sorted(sub.get_latest().keys()), sorted(VAR_NAMES))
+      self.assertEqual(sub.get_latest(), {})
+
+    publisher.publish(1, {'learner/w:0': w, 'learner/b:0': np.ones(4)})
+    self._wait_for(subscribers, (publisher._learner_id, 2))
+    for sub in subscribers:
+      latest = sub.get_latest()
+      self.assertEqual(list(latest.keys()), ['shell/b:0'])
+      np.testing.assert_array_equal(latest['shell/b:0'], np.ones(4))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -52,7 +52,7 @@ class DummyPS:
         'time': time.time(),
         'iteration': 0,
         'variable_list': [],
-        'hash': U.pyobj_hash({}),
+        'version': ('dummy_learner', 1),
     }
 
     self._server = ZmqServer(
@@ -74,8 +74,8 @@ class DummyPS:
       return PSResponse(type='info')._asdict()
 
     elif request.type == 'parameter':
-      if request.hash is not None:
-        if request.hash == self.param_info['hash']:  # param not changed
+      if request.version is not None:
+        if tuple(request.version) == self.param_info['version']:  # param not changed
           return PSResponse(type='no_change', info=self.param_info)._asdict()
 
       return PSResponse(type='parameters', info=self.param_info,
@@ -0,0 +1,58 @@
+import numpy as np
+from absl.testing import absltest
+from liaison.distributed import (ParameterClient, SimpleParameterPublisher, SimpleParameterServer)
+
+_LOCALHOST = 'localhost'
+N_SHARDS = 3
+PUBLISH_PORTS = [6050, 6051, 6052]
+SERVING_PORTS = [6060, 6061, 6062]
+N_VARS = 12
+
+
+class ShardedFetchTest(absltest.TestCase):
+
+  def _start_servers(self):
+    servers = []
+    for publish_port, serving_port in zip(PUBLISH_PORTS, SERVING_PORTS):
+      server = SimpleParameterServer(publish_port=publish_port, serving_port=serving_port)
+      server.daemon = True
+      server.start()
+      servers.append(server)
+    return servers
+
+  def testFetch(self):
+    servers = self._start_servers()
+    publisher = SimpleParameterPublisher(host=_LOCALHOST,
+                                         port=PUBLISH_PORTS,
+                                         agent_scope='learner')
+    client = ParameterClient(host=_LOCALHOST,
+                             port=SERVING_PORTS,
+                             agent_scope='shell')
+    var_dict = {'learner/v%d:0' % i: np.full(4, i, dtype=np.float32) for i in range(N_VARS)}
+    var_names = ['shell/v%d:0' % i for i in range(N_VARS)]
+    publisher.publish(0, var_dict)
+
+    params, info = client.fetch_parameter_with_info(var_names)
+    self.assertEqual(info['iteration'], 0)
+    self.assertCountEqual(params.keys(), var_names)
+    for i in range(N_VARS):
+      np.testing.assert_array_equal(params['shell/v%d:0' % i], var_dict['learner/v%d:0' % i])
+
+    # every shard holds a disjoint part of the variables.
+    shard_vars = [set(server._store._snapshot[0]) for server in servers]
+    self.assertTrue(all(shard_vars))
+    self.assertEqual(sum(map(len, shard_vars)), N_VARS)
+    self.assertEqual(set.union(*shard_vars), set(var_dict))
+
+    # only the changed variable is fetched again.
+    var_dict = dict(var_dict)
+    var_dict['learner/v3:0'] = np.zeros(4, dtype=np.float32)
+    publisher.publish(1, var_dict)
+    params, info = client.fetch_parameter_with_info(var_names)
+    self.assertEqual(info['iteration'], 1)
+    self.assertCountEqual(params.keys(), ['shell/v3:0'])
+    np.testing.assert_array_equal(params['shell/v3:0'], np.zeros(4))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,62 @@
+import json
+
+import liaison.utils as U
+from absl.testing import absltest
+from liaison.distributed.step_tracer import StepTracer, merge_host_spans
+
+
+class StepTracerTest(absltest.TestCase):
+
+  def _run_step(self, tracer, step, update_time):
+    traced = tracer.begin_step(step)
+    with U.Timer() as timer:
+      pass
+    return traced, tracer.end_step(step, update_time, dict(update=timer))
+
+  def testDisabled(self):
+    tracer = StepTracer(0, 5, .01)
+    for step in range(10):
+      self.assertEqual(self._run_step(tracer, step, 1.), (False, None))
+
+  def testRollingFiles(self):
+    tracer = StepTracer(2, 3, 1.)
+    fnames = []
+    for step in range(20):
+      traced, trace = self._run_step(tracer, step, 1.)
+      self.assertEqual(traced, trace is not None)
+      if trace is not None:
+        fnames.append(trace[0])
+        self.assertEqual([name for name, _, _ in trace[1]], ['update'])
+    self.assertEqual(fnames, ['trace_%d.json' % (i % 3) for i in range(len(fnames))])
+    self.assertLen(fnames, 9)
+
+  def testOverheadBudget(self):
+    tracer = StepTracer(10, 5, .01)
+    traced_steps = []
+    for step in range(1000):
+      # traced updates take twice as long.
+      traced = tracer.begin_step(step)
+      tracer.end_step(step, 2. if traced else 1., {})
+      if traced:
+        traced_steps.append(step)
+    # a traced step every 100 steps keeps the slow down at 1%.
+    self.assertEqual(traced_steps[:3], [10, 110, 210])
+
+  def testMergeHostSpans(self):
+    ctf = json.dumps(
+        dict(traceEvents=[
+            dict(name='process_name', ph='M', pid=0, args=dict(name='/gpu:0')),
+            dict(name='MatMul', ph='X', pid=0, tid=0, ts=10, dur=5),
+            dict(name='process_name', ph='M', pid=1, args=dict(name='/cpu:0')),
+        ]))
+    trace = json.loads(merge_host_spans(ctf, [('update', 1., .5)], 7))
+    events = trace['traceEvents'][3:]
+    self.assertEqual(events[0]['pid'], 2)
+    self.assertEqual(events[0]['args']['name'], 'Learner host (step 7)')
+    self.assertEqual(events[1]['name'], 'update')
+    self.assertEqual(events[1]['ts'], 1e6)
+    self.assertEqual(events[1]['dur'], 5e5)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,257 @@
+"""Tests for the actor side trajectory."""
+
+import numpy as np
+from absl.testing import absltest
+from liaison.agents import StepOutput
+from liaison.distributed.trajectory import Trajectory, is_packed_static
+from liaison.env import StepType
+from liaison.specs.specs import ArraySpec
+from tensorflow.contrib.framework import nest
+
+B = 2
+T = 4
+
+
+def _obs_spec():
+  return dict(graph_features=dict(edges=ArraySpec((B, 5, 1), np.float32, name='edges'),
+                                  nodes=ArraySpec((B, 3, 2), np.float32, name='nodes')),
+              mask=ArraySpec((B, 3), np.int32, name='mask'))
+
+
+def _step_output_spec():
+  return dict(action=ArraySpec((B, ), np.int32, name='action'),
+              logits=ArraySpec((B, 3), np.float32, name='logits'),
+              next_state=ArraySpec((B, ), np.int32, name='next_state'))
+
+
+def _obs(t, episode, n=B):
+  return dict(graph_features=dict(edges=np.full((n, 5, 1), episode, np.float32),
+                                  nodes=np.full((n, 3, 2), t, np.float32)),
+              mask=np.ones((n, 3), np.int32))
+
+
+# max # of nodes and edges of the graph observations.
+N = 4
+E = 6
+GRAPH_FIELDS = ['nodes', 'edges', 'senders', 'receivers']
+
+
+def _graph_obs_spec():
+  return dict(graph_features=dict(nodes=ArraySpec((B, N, 2), np.float32, name='nodes'),
+                                  edges=ArraySpec((B, E, 1), np.float32, name='edges'),
+                                  senders=ArraySpec((B, E), np.int32, name='senders'),
+                                  receivers=ArraySpec((B, E), np.int32, name='receivers'),
+                                  n_node=ArraySpec((B, ), np.int32, name='n_node'),
+                                  n_edge=ArraySpec((B, ), np.int32, name='n_edge')))
+
+
+def _graph_obs(t, episode):
+  nodes = np.zeros((B, N, 2), np.float32)
+  edges = np.zeros((B, E, 1), np.float32)
+  senders = np.zeros((B, E), np.int32)
+  receivers = np.zeros((B, E), np.int32)
+  n_edge = np.zeros(B, np.int32)
+  # graph structure is fixed within an episode.
+  n_node = np.int32([2 + (episode + i) % (N - 1) for i in range(B)])
+  for i in range(B):
+    rng = np.random.RandomState(episode * B + i)
+    n_edge[i] = rng.randint(E + 1)
+    edges[i, :n_edge[i]] = rng.randn(n_edge[i], 1)
+    senders[i, :n_edge[i]] = rng.randint(n_node[i], size=n_edge[i])
+    receivers[i, :n_edge[i]] = rng.randint(n_node[i], size=n_edge[i])
+    nodes[i, :n_node[i]] = t + np.random.RandomState(t).randn(n_node[i], 2)
+  return dict(graph_features=dict(nodes=nodes,
+                                  edges=edges,
+                                  senders=senders,
+                                  receivers=receivers,
+                                  n_node=n_node,
+                                  n_edge=n_edge))
+
+
+def _add(traj, t, env_ids):
+  n = len(env_ids)
+  traj.add(step_type=np.full(n, StepType.MID, np.int8),
+           reward=np.full(n, t, np.float32),
+           discount=np.ones(n, np.float32),
+           observation=_obs(t, 0, n),
+           step_output=StepOutput(action=np.full(n, t, np.int32),
+                                  logits=np.zeros((n, 3), np.float32),
+                                  next_state=np.zeros(n, np.int32)),
+           env_ids=env_ids)
+
+
+class TrajectoryTest(absltest.TestCase):
+
+  def _run(self, static_obs_keys, traj_length=None, traj=None):
+    if traj is None:
+      traj = Trajectory(_obs_spec(),
+                        _step_output_spec(),
+                        static_obs_keys=static_obs_keys,
+                        traj_length=traj_length)
+      traj.reset()
+    traj.start(step_type=np.full(B, StepType.FIRST, np.int8),
+               reward=np.zeros(B, np.float32),
+               discount=np.ones(B, np.float32),
+               observation=_obs(0, 0),
+               next_state=np.zeros(B, np.int32))
+    for t in range(1, T + 1):
+      # new episode starts at t = 3
+      episode = int(t >= 3)
+      step_type = StepType.FIRST if t == 3 else StepType.MID
+      traj.add(step_type=np.full(B, step_type, np.int8),
+               reward=np.full(B, t, np.float32),
+               discount=np.ones(B, np.float32),
+               observation=_obs(t, episode),
+               step_output=StepOutput(action=np.zeros(B, np.int32),
+                                      logits=np.zeros((B, 3), np.float32),
+                                      next_state=np.zeros(B, np.int32)))
+    return traj, traj.debatch_and_stack()
+
+  def testStaticFieldsPacked(self):
+    self._test_static_fields_packed(traj_length=None)
+
+  def testColumnarStaticFieldsPacked(self):
+    self._test_static_fields_packed(traj_length=T)
+
+  def testColumnarMatchesStack(self):
+    traj, exps = self._run([], traj_length=T)
+    self.assertLen(exps, B)
+    _, ref_exps = self._run([])
+    for exp, ref_exp in zip(exps, ref_exps):
+      for v, ref_v in zip(nest.flatten_up_to(traj.spec, exp), nest.flatten_up_to(traj.spec, ref_exp)):
+        self.assertEqual(v.dtype, ref_v.dtype)
+        np.testing.assert_array_equal(v, ref_v)
+    self.assertEqual(exps[0]['step_output']['action'].shape, (T, ))
+    self.assertEqual(exps[0]['reward'].shape, (T + 1, ))
+
+  def testColumnarBuffersRecycled(self):
+    traj, exps = self._run(['graph_features/edges'], traj_length=T)
+    bufs = traj.reset()
+    self.assertIsNotNone(bufs)
+    # the handed out trajectories still view into the finished unroll's
+    # buffers, so they aren't written before they are recycled.
+    self.assertIsNot(traj._bufs, bufs[0])
+    traj.reset()
+    traj.recycle(bufs)
+    traj.reset()
+    self.assertIs(traj._bufs, bufs[0])
+    self.assertIs(traj._segment_ids, bufs[1])
+
+    # a recycled unroll is written like a fresh one.
+    _, ref_exps = self._run(['graph_features/edges'], traj_length=T)
+    _, exps = self._run(['graph_features/edges'], traj=traj)
+    for exp, ref_exp in zip(exps, ref_exps):
+      for v, ref_v in zip(nest.flatten(exp), nest.flatten(ref_exp)):
+        np.testing.assert_array_equal(v, ref_v)
+
+  def testAsyncPerEnvStepCounters(self):
+    traj = Trajectory(_obs_spec(),
+                      _step_output_spec(),
+                      static_obs_keys=['graph_features/edges'],
+                      traj_length=T)
+    traj.reset()
+    traj.start(step_type=np.full(B, StepType.FIRST, np.int8),
+               reward=np.zeros(B, np.float32),
+               discount=np.ones(B, np.float32),
+               observation=_obs(0, 0),
+               next_state=np.zeros(B, np.int32))
+    for t in range(1, T + 1):
+      _add(traj, t, [0])
+      # env 1 is twice as slow.
+      if t % 2 == 0:
+        _add(traj, t, [1])
+
+    env_ids, exps = traj.pop_finished()
+    np.testing.assert_array_equal(env_ids, [0])
+    np.testing.assert_array_equal(exps[0]['reward'], np.arange(T + 1))
+    np.testing.assert_array_equal(exps[0]['step_output']['action'], np.arange(1, T + 1))
+    self.assertLen(exps[0]['observation']['graph_features']['edges']['static_segments'], 1)
+    # env 1 is still midway.
+    self.assertEqual(len(traj), T // 2 + 1)
+
+    # popped rows are reused by the next unroll.
+    _add(traj, -1, [0])
+    np.testing.assert_array_equal(exps[0]['reward'], np.arange(T + 1))
+
+  def _run_graphs(self, static_obs_keys, graph_obs_keys, traj_length):
+    traj = Trajectory(_graph_obs_spec(),
+                      _step_output_spec(),
+                      static_obs_keys=static_obs_keys,
+                      traj_length=traj_length,
+                      graph_obs_keys=graph_obs_keys)
+    traj.reset()
+    traj.start(step_type=np.full(B, StepType.FIRST, np.int8),
+               reward=np.zeros(B, np.float32),
+               discount=np.ones(B, np.float32),
+               observation=_graph_obs(0, 0),
+               next_state=np.zeros(B, np.int32))
+    for t in range(1, T + 1):
+      episode = int(t >= 3)
+      traj.add(step_type=np.full(B, StepType.FIRST if t == 3 else StepType.MID, np.int8),
+               reward=np.full(B, t, np.float32),
+               discount=np.ones(B, np.float32),
+               observation=_graph_obs(t, episode),
+               step_output=StepOutput(action=np.zeros(B, np.int32),
+                                      logits=np.zeros((B, 3), np.float32),
+                                      next_state=np.zeros(B, np.int32)))
+    return traj, traj.debatch_and_stack()
+
+  def testGraphsPacked(self):
+    for traj_length in [None, T]:
+      self._test_graphs_packed([], traj_length)
+      self._test_graphs_packed(
+          ['graph_features/' + k for k in ['edges', 'senders', 'receivers', 'n_edge']], traj_length)
+
+  def _test_graphs_packed(self, static_obs_keys, traj_length):
+    traj, exps = self._run_graphs(static_obs_keys, ['graph_features'], traj_length)
+    _, ref_exps = self._run_graphs([], [], traj_length)
+    # padding is stripped before shipping.
+    nodes = exps[0]['observation']['graph_features']['nodes']
+    ref_graph = ref_exps[0]['observation']['graph_features']
+    self.assertEqual(nodes.shape, (ref_graph['n_node'].sum(), 2))
+
+    batch = Trajectory.batch(exps, traj.spec, ['graph_features'])
+    graph = batch['observation']['graph_features']
+    ref_graph = Trajectory.batch(ref_exps, traj.spec)['observation']['graph_features']
+    np.testing.assert_array_equal(graph['n_node'], ref_graph['n_node'])
+    np.testing.assert_array_equal(graph['n_edge'], ref_graph['n_edge'])
+
+    # flatten the padded graphs in time major order.
+    n_node = ref_graph['n_node'].ravel()
+    n_edge = ref_graph['n_edge'].ravel()
+    ref = {k: ref_graph[k].reshape((-1, ) + ref_graph[k].shape[2:]) for k in GRAPH_FIELDS}
+    offsets = np.cumsum(n_node) - n_node
+    np.testing.assert_array_equal(graph['nodes'],
+                                  np.concatenate([v[:n] for v, n in zip(ref['nodes'], n_node)]))
+    for k in ['edges', 'senders', 'receivers']:
+      expected = np.concatenate([v[:n] for v, n in zip(ref[k], n_edge)])
+      if k != 'edges':
+        expected += np.repeat(offsets, n_edge)
+      np.testing.assert_array_equal(graph[k], expected)
+      self.assertEqual(graph[k].dtype, ref_graph[k].dtype)
+
+    spec = Trajectory.format_traj_spec(traj.spec, B, T, ['graph_features'])
+    self.assertEqual(spec['observation']['graph_features']['nodes'].shape, (None, 2))
+    self.assertEqual(spec['observation']['graph_features']['senders'].shape, (None, ))
+    self.assertEqual(spec['observation']['graph_features']['n_node'].shape, (T + 1, B))
+
+  def _test_static_fields_packed(self, traj_length):
+    traj, exps = self._run(['graph_features/edges'], traj_length)
+    self.assertLen(exps, B)
+    edges = exps[0]['observation']['graph_features']['edges']
+    self.assertTrue(is_packed_static(edges))
+    # two episode segments in the unroll
+    self.assertLen(edges['static_segments'], 2)
+
+    batch = Trajectory.batch(exps, traj.spec)
+    _, ref_exps = self._run([])
+    ref_batch = Trajectory.batch(ref_exps, traj.spec)
+    np.testing.assert_array_equal(batch['observation']['graph_features']['edges'],
+                                  ref_batch['observation']['graph_features']['edges'])
+    self.assertEqual(batch['observation']['graph_features']['edges'].shape, (T + 1, B, 5, 1))
+    np.testing.assert_array_equal(batch['observation']['graph_features']['edges'][:, 0, 0, 0],
+                                  [0, 0, 0, 1, 1])
+
+
+if __name__ == '__main__':
+  absltest.main()
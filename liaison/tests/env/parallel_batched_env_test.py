@@ -0,0 +1,129 @@
+import time
+
+import numpy as np
+from absl.testing import absltest
+from liaison.env import Env as BaseEnv
+from liaison.env.batch import ParallelBatchedEnv
+from liaison.env.environment import restart, transition
+from liaison.specs import ArraySpec, BoundedArraySpec
+from tensorflow.contrib.framework import nest
+
+B = 4
+
+
+class CounterEnv(BaseEnv):
+  """Observes the number of steps taken so far and the env id."""
+
+  def __init__(self, id, seed):
+    self._id = id
+    self._t = 0
+
+  def _obs(self):
+    return dict(count=np.full(3, self._t, np.float32), id=np.int32(self._id))
+
+  def reset(self):
+    self._t = 0
+    return restart(self._obs())
+
+  def step(self, action):
+    self._t += 1
+    # depends on the env so that the rows of the non-observation fields
+    # can be told apart.
+    return transition(np.float32(10 * self._id + action), self._obs())
+
+  def observation_spec(self):
+    return dict(count=ArraySpec((3, ), np.float32, name='count'),
+                id=ArraySpec((), np.int32, name='id'))
+
+  def action_spec(self):
+    return BoundedArraySpec((), np.int32, minimum=0, maximum=9, name='action')
+
+  def set_seed(self, seed):
+    pass
+
+
+class SlowCounterEnv(CounterEnv):
+  """Env 0 takes much longer to step than the rest."""
+
+  def step(self, action):
+    if self._id == 0:
+      time.sleep(.2)
+    return super().step(action)
+
+
+def _copy_ts(ts):
+  # shared memory timesteps are only valid till the next call.
+  return nest.map_structure(np.array, dict(ts._asdict()))
+
+
+class ParallelBatchedEnvTest(absltest.TestCase):
+
+  def _get_env(self, use_shared_memory, env_class=CounterEnv):
+    return ParallelBatchedEnv(B,
+                              env_class, [{}] * B,
+                              seed=42,
+                              use_threads=True,
+                              use_shared_memory=use_shared_memory)
+
+  def _run(self, env):
+    tss = [_copy_ts(env.reset())]
+    for t in range(3):
+      tss.append(_copy_ts(env.step(np.full(B, t, np.int32))))
+    return tss
+
+  def testSharedMemoryMatchesQueues(self):
+    tss = self._run(self._get_env(use_shared_memory=False))
+    shm_tss = self._run(self._get_env(use_shared_memory=True))
+    for ts, shm_ts in zip(tss, shm_tss):
+      nest.map_structure(np.testing.assert_array_equal, ts, shm_ts)
+      nest.map_structure(lambda v, v2: self.assertEqual(v.dtype, v2.dtype), ts, shm_ts)
+
+  def testSharedMemoryRows(self):
+    env = self._get_env(use_shared_memory=True)
+    env.reset()
+    for t in range(3):
+      ts = env.step(np.full(B, t, np.int32))
+      # observations already carry the batch dim.
+      self.assertEqual(ts.observation['count'].shape, (B, 3))
+      np.testing.assert_array_equal(ts.observation['id'], np.arange(B))
+      np.testing.assert_array_equal(ts.observation['count'], np.full((B, 3), t + 1))
+      # non-observation fields are laid out with a batch dim added.
+      self.assertEqual(ts.reward.shape, (B, ))
+      np.testing.assert_array_equal(ts.reward, 10 * np.arange(B) + t)
+
+  def testAsyncStepping(self):
+    for use_shared_memory in [False, True]:
+      env = self._get_env(use_shared_memory, env_class=SlowCounterEnv)
+      lockstep_env = self._get_env(use_shared_memory=False)
+      env.reset()
+      lockstep_env.reset()
+      for t in range(2):
+        action = np.arange(B, dtype=np.int32) + t
+        expected = _copy_ts(lockstep_env.step(action))
+
+        env.async_send(action, np.arange(B))
+        env_ids, ts = env.async_recv(min_envs=1)
+        # the slow env is left in flight.
+        self.assertNotIn(0, env_ids)
+        np.testing.assert_array_equal(env_ids, np.sort(env_ids))
+        nest.map_structure(lambda v, v2: np.testing.assert_array_equal(v[env_ids], v2),
+                           expected, _copy_ts(ts))
+        with self.assertRaises(AssertionError):
+          env.async_send(action[:1], [0])
+        # lockstep calls are refused while steps are in flight.
+        with self.assertRaises(AssertionError):
+          env.reset()
+
+        done = set(env_ids)
+        while len(done) < B:
+          env_ids, ts = env.async_recv(min_envs=B)
+          np.testing.assert_array_equal(env_ids, np.sort(env_ids))
+          nest.map_structure(lambda v, v2: np.testing.assert_array_equal(v[env_ids], v2),
+                             expected, _copy_ts(ts))
+          done.update(env_ids)
+      # all the steps are received.
+      env.reset()
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,68 @@
+import numpy as np
+from absl.testing import absltest
+from liaison.env import Env as BaseEnv
+from liaison.env.environment import restart, transition
+from liaison.env.batch import SerialBatchedEnv
+from liaison.specs import ArraySpec, BoundedArraySpec
+
+B = 4
+
+
+class CounterEnv(BaseEnv):
+  """Observes the number of steps taken so far."""
+
+  def __init__(self, id, seed):
+    self._id = id
+    self._t = 0
+
+  def _obs(self):
+    # float64 and python ints on purpose to exercise the dtype casts.
+    return dict(count=np.full(3, self._t, np.float64), id=self._id)
+
+  def reset(self):
+    self._t = 0
+    return restart(self._obs())
+
+  def step(self, action):
+    self._t += 1
+    return transition(1, self._obs())
+
+  def observation_spec(self):
+    return dict(count=ArraySpec((3, ), np.float32, name='count'),
+                id=ArraySpec((), np.int32, name='id'))
+
+  def action_spec(self):
+    return BoundedArraySpec((), np.int32, minimum=0, maximum=1, name='action')
+
+  def set_seed(self, seed):
+    pass
+
+
+class SerialBatchedEnvTest(absltest.TestCase):
+
+  def _get_env(self, reuse_buffers):
+    return SerialBatchedEnv(B, CounterEnv, [{}] * B, seed=42, reuse_buffers=reuse_buffers)
+
+  def testStackTs(self):
+    env = self._get_env(reuse_buffers=False)
+    env.reset()
+    ts = env.step(np.zeros(B, np.int32))
+    self.assertEqual(ts.observation['count'].dtype, np.float32)
+    self.assertEqual(ts.observation['count'].shape, (B, 3))
+    self.assertEqual(ts.reward.dtype, np.float32)
+    np.testing.assert_array_equal(ts.observation['id'], np.arange(B))
+    ts2 = env.step(np.zeros(B, np.int32))
+    # fresh arrays on every call.
+    np.testing.assert_array_equal(ts.observation['count'], np.ones((B, 3)))
+    np.testing.assert_array_equal(ts2.observation['count'], np.full((B, 3), 2))
+
+  def testReuseBuffers(self):
+    env = self._get_env(reuse_buffers=True)
+    ts = env.reset()
+    ts2 = env.step(np.zeros(B, np.int32))
+    self.assertIs(ts.observation['count'], ts2.observation['count'])
+    np.testing.assert_array_equal(ts2.observation['count'], np.ones((B, 3)))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,59 @@
+"""Tests for the out-of-band experience serializer."""
+
+import numpy as np
+from absl.testing import absltest
+from liaison.distributed.exp_serializer import (get_deserializer,
+                                                get_frames_deserializer,
+                                                get_frames_serializer,
+                                                get_serializer)
+
+
+def _get_exp():
+  return ([dict(observation=dict(nodes=np.random.rand(100, 16).astype(np.float32),
+                                 n_node=np.int32(100)),
+                reward=np.zeros(8, dtype=np.float32),
+                step_type=None)], {
+                    'abc': np.arange(1000, dtype=np.int64),
+                    'tiny': np.ones(2, dtype=np.int8)
+                })
+
+
+class ExpSerializerTest(absltest.TestCase):
+
+  def _assert_equal(self, expected, actual):
+    exp_list, storage = expected
+    exp_list2, storage2 = actual
+    self.assertEqual(sorted(storage.keys()), sorted(storage2.keys()))
+    for k in storage:
+      np.testing.assert_array_equal(storage[k], storage2[k])
+    obs, obs2 = exp_list[0]['observation'], exp_list2[0]['observation']
+    np.testing.assert_array_equal(obs['nodes'], obs2['nodes'])
+    self.assertEqual(obs['n_node'], obs2['n_node'])
+    self.assertIsNone(exp_list2[0]['step_type'])
+
+  def testRoundTrip(self):
+    for compress in [True, False]:
+      exp = _get_exp()
+      buf = get_serializer(compress)(exp)
+      self._assert_equal(exp, get_deserializer(compress)(buf))
+
+  def testFramesRoundTrip(self):
+    for compress in [True, False]:
+      exp = _get_exp()
+      frames = get_frames_serializer(compress)(exp)
+      # header + pickle stream + one frame per array.
+      self.assertEqual(len(frames), 2 + 4)
+      self._assert_equal(exp, get_frames_deserializer()(frames))
+
+  def testNoCopyWithoutCompression(self):
+    exp = _get_exp()
+    frames = [bytes(f) for f in get_frames_serializer(False)(exp)]
+    _, storage = get_frames_deserializer()(frames)
+    arr = storage['abc']
+    # array should be a view into the received frame.
+    self.assertFalse(arr.flags.owndata)
+    self.assertFalse(arr.flags.writeable)
+
+
+if __name__ == '__main__':
+  absltest.main()
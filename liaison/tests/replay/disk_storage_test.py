@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+from absl.testing import absltest
+from liaison.replay.disk_storage import DiskStorage
+
+
+def _exp(i):
+  return dict(step=i, obs=np.full((64, 4), i, dtype=np.float32))
+
+
+class DiskStorageTest(absltest.TestCase):
+
+  def _storage(self, cache_size=0, compress=False):
+    return DiskStorage(self.create_tempdir().full_path,
+                       segment_bytes=4096,
+                       cache_size=cache_size,
+                       compress=compress)
+
+  def testRoundTrip(self):
+    for compress in [False, True]:
+      storage = self._storage(compress=compress)
+      handles = [storage.put(_exp(i)) for i in range(10)]
+      for i, handle in enumerate(handles):
+        exp = storage.get(handle)
+        self.assertEqual(exp['step'], i)
+        np.testing.assert_array_equal(exp['obs'], _exp(i)['obs'])
+
+  def testCache(self):
+    storage = self._storage(cache_size=2)
+    exp = _exp(0)
+    handle = storage.put(exp)
+    self.assertIs(storage.get(handle), exp)
+
+  def testCacheNbytes(self):
+    storage = self._storage(cache_size=2)
+    handles = [storage.put(_exp(i), nbytes=10) for i in range(3)]
+    # the first one is evicted from the cache.
+    self.assertEqual(storage.cache_nbytes, 20)
+    storage.get(handles[0])
+    storage.get(handles[0])
+    self.assertEqual(storage.cache_nbytes, 20)
+    for handle in handles:
+      storage.release(handle)
+    self.assertEqual(storage.cache_nbytes, 0)
+
+  def testSegmentsDroppedOnRelease(self):
+    storage = self._storage()
+    handles = [storage.put(_exp(i)) for i in range(10)]
+    dirname = storage._dirname
+    self.assertGreater(len(os.listdir(dirname)), 1)
+    self.assertGreater(storage.nbytes, 0)
+
+    for handle in handles[:-1]:
+      storage.release(handle)
+    # only the segment being written is left.
+    self.assertLen(os.listdir(dirname), 1)
+    np.testing.assert_array_equal(storage.get(handles[-1])['obs'], _exp(9)['obs'])
+    storage.release(handles[-1])
+    self.assertEqual(storage.nbytes, 0)
+
+  def testReadAfterDrop(self):
+    storage = self._storage()
+    handles = [storage.put(_exp(i)) for i in range(10)]
+    first = [h for h in handles if h.segment is handles[0].segment]
+    for handle in first:
+      storage.release(handle)
+    self.assertFalse(os.path.exists(handles[0].segment.fname))
+    # handles that are still around can be read after their segment is gone.
+    self.assertEqual(storage.get(handles[0])['step'], 0)
+
+  def testCompaction(self):
+    storage = self._storage()
+    dirname = storage._dirname
+    # one survivor per segment would keep every segment alive.
+    survivors = []
+    for i in range(200):
+      handle = storage.put(_exp(i))
+      if i % 20 == 0:
+        survivors.append((i, handle))
+      else:
+        storage.release(handle)
+    # the full segments are at least half live.
+    live_bytes = sum(handle.length for _, handle in survivors)
+    self.assertLessEqual(len(os.listdir(dirname)) - 1, 2 * live_bytes / 4096 + 1)
+    self.assertEqual(storage.nbytes, live_bytes)
+    for i, handle in survivors:
+      exp = storage.get(handle)
+      self.assertEqual(exp['step'], i)
+      np.testing.assert_array_equal(exp['obs'], _exp(i)['obs'])
+    for _, handle in survivors:
+      storage.release(handle)
+    self.assertLen(os.listdir(dirname), 1)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,57 @@
+import os
+
+from absl.testing import absltest
+from liaison.replay.k_times_sample_replay import Replay
+from liaison.utils import ConfigDict
+
+_LOCALHOST = 'localhost'
+SYMPH_COLLECTOR_FRONTEND_PORT = '6070'
+SYMPH_SAMPLER_FRONTEND_PORT = '6071'
+
+MEMORY_SIZE = 8
+K = 2
+EXP_NBYTES = 8
+
+
+class KTimesSampleReplayTest(absltest.TestCase):
+
+  def _get_replay(self):
+    os.environ.update(
+        dict(SYMPH_COLLECTOR_FRONTEND_PORT=SYMPH_COLLECTOR_FRONTEND_PORT,
+             SYMPH_SAMPLER_FRONTEND_PORT=SYMPH_SAMPLER_FRONTEND_PORT,
+             SYMPH_TENSORPLEX_SYSTEM_HOST=_LOCALHOST,
+             SYMPH_TENSORPLEX_SYSTEM_PORT='6072'))
+    return Replay(seed=42,
+                  max_times_sampled=K,
+                  evict_interval=None,
+                  compress_before_send=False,
+                  load_balanced=False,
+                  memory_size=MEMORY_SIZE,
+                  sampling_start_size=0,
+                  tensorboard_display=False,
+                  tensorplex_config=ConfigDict(serializer='pickle', deserializer='pickle'))
+
+  def testFifoStaysBounded(self):
+    replay = self._get_replay()
+    # the oldest are evicted when full.
+    for i in range(2 * MEMORY_SIZE):
+      replay._insert_wrapper(dict(i=i), EXP_NBYTES)
+    self.assertLen(replay, MEMORY_SIZE)
+    self.assertCountEqual([replay.load(item)['i'] for item in replay._items],
+                          range(MEMORY_SIZE, 2 * MEMORY_SIZE))
+    self.assertEqual(replay.memory_bytes, MEMORY_SIZE * EXP_NBYTES)
+
+    for i in range(100 * MEMORY_SIZE):
+      replay._insert_wrapper(dict(i=i), EXP_NBYTES)
+      # sampling keeps up, so experiences are mostly sampled out
+      # before they are evicted.
+      replay.sample(2)
+      self.assertLessEqual(len(replay._fifo), 2 * MEMORY_SIZE)
+      if replay._fifo:
+        self.assertIn(replay._fifo[0], replay._id_to_slot)
+      # evicted and sampled out experiences are released.
+      self.assertEqual(replay.memory_bytes, len(replay) * EXP_NBYTES)
+
+
+if __name__ == '__main__':
+  absltest.main()
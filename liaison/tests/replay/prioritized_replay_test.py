@@ -0,0 +1,89 @@
+"""Drives PrioritizedReplay shards through the priority update path."""
+
+import os
+import time
+
+import numpy as np
+from absl.testing import absltest
+from liaison.distributed.priority_sender import (IS_WEIGHT_KEY, REPLAY_KEY, PrioritySender)
+from liaison.replay import PrioritizedReplay
+from liaison.utils import ConfigDict
+
+_LOCALHOST = 'localhost'
+
+# shard i binds SYMPH_*_PORT + i
+SYMPH_COLLECTOR_FRONTEND_PORT = 6020
+SYMPH_SAMPLER_FRONTEND_PORT = 6025
+# shard 0 uses the plain service name. (see U.shard_service_name)
+SYMPH_PRIORITY_PORTS = dict(SYMPH_PRIORITY_PORT='6030', SYMPH_PRIORITY_1_PORT='6031')
+
+N_SHARDS = 2
+MEMORY_SIZE = 4
+
+
+class PrioritizedReplayTest(absltest.TestCase):
+
+  def _get_replay(self, index):
+    os.environ.update(
+        dict(SYMPH_COLLECTOR_FRONTEND_PORT=str(SYMPH_COLLECTOR_FRONTEND_PORT + index),
+             SYMPH_SAMPLER_FRONTEND_PORT=str(SYMPH_SAMPLER_FRONTEND_PORT + index),
+             **SYMPH_PRIORITY_PORTS,
+             SYMPH_TENSORPLEX_SYSTEM_HOST=_LOCALHOST,
+             SYMPH_TENSORPLEX_SYSTEM_PORT='6040'))
+    replay = PrioritizedReplay(seed=index,
+                               index=index,
+                               evict_interval=None,
+                               compress_before_send=False,
+                               load_balanced=False,
+                               memory_size=MEMORY_SIZE,
+                               sampling_start_size=0,
+                               tensorboard_display=False,
+                               tensorplex_config=ConfigDict(serializer='pickle',
+                                                            deserializer='pickle'))
+    for i in range(MEMORY_SIZE):
+      replay._insert_wrapper(dict(i=np.array([i])), 8)
+    replay.start_priority_thread()
+    return replay
+
+  def _sample_counts(self, replay):
+    exps = sum([replay.sample(MEMORY_SIZE) for _ in range(1000)], [])
+    return np.bincount([exp['i'][0] for exp in exps], minlength=MEMORY_SIZE)
+
+  def testUpdatesChangeSampling(self):
+    replays = [self._get_replay(index) for index in range(N_SHARDS)]
+    for replay in replays:
+      # inserted with the same priority.
+      self.assertTrue(np.all(self._sample_counts(replay) > 500))
+      for exp in replay.sample(MEMORY_SIZE):
+        self.assertAlmostEqual(exp[IS_WEIGHT_KEY], 1.)
+
+    # keys of all the shards go out in one update.
+    replay_keys = []
+    priorities = []
+    for index, replay in enumerate(replays):
+      for exp in sum([replay.sample(MEMORY_SIZE) for _ in range(10)], []):
+        replay_keys.append(exp[REPLAY_KEY])
+        # shard i favours experience i.
+        priorities.append(1. if exp['i'][0] == index else 0.)
+
+    sender = PrioritySender(host=_LOCALHOST,
+                            ports=list(SYMPH_PRIORITY_PORTS.values()),
+                            compress_before_send=False)
+    sender.send(replay_keys, priorities)
+
+    for index, replay in enumerate(replays):
+      deadline = time.time() + 10
+      while replay._tree.total > 2 and time.time() < deadline:
+        time.sleep(.01)
+      counts = self._sample_counts(replay)
+      self.assertGreater(counts[index], 3900)
+      # the favoured experience is down-weighted.
+      for _ in range(100):
+        weights = {exp['i'][0]: exp[IS_WEIGHT_KEY] for exp in replay.sample(MEMORY_SIZE)}
+        self.assertAlmostEqual(max(weights.values()), 1.)
+        if len(weights) > 1:
+          self.assertLess(weights.pop(index), min(weights.values()))
+
+
+if __name__ == '__main__':
+  absltest.main()
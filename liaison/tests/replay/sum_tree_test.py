@@ -0,0 +1,29 @@
+import numpy as np
+from absl.testing import absltest
+from liaison.replay.sum_tree import SumTree
+
+
+class SumTreeTest(absltest.TestCase):
+
+  def testTotal(self):
+    tree = SumTree(5)
+    tree.update([0, 1, 2], [1., 0., 3.])
+    self.assertEqual(tree.total, 4.)
+    tree.update([2], [1.])
+    self.assertEqual(tree.total, 2.)
+    np.testing.assert_array_equal(tree.get([0, 2]), [1., 1.])
+
+  def testSampleProportional(self):
+    tree = SumTree(5)
+    tree.update([0, 1, 2], [1., 0., 3.])
+    counts = np.bincount(tree.sample(40000, np.random.RandomState(42)), minlength=5)
+    np.testing.assert_allclose(counts / 40000., [.25, 0., .75, 0., 0.], atol=1e-2)
+
+  def testNeverSamplesEmptySlots(self):
+    tree = SumTree(7)
+    tree.update([3], [1e-8])
+    self.assertTrue(np.all(tree.sample(1000) == 3))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -26,6 +26,8 @@ def build_program(
     without_valid_and_test_evaluators=False,
     with_irs_proxy=False,
     irs_proxy_placement=None,
+    ps_n_shards=1,
+    replay_n_shards=1,
 ):
   learner = exp.new_process('learner')
   replay = exp.new_process('replay_worker-0')
@@ -67,6 +69,8 @@ def build_program(
       visualizers=visualizers,
       irs=irs,
       irs_proxy=irs_proxy,
+      ps_n_shards=ps_n_shards,
+      replay_n_shards=replay_n_shards,
   )
   for proc in [learner, replay, ps, irs, irs_proxy, visualizers] + actors + [evaluator]:
     if proc:
@@ -85,7 +89,9 @@ def setup_network(*,
                   evaluator=None,
                   visualizers=None,
                   irs=None,
-                  irs_proxy=None):
+                  irs_proxy=None,
+                  ps_n_shards=1,
+                  replay_n_shards=1):
   """
     Sets up the communication between surreal
     components using symphony
@@ -94,24 +100,39 @@ def setup_network(*,
         actors, (list): list of symphony processes
         ps, replay, learner, visualizers:
             symphony processes
+        ps_n_shards, replay_n_shards: every shard gets its own
+            ps-publishing, ps-serving and priority ports.
+            (see U.shard_service_name)
   """
+  ps_shards = range(ps_n_shards)
+  replay_shards = range(replay_n_shards)
+
   for proc in actors:
-    proc.connects('ps-serving')
+    for shard in ps_shards:
+      proc.connects(U.shard_service_name('ps-serving', shard))
+    proc.connects('ps-broadcast')
     proc.connects('collector-frontend')
 
   actors[0].binds('spec')
 
-  ps.binds('ps-publishing')
-  ps.binds('ps-serving')
+  for shard in ps_shards:
+    ps.binds(U.shard_service_name('ps-publishing', shard))
+    ps.binds(U.shard_service_name('ps-serving', shard))
+  ps.binds('ps-broadcast')
 
   replay.binds('collector-frontend')
   replay.binds('sampler-frontend')
   replay.binds('collector-backend')
   replay.binds('sampler-backend')
+  for shard in replay_shards:
+    replay.binds(U.shard_service_name('priority', shard))
 
   learner.connects('spec')
   learner.connects('sampler-frontend')
-  learner.binds('ps-publishing')
+  for shard in replay_shards:
+    learner.connects(U.shard_service_name('priority', shard))
+  for shard in ps_shards:
+    learner.binds(U.shard_service_name('ps-publishing', shard))
   learner.binds('prefetch-queue')
 
   irs.binds('tensorplex')
@@ -136,7 +157,8 @@ def setup_network(*,
     evaluator.connects('irs')
     if irs_proxy:
       evaluator.connects('irs-proxy')
-    evaluator.connects('ps-serving')
+    for shard in ps_shards:
+      evaluator.connects(U.shard_service_name('ps-serving', shard))
 
   if visualizers:
     visualizers.binds('visualizers-tb')
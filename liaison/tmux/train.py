@@ -18,6 +18,9 @@ WHITELIST_NODES = list(set((IRS_NODE, IRS_PROXY_NODE, VISUALIZER_NODE)))
 parser = argon.ArgumentParser('Liaison trainer', add_help=False)
 parser.add_argument('--n_actors', type=int, default=1)
 parser.add_argument('--bundle_actors', action='store_true')
+# have to match session_config ps.n_shards and replay.n_shards.
+parser.add_argument('--ps_n_shards', type=int, default=1)
+parser.add_argument('--replay_n_shards', type=int, default=1)
 parser.add_config_file(name='cluster', default='ccc/config.py')
 parser.add_config_file(name='resource_req', default='liaison/configs/resource_req.py')
 parser.add_argument('--spy_measurement_interval', type=float, default=2.)
@@ -107,7 +110,9 @@ def train(argv):
         with_evaluators=(not args.without_evaluators),
         without_valid_and_test_evaluators=args.without_valid_and_test_evaluators,
         with_irs_proxy=args.use_irs_proxy,
-        irs_proxy_placement=IRS_PROXY_NODE)
+        irs_proxy_placement=IRS_PROXY_NODE,
+        ps_n_shards=args.ps_n_shards,
+        replay_n_shards=args.replay_n_shards)
 
     exp_flag = ['--work_id', str(work_id)]
     exp_flag += ['--hyper_configs', str(shlex.quote(json.dumps(params)))]
@@ -30,3 +30,25 @@ def local_run_cmd(cmd):
 def get_public_ip():
   """Returns the public ip of the local machine."""
   return local_run_cmd('curl ifconfig.me').rstrip('\n')
+
+
+def shard_service_name(service, shard):
+  """Name of the symphony service for the given shard.
+  Shard 0 keeps the plain name so that unsharded setups are unaffected."""
+  if shard == 0:
+    return service
+  return '{}-{}'.format(service, shard)
+
+
+def _service_env_var(service, field):
+  return 'SYMPH_{}_{}'.format(service.upper().replace('-', '_'), field)
+
+
+def get_service_host(service, shard=0):
+  """Host of the service allocated by symphony (see create_programs)."""
+  return os.environ[_service_env_var(shard_service_name(service, shard), 'HOST')]
+
+
+def get_service_port(service, shard=0):
+  """Port of the service allocated by symphony (see create_programs)."""
+  return os.environ[_service_env_var(shard_service_name(service, shard), 'PORT')]